@@ -8,6 +8,7 @@
 # produced by NS_FormatCodeAddress(), which on Linux often lack a function
 # name, a file name and a line number.
 
+import collections
 import subprocess
 import sys
 import re
@@ -242,35 +243,132 @@ def address_adjustment_for(file):
     return adjustment
 
 
+def build_id_for(file):
+    """
+    Return the hexadecimal build id from the .note.gnu.build-id section
+    of file or None if it does not have one.
+    """
+    note = elf_section(file, ".note.gnu.build-id")
+    if note is None or len(note) <= 16:
+        return None
+    # Skip the note's name size, description size, type and name.
+    return "".join(map(lambda ch: "%02x" % ord(ch), note[16:]))
+
+
+# file --> ((size, mtime), build id or file, debug file, address adjustment)
+elf_info = {}
+
+def elf_info_for(file):
+    """
+    Return (key, debug_file, address_adjustment) for file where key
+    identifies the build of the file. The results of running readelf
+    and objdump are cached until the file changes.
+    """
+    st = os.stat(file)
+    stamp = (st.st_size, st.st_mtime)
+    if file in elf_info and elf_info[file][0] == stamp:
+        return elf_info[file][1:]
+    key = build_id_for(file) or "%s:%d:%d" % (file, st.st_size, st.st_mtime)
+    debug_file = separate_debug_file_for(file) or file
+    address_adjustment = address_adjustment_for(file)
+    elf_info[file] = (stamp, key, debug_file, address_adjustment)
+    return (key, debug_file, address_adjustment)
+
+
 devnull = open(os.devnull)
-file_stuff = {}
 
-def addressToSymbol(file, address):
-    if not file in file_stuff:
-        debug_file = separate_debug_file_for(file) or file
-
-        # Start an addr2line process for this file. Note that addr2line
-        # sometimes prints error messages, which we want to suppress.
-        args = ['/usr/bin/addr2line', '-C', '-f', '-e', debug_file]
-        addr2line = subprocess.Popen(args, stdin=subprocess.PIPE,
-                                     stdout=subprocess.PIPE,
-                                     stderr=devnull)
-        address_adjustment = address_adjustment_for(file)
-        cache = {}
-        file_stuff[file] = (addr2line, address_adjustment, cache)
-    else:
-        (addr2line, address_adjustment, cache) = file_stuff[file]
+class Addr2linePool:
+    """
+    Long lived addr2line processes, one per debug file, which are fed
+    addresses over pipes. At most maxprocs processes are kept and the
+    least recently used one is closed when another is needed.
+    """
+    # Number of addresses written before reading their results. This
+    # keeps the input well within the pipe's buffer so that neither
+    # process can block the other.
+    chunk_size = 256
 
-    if address in cache:
-        return cache[address]
+    def __init__(self, maxprocs=32):
+        self.maxprocs = maxprocs
+        self.procs = collections.OrderedDict()
 
-    # For each line of input, addr2line produces two lines of output.
-    addr2line.stdin.write(hex(int(address, 16) + address_adjustment) + '\n')
-    addr2line.stdin.flush()
-    result = (addr2line.stdout.readline().rstrip("\r\n"), \
-              addr2line.stdout.readline().rstrip("\r\n"))
-    cache[address] = result
-    return result
+    def get(self, debug_file):
+        addr2line = self.procs.pop(debug_file, None)
+        if addr2line is None:
+            while len(self.procs) >= self.maxprocs:
+                self.close_process(self.procs.popitem(last=False)[1])
+            # Note that addr2line sometimes prints error messages, which
+            # we want to suppress.
+            args = ['/usr/bin/addr2line', '-C', '-f', '-e', debug_file]
+            addr2line = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=devnull)
+        self.procs[debug_file] = addr2line
+        return addr2line
+
+    def lookup(self, debug_file, addresses):
+        """
+        Return a list of (name, fileline) for the integer addresses.
+        """
+        addr2line = self.get(debug_file)
+        results = []
+        for start in range(0, len(addresses), self.chunk_size):
+            chunk = addresses[start:start + self.chunk_size]
+            addr2line.stdin.write(''.join(['0x%x\n' % address for address in chunk]))
+            addr2line.stdin.flush()
+            # For each line of input, addr2line produces two lines of output.
+            for address in chunk:
+                results.append((addr2line.stdout.readline().rstrip("\r\n"),
+                                addr2line.stdout.readline().rstrip("\r\n")))
+        return results
+
+    def close_process(self, addr2line):
+        addr2line.stdin.close()
+        addr2line.wait()
+
+    def close(self):
+        while self.procs:
+            self.close_process(self.procs.popitem()[1])
+
+addr2line_pool = Addr2linePool()
+
+# (build id, address) --> (name, fileline), least recently used first.
+symbol_cache = collections.OrderedDict()
+symbol_cache_size = 100000
+
+def addressesToSymbols(file, addresses):
+    """
+    Return a list of (name, fileline) for the hexadecimal address
+    strings in file.
+    """
+    (key, debug_file, address_adjustment) = elf_info_for(file)
+    keys = [(key, int(address, 16) + address_adjustment) for address in addresses]
+
+    results = {}
+    missing = []
+    for k in keys:
+        if k in results:
+            continue
+        result = symbol_cache.pop(k, None)
+        if result is None:
+            missing.append(k)
+            results[k] = None
+        else:
+            symbol_cache[k] = result
+            results[k] = result
+
+    if missing:
+        found = addr2line_pool.lookup(debug_file, [k[1] for k in missing])
+        for k, result in zip(missing, found):
+            results[k] = result
+            symbol_cache[k] = result
+        while len(symbol_cache) > symbol_cache_size:
+            symbol_cache.popitem(last=False)
+
+    return [results[k] for k in keys]
+
+def addressToSymbol(file, address):
+    return addressesToSymbols(file, [address])[0]
 
 # Matches lines produced by NS_FormatCodeAddress().
 line_re = re.compile("^(.*#\d+: )(.+)\[(.+) \+(0x[0-9A-Fa-f]+)\](.*)$")
@@ -281,22 +379,77 @@ def fixSymbols(line):
         (before, fn, file, address, after) = result.groups()
 
         if os.path.exists(file) and os.path.isfile(file):
-            (name, fileline) = addressToSymbol(file, address)
-
-            # If addr2line gave us something useless, keep what we had before.
-            if name == "??":
-                name = fn
-            if fileline == "??:0" or fileline == "??:?":
-                fileline = file
-
-            nl = '\n' if line[-1] == '\n' else ''
-            return "%s%s (%s)%s%s" % (before, name, fileline, after, nl)
+            return formatSymbol(line, before, fn, file, after, addressToSymbol(file, address))
         else:
             sys.stderr.write("Warning: File \"" + file + "\" does not exist.\n")
             return line
     else:
         return line
 
+def formatSymbol(line, before, fn, file, after, symbol):
+    (name, fileline) = symbol
+
+    # If addr2line gave us something useless, keep what we had before.
+    if name == "??":
+        name = fn
+    if fileline == "??:0" or fileline == "??:?":
+        fileline = file
+
+    nl = '\n' if line[-1] == '\n' else ''
+    return "%s%s (%s)%s%s" % (before, name, fileline, after, nl)
+
+def fixSymbolsInLines(lines):
+    """
+    Return the fixed lines of a whole log. The frames are grouped by
+    file so that each file's addresses are resolved in one batch.
+    """
+    lines = list(lines)
+    frames = collections.defaultdict(list)
+    for i, line in enumerate(lines):
+        result = line_re.match(line)
+        if result is not None:
+            (before, fn, file, address, after) = result.groups()
+            if os.path.exists(file) and os.path.isfile(file):
+                frames[file].append((i, before, fn, address, after))
+            else:
+                sys.stderr.write("Warning: File \"" + file + "\" does not exist.\n")
+
+    for file, fileFrames in frames.iteritems():
+        symbols = addressesToSymbols(file, [frame[3] for frame in fileFrames])
+        for (i, before, fn, address, after), symbol in zip(fileFrames, symbols):
+            lines[i] = formatSymbol(lines[i], before, fn, file, after, symbol)
+    return lines
+
+# The maximum number of lines fixSymbolsInWindows holds at once.
+SYMBOL_WINDOW_SIZE = 10000
+
+def fixSymbolsInWindows(lines, windowSize=SYMBOL_WINDOW_SIZE):
+    """
+    Generate the fixed lines of lines, an iterable which may be a file,
+    without holding the whole log. Lines are collected into a window
+    while they contain frames and the window is fixed with
+    fixSymbolsInLines at the end of each stack or once it holds
+    windowSize lines. Other lines are passed through as they are read.
+    """
+    window = []
+    for line in lines:
+        isFrame = line_re.match(line) is not None
+        if isFrame:
+            window.append(line)
+        if window and (not isFrame or len(window) >= windowSize):
+            for fixed in fixSymbolsInLines(window):
+                yield fixed
+            window = []
+        if not isFrame:
+            yield line
+    if window:
+        for fixed in fixSymbolsInLines(window):
+            yield fixed
+
 if __name__ == "__main__":
-    for line in sys.stdin:
-        sys.stdout.write(fixSymbols(line))
+    # readline rather than iterating over stdin so that each line is
+    # written as soon as it can be fixed.
+    for line in fixSymbolsInWindows(iter(sys.stdin.readline, '')):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+    addr2line_pool.close()
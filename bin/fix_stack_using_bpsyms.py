@@ -13,8 +13,19 @@ from __future__ import with_statement
 import sys
 import os
 import re
+import socket
 import subprocess
+import time
+import array
 import bisect
+import collections
+import itertools
+import json
+import mmap
+import operator
+import struct
+import tempfile
+import threading
 
 here = os.path.dirname(__file__)
 
@@ -35,11 +46,23 @@ def prettyFileName(name):
 
 
 class SymbolFile:
+    """The symbols of a breakpad .sym file held in parallel arrays sorted by
+    address. Symbol names are only formatted when an address is resolved."""
     def __init__(self, fn):
-        addrs = []  # list of addresses, which will be sorted once we're done initializing
-        funcs = {}  # hash: address --> (function name + possible file/line)
-        # hash: filenum (string) --> prettified filename ready to have a line number appended
-        files = {}
+        addrs = array.array('L')  # addresses in file order, sorted once we're done initializing
+        nameidxs = array.array('l')  # index into names of the record's function
+        lines = array.array('l')  # line number of a line record, -1 for FUNC and PUBLIC
+        fileidxs = array.array('l')  # index into files of a line record's file
+        names = []  # function and public names
+        # prettified filenames ready to have a line number appended
+        files = []
+        # hash: filenum (string) --> index into files
+        filenums = {}
+        # Bind the append methods once since they are called for every record.
+        addrsAppend = addrs.append
+        nameidxsAppend = nameidxs.append
+        linesAppend = lines.append
+        fileidxsAppend = fileidxs.append
         with open(fn) as f:
             for line in f:
                 line = line.rstrip()
@@ -51,43 +74,251 @@ class SymbolFile:
                     if len(bits) < 5:
                         bits.append('unnamed_function')
                     (junk, rva, size, ss, name) = bits
-                    rva = int(rva, 16)
-                    funcs[rva] = name
-                    addrs.append(rva)
-                    lastFuncName = name
+                    lastFuncIndex = len(names)
+                    names.append(name)
+                    addrsAppend(int(rva, 16))
+                    nameidxsAppend(lastFuncIndex)
+                    linesAppend(-1)
+                    fileidxsAppend(-1)
                 elif line.startswith("PUBLIC "):
                     # PUBLIC [<multiple>] <address> <stack_param_size> <name>
                     line = line.replace("PUBLIC m ", "PUBLIC ")  # Ignore the multiple marker
                     (junk, rva, ss, name) = line.split(None, 3)
-                    rva = int(rva, 16)
-                    funcs[rva] = name
-                    addrs.append(rva)
+                    nameidxsAppend(len(names))
+                    names.append(name)
+                    addrsAppend(int(rva, 16))
+                    linesAppend(-1)
+                    fileidxsAppend(-1)
                 elif line.startswith("FILE "):
                     # FILE <number> <name>
                     (junk, filenum, name) = line.split(None, 2)
-                    files[filenum] = prettyFileName(name)
+                    filenums[filenum] = len(files)
+                    files.append(prettyFileName(name))
                 elif line[0] in "0123456789abcdef":
                     # This is one of the "line records" corresponding to the last FUNC record
                     # <address> <size> <line> <filenum>
                     (rva, size, line, filenum) = line.split(None)
-                    rva = int(rva, 16)
-                    file = files[filenum]
-                    name = lastFuncName + " [" + file + line + "]"
-                    funcs[rva] = name
-                    addrs.append(rva)
+                    fileidxsAppend(filenums[filenum])
+                    addrsAppend(int(rva, 16))
+                    nameidxsAppend(lastFuncIndex)
+                    linesAppend(int(line))
                 # skip everything else
-        # print "Loaded %d functions from symbol file %s" % (len(funcs), os.path.basename(fn))
-        self.addrs = sorted(addrs)
-        self.funcs = funcs
+        # print "Loaded %d functions from symbol file %s" % (len(names), os.path.basename(fn))
+
+        # Sort the records by address. When several records share an
+        # address the last one in the file wins. The records are usually
+        # already sorted apart from the PUBLIC records.
+        if not all(itertools.imap(operator.le, addrs, itertools.islice(addrs, 1, None))):
+            # A stable sort keeps records which share an address in file order.
+            order = sorted(xrange(len(addrs)), key=addrs.__getitem__)
+            addrs = array.array('L', map(addrs.__getitem__, order))
+            nameidxs = array.array('l', map(nameidxs.__getitem__, order))
+            lines = array.array('l', map(lines.__getitem__, order))
+            fileidxs = array.array('l', map(fileidxs.__getitem__, order))
+            del order
+        duplicates = list(itertools.compress(itertools.count(),
+                                             itertools.imap(operator.eq, addrs,
+                                                            itertools.islice(addrs, 1, None))))
+        for k in reversed(duplicates):
+            nameidxs[k] = nameidxs[k + 1]
+            lines[k] = lines[k + 1]
+            fileidxs[k] = fileidxs[k + 1]
+        self.addrs = addrs
+        self.nameidxs = nameidxs
+        self.lines = lines
+        self.fileidxs = fileidxs
+        self.names = names
+        self.files = files
+        # Approximate memory used by the parsed symbols.
+        self.nbytes = (4 * len(addrs) * addrs.itemsize +
+                       sys.getsizeof(names) + sum(sys.getsizeof(name) for name in names) +
+                       sys.getsizeof(files) + sum(sys.getsizeof(name) for name in files))
+
+    def symbolAt(self, i):
+        name = self.names[self.nameidxs[i]]
+        line = self.lines[i]
+        if line < 0:
+            return name
+        return name + " [" + self.files[self.fileidxs[i]] + str(line) + "]"
 
     def addrToSymbol(self, address):
         i = bisect.bisect(self.addrs, address) - 1
         if i > 0:
             # offset = address - self.addrs[i]
-            return self.funcs[self.addrs[i]]
+            return self.symbolAt(i)
+        else:
+            return ""
+
+    def addrsToSymbols(self, addresses):
+        """Resolve a list of addresses such as a whole stack in one call.
+        The addresses are searched in sorted order so that each search
+        starts where the previous one ended."""
+        symbols = {}
+        lo = 0
+        for address in sorted(set(addresses)):
+            lo = bisect.bisect(self.addrs, address, lo)
+            i = lo - 1
+            if i > 0:
+                symbols[address] = self.symbolAt(i)
+            else:
+                symbols[address] = ""
+        return [symbols[address] for address in addresses]
+
+
+# The compiled symbol index is written next to the .sym file as
+# <name>.sym.idx. It contains a header, the sorted addresses as
+# little endian 64 bit integers, the offset of each address's name in
+# the string table as 32 bit integers and the string table of nul
+# terminated names.
+SYMBOL_INDEX_MAGIC = 'BPSYMIX1'
+SYMBOL_INDEX_HEADER = struct.Struct('<8sQ')
+SYMBOL_INDEX_ADDRESS = struct.Struct('<Q')
+SYMBOL_INDEX_OFFSET = struct.Struct('<I')
+
+
+def symbolIndexPath(fn):
+    return fn + '.idx'
+
+
+def writeIndexArray(f, values, itemsize):
+    """Write the integers values to f as little endian unsigned itemsize
+    byte integers. The values are copied into an array and written with
+    tofile rather than passed to struct.pack as millions of arguments."""
+    for typecode in ('I', 'L'):
+        if array.array(typecode).itemsize == itemsize:
+            a = array.array(typecode, values)
+            break
+    else:
+        # There is no 8 byte array type where long is 4 bytes, as on
+        # Windows, so write each value as its low then high 4 bytes.
+        a = array.array('I', itertools.chain.from_iterable(
+            (value & 0xffffffff, value >> 32) for value in values))
+    if sys.byteorder == 'big':
+        a.byteswap()
+    a.tofile(f)
+
+
+def compileSymbolFile(fn):
+    """Compile the .sym file fn into a binary symbol index and return the
+    path of the index."""
+    symfile = SymbolFile(fn)
+    addrs = symfile.addrs
+
+    strtab = []
+    stroffsets = {}
+    strsize = 0
+    offsets = array.array('L')
+    for i in xrange(len(addrs)):
+        name = symfile.symbolAt(i)
+        offset = stroffsets.get(name)
+        if offset is None:
+            offset = stroffsets[name] = strsize
+            strtab.append(name + '\0')
+            strsize += len(name) + 1
+        offsets.append(offset)
+
+    indexfn = symbolIndexPath(fn)
+    tmpfn = '%s.%d.tmp' % (indexfn, os.getpid())
+    with open(tmpfn, 'wb') as f:
+        f.write(SYMBOL_INDEX_HEADER.pack(SYMBOL_INDEX_MAGIC, len(addrs)))
+        writeIndexArray(f, addrs, SYMBOL_INDEX_ADDRESS.size)
+        writeIndexArray(f, offsets, SYMBOL_INDEX_OFFSET.size)
+        f.write(''.join(strtab))
+    # Rename so that a reader never sees a partially written index.
+    os.rename(tmpfn, indexfn)
+    return indexfn
+
+
+def compileSymbolsDir(symbolsDir):
+    """Compile every .sym file below symbolsDir which does not already have
+    an up to date index. Returns the number of files compiled."""
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(symbolsDir):
+        for filename in filenames:
+            if filename.endswith('.sym'):
+                fn = os.path.join(dirpath, filename)
+                if not isSymbolIndexCurrent(fn):
+                    compileSymbolFile(fn)
+                    count += 1
+    return count
+
+
+def isSymbolIndexCurrent(fn):
+    indexfn = symbolIndexPath(fn)
+    try:
+        return os.path.getmtime(indexfn) >= os.path.getmtime(fn)
+    except OSError:
+        return False
+
+
+class SymbolIndex:
+    """A compiled symbol index mapped into memory. Lookups are a binary
+    search of the mapped address array."""
+    def __init__(self, fn):
+        with open(fn, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.count) = SYMBOL_INDEX_HEADER.unpack_from(self.map, 0)
+        if magic != SYMBOL_INDEX_MAGIC:
+            self.map.close()
+            raise Exception("Invalid symbol index " + fn)
+        self.addrsStart = SYMBOL_INDEX_HEADER.size
+        self.offsetsStart = self.addrsStart + self.count * SYMBOL_INDEX_ADDRESS.size
+        self.strtabStart = self.offsetsStart + self.count * SYMBOL_INDEX_OFFSET.size
+        self.nbytes = len(self.map)
+
+    def addrAt(self, i):
+        return SYMBOL_INDEX_ADDRESS.unpack_from(self.map, self.addrsStart + i * SYMBOL_INDEX_ADDRESS.size)[0]
+
+    def nameAt(self, i):
+        start = self.strtabStart + SYMBOL_INDEX_OFFSET.unpack_from(
+            self.map, self.offsetsStart + i * SYMBOL_INDEX_OFFSET.size)[0]
+        return self.map[start:self.map.find('\0', start)]
+
+    def bisect(self, address, lo=0):
+        # Equivalent to bisect.bisect on the address array.
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if address < self.addrAt(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def addrToSymbol(self, address):
+        i = self.bisect(address) - 1
+        if i > 0:
+            return self.nameAt(i)
         else:
             return ""
 
+    def addrsToSymbols(self, addresses):
+        """Resolve a list of addresses in one call. See
+        SymbolFile.addrsToSymbols."""
+        symbols = {}
+        lo = 0
+        for address in sorted(set(addresses)):
+            lo = self.bisect(address, lo)
+            i = lo - 1
+            if i > 0:
+                symbols[address] = self.nameAt(i)
+            else:
+                symbols[address] = ""
+        return [symbols[address] for address in addresses]
+
+
+def loadSymbolFile(fn):
+    """Return a SymbolIndex for fn if it has an up to date compiled index,
+    otherwise parse the .sym file."""
+    if isSymbolIndexCurrent(fn):
+        try:
+            return SymbolIndex(symbolIndexPath(fn))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            pass
+    return SymbolFile(fn)
+
 
 def get_fileid():
     """Attempts to determine if fileid is found on PATH.
@@ -111,8 +342,9 @@ def get_fileid():
             pass
     return None
 
-def findIdForPath(path):
-    """Finds the breakpad id for the object file at the given path."""
+def findFileidExecutable():
+    """Returns the fileid executable to use or raises an Exception if it
+    can not be found."""
     # We should always be packaged with a "fileid" executable.
     fileid_exe = get_fileid()
     if not fileid_exe:
@@ -122,13 +354,82 @@ def findIdForPath(path):
             fileid_exe = fileid_exe + '.exe'
             if not os.path.isfile(fileid_exe):
                 raise Exception("Could not find fileid executable in %s" % here)
+    return fileid_exe
+
+
+class FileIdCache:
+    """A cache of the fileid executable and of the breakpad id of each
+    object file, keyed by path, size and mtime, which is saved to path so
+    that it persists across runs and is shared by the workers on a host."""
+    def __init__(self, path):
+        self.path = path
+        self.loaded = False
+        self.fileid_exe = None
+        self.ids = {}  # path --> [size, mtime, id]
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return (data.get('fileid'), data.get('ids', {}))
+        except (IOError, OSError, ValueError, AttributeError):
+            return (None, {})
+
+    def load(self):
+        if not self.loaded:
+            (self.fileid_exe, self.ids) = self.read()
+            self.loaded = True
+
+    def save(self):
+        # Merge with the entries saved by other processes since we loaded.
+        (fileid_exe, ids) = self.read()
+        ids.update(self.ids)
+        self.ids = ids
+        # The symbol server looks up ids from several threads.
+        tmppath = '%s.%d.%d.tmp' % (self.path, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(tmppath, 'w') as f:
+                json.dump({'fileid': self.fileid_exe, 'ids': ids}, f)
+            os.rename(tmppath, self.path)
+        except (IOError, OSError):
+            pass
+
+    def getExecutable(self):
+        self.load()
+        if not self.fileid_exe:
+            self.fileid_exe = findFileidExecutable()
+            self.save()
+        return self.fileid_exe
 
+    def getId(self, path):
+        self.load()
+        st = os.stat(path)
+        entry = self.ids.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            return entry[2].encode('latin-1')
+        try:
+            fileid = subprocess.check_output([self.getExecutable(), path]).rstrip()
+        except OSError:
+            # The saved fileid executable no longer exists.
+            self.fileid_exe = None
+            fileid = subprocess.check_output([self.getExecutable(), path]).rstrip()
+        self.ids[path] = [st.st_size, st.st_mtime, fileid]
+        self.save()
+        return fileid
+
+
+fileIdCache = FileIdCache(os.environ.get('SISYPHUS_FILEID_CACHE',
+                                         os.path.join(tempfile.gettempdir(), 'sisyphus-fileid-cache.json')))
+
+
+def findIdForPath(path):
+    """Finds the breakpad id for the object file at the given path."""
     if not os.path.isfile(path):
         for suffix in ('.exe', '.dll'):
             if os.path.isfile(path + suffix):
                 path = path + suffix
     try:
-        return subprocess.check_output([fileid_exe, path]).rstrip()
+        return fileIdCache.getId(path)
     except subprocess.CalledProcessError as e:
         raise Exception("Error getting fileid for %s: %s" %
                         (path, e.output))
@@ -154,21 +455,113 @@ def guessSymbolFile(full_path, symbolsDir):
     return os.path.join(d1, uuid, fn + ".sym")
 
 
-parsedSymbolFiles = {}
+class SymbolCache:
+    """A cache of loaded symbol files keyed by (build id, module debug id)
+    which evicts the least recently used modules once the memory used by
+    the loaded symbols exceeds maxbytes. Entries are kept across tests on
+    the same build and are dropped when reset is called for a new build.
+    The build id passed to reset must differ for each build, such as one
+    including the build date, so that a module loaded for the previous
+    build while reset was called is not cached for the new one.
+
+    get may be called from several threads. lock is only held while the
+    dicts are read or updated. A missing module is found and loaded
+    under a lock for that module alone so that lookups of other modules
+    are not blocked while it loads, and the lookups in the returned
+    symbol file need no lock."""
+    def __init__(self, maxbytes=512 * 1024 * 1024):
+        self.maxbytes = maxbytes
+        self.build_id = None
+        self.entries = collections.OrderedDict()  # (build id, debug id) --> symbol file
+        self.symfiles = {}  # (object file, symbols dir) --> .sym path or None
+        self.loading = {}  # (object file, symbols dir) --> lock held while loading
+        # Whether to check that a previously found .sym file still exists.
+        self.verifyPaths = False
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def reset(self, build_id=None):
+        """Drop all entries and use build_id for subsequent entries."""
+        with self.lock:
+            self.build_id = build_id
+            self.entries.clear()
+            self.symfiles.clear()
+            self.bytes = 0
+
+    def lookup(self, pathkey):
+        """Return (True, symbol file or None) if the module of pathkey
+        is cached, otherwise (False, None). Called with lock held."""
+        if pathkey not in self.symfiles:
+            return (False, None)
+        symfile = self.symfiles[pathkey]
+        if not symfile:
+            return (True, None)
+        if self.verifyPaths and not os.path.exists(symfile):
+            return (False, None)
+        # Symbol files are stored as <name>/<debug id>/<name>.sym
+        key = (self.build_id, os.path.basename(os.path.dirname(symfile)))
+        p = self.entries.pop(key, None)
+        if p is None:
+            return (False, None)
+        self.hits += 1
+        self.entries[key] = p
+        return (True, p)
+
+    def get(self, file, symbolsDir):
+        pathkey = (file, symbolsDir)
+        with self.lock:
+            (found, p) = self.lookup(pathkey)
+            if found:
+                return p
+            loadlock = self.loading.setdefault(pathkey, threading.Lock())
+
+        with loadlock:
+            # Another thread may have loaded the module while we waited.
+            with self.lock:
+                (found, p) = self.lookup(pathkey)
+                if found:
+                    return p
+                build_id = self.build_id
+            try:
+                symfile = guessSymbolFile(file, symbolsDir)
+                if symfile:
+                    p = loadSymbolFile(symfile)
+            except:
+                with self.lock:
+                    self.loading.pop(pathkey, None)
+                raise
+            with self.lock:
+                self.loading.pop(pathkey, None)
+                self.symfiles[pathkey] = symfile
+                if not symfile or build_id != self.build_id:
+                    return p
+                self.misses += 1
+                key = (build_id, os.path.basename(os.path.dirname(symfile)))
+                oldp = self.entries.pop(key, None)
+                if oldp is not None:
+                    self.bytes -= oldp.nbytes
+                self.entries[key] = p
+                self.bytes += p.nbytes
+                while self.bytes > self.maxbytes and len(self.entries) > 1:
+                    (oldkey, oldp) = self.entries.popitem(last=False)
+                    self.bytes -= oldp.nbytes
+                    self.evictions += 1
+            return p
+
+    def stats(self):
+        with self.lock:
+            return ('symbol cache: %d modules, %d bytes, %d hits, %d misses, %d evictions' %
+                    (len(self.entries), self.bytes, self.hits, self.misses, self.evictions))
+
+
+symbolCache = SymbolCache()
 
 
 def getSymbolFile(file, symbolsDir):
-    p = None
-    if file not in parsedSymbolFiles:
-        symfile = guessSymbolFile(file, symbolsDir)
-        if symfile:
-            p = SymbolFile(symfile)
-        else:
-            p = None
-        parsedSymbolFiles[file] = p
-    else:
-        p = parsedSymbolFiles[file]
-    return p
+    return symbolCache.get(file, symbolsDir)
 
 
 def addressToSymbol(file, address, symbolsDir):
@@ -183,20 +576,142 @@ def addressToSymbol(file, address, symbolsDir):
 line_re = re.compile("^(.*#\d+: )(.+)\[(.+) \+(0x[0-9A-Fa-f]+)\](.*)$")
 
 
+# The Unix socket of the host local symbol server, see symbol_server.py.
+SYMBOL_SERVER_SOCKET = os.environ.get('SISYPHUS_SYMBOL_SOCKET', '/tmp/sisyphus-symbol-server.sock')
+SYMBOL_SERVER_TIMEOUT = 300
+# Seconds to wait before trying the server again after it was unavailable.
+SYMBOL_SERVER_RETRY_INTERVAL = 60
+symbolServerRetryTime = 0
+
+
+def serverAddrsToSymbols(modules, symbolsDir):
+    """Ask the symbol server to resolve modules, a dict of module file -->
+    list of addresses. Returns the server's response or None if the
+    server is not running."""
+    global symbolServerRetryTime
+
+    if not hasattr(socket, 'AF_UNIX') or time.time() < symbolServerRetryTime:
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(SYMBOL_SERVER_TIMEOUT)
+        sock.connect(SYMBOL_SERVER_SOCKET)
+        stream = sock.makefile('rwb')
+        stream.write(json.dumps({'symbolsDir': symbolsDir, 'modules': modules},
+                                encoding='latin-1') + '\n')
+        stream.flush()
+        response = json.loads(stream.readline())
+        stream.close()
+    except (socket.error, ValueError):
+        symbolServerRetryTime = time.time() + SYMBOL_SERVER_RETRY_INTERVAL
+        return None
+    finally:
+        sock.close()
+    symbols = {}
+    for file, names in response['symbols'].iteritems():
+        symbols[file.encode('latin-1')] = [name.encode('latin-1') for name in names]
+    errors = {}
+    for file, message in response['errors'].iteritems():
+        errors[file.encode('latin-1')] = message.encode('latin-1')
+    return {'symbols': symbols, 'errors': errors}
+
+
 def fixSymbols(line, symbolsDir):
-    result = line_re.match(line)
-    if result is not None:
-        (before, fn, file, address, after) = result.groups()
-        address = int(address, 16)
-        symbol = addressToSymbol(file, address, symbolsDir)
-        if not symbol:
-            symbol = "%s + 0x%x" % (os.path.basename(file), address)
-        return before + symbol + after + "\n"
-    else:
-        return line
+    return fixSymbolsInLines([line], symbolsDir)[0]
+
+
+def fixSymbolsInLines(lines, symbolsDir, errors=None):
+    """Symbolicate a whole log in two passes and return the list of fixed
+    lines. The first pass finds the lines containing frames and groups
+    their addresses by module. The second resolves each module's
+    addresses in one batch, using the symbol server if it is running,
+    and rewrites only the lines with frames.
+
+    If errors is a list, the exception raised while resolving a module
+    is appended to it and that module's lines are left unchanged,
+    otherwise the exception is raised."""
+    lines = list(lines)
+
+    # module file --> list of (line index, before, address, after)
+    frames = collections.defaultdict(list)
+    for i, line in enumerate(lines):
+        # Cheap test for the literals line_re requires before matching.
+        if ' +0x' not in line or '#' not in line:
+            continue
+        result = line_re.match(line)
+        if result is not None:
+            (before, fn, file, address, after) = result.groups()
+            frames[file].append((i, before, int(address, 16), after))
+
+    modules = {}
+    for file, moduleFrames in frames.iteritems():
+        modules[file] = [address for (i, before, address, after) in moduleFrames]
+
+    # Use the symbol server if it is running, otherwise the symbols are
+    # loaded in this process.
+    response = None
+    if modules:
+        response = serverAddrsToSymbols(modules, symbolsDir)
+
+    for file, moduleFrames in frames.iteritems():
+        try:
+            if response is not None:
+                if file in response['errors']:
+                    raise Exception(response['errors'][file])
+                symbols = response['symbols'][file]
+            else:
+                p = getSymbolFile(file, symbolsDir)
+                if p:
+                    symbols = p.addrsToSymbols(modules[file])
+                else:
+                    symbols = [""] * len(modules[file])
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append(e)
+            continue
+        basename = os.path.basename(file)
+        for (i, before, address, after), symbol in itertools.izip(moduleFrames, symbols):
+            if not symbol:
+                symbol = "%s + 0x%x" % (basename, address)
+            lines[i] = before + symbol + after + "\n"
+
+    return lines
+
+
+# The maximum number of lines fixSymbolsInWindows holds at once.
+SYMBOL_WINDOW_SIZE = 10000
+
+
+def fixSymbolsInWindows(lines, symbolsDir, errors=None, windowSize=SYMBOL_WINDOW_SIZE):
+    """Generate the symbolicated lines of lines, an iterable which may be
+    a file, without holding the whole log. Lines are collected into a
+    window while they contain frames and the window is fixed with
+    fixSymbolsInLines at the end of each stack or once it holds
+    windowSize lines. Other lines are passed through as they are read.
+    errors is as for fixSymbolsInLines."""
+    window = []
+    for line in lines:
+        isFrame = ' +0x' in line and '#' in line and line_re.match(line) is not None
+        if isFrame:
+            window.append(line)
+        if window and (not isFrame or len(window) >= windowSize):
+            for fixed in fixSymbolsInLines(window, symbolsDir, errors):
+                yield fixed
+            window = []
+        if not isFrame:
+            yield line
+    if window:
+        for fixed in fixSymbolsInLines(window, symbolsDir, errors):
+            yield fixed
 
 
 if __name__ == "__main__":
     symbolsDir = sys.argv[1]
-    for line in iter(sys.stdin.readline, ''):
-        print fixSymbols(line, symbolsDir),
+    # readline rather than iterating over stdin so that each line is
+    # written as soon as it can be fixed.
+    for line in fixSymbolsInWindows(iter(sys.stdin.readline, ''), symbolsDir):
+        sys.stdout.write(line)
+        sys.stdout.flush()
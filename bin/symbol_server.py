@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Host local symbol server. Loads or maps the symbols of each build once
+# and answers batched address to symbol requests from every worker on
+# the host over a Unix socket. fix_stack_using_bpsyms uses the server
+# when it is running and falls back to in process lookups otherwise.
+#
+# Each request and response is a single line of JSON:
+#
+#   {"symbolsDir": dir, "modules": {file: [address, ...], ...}}
+#   {"symbols": {file: [symbol, ...], ...}, "errors": {file: message, ...}}
+
+import json
+import optparse
+import os
+import signal
+import SocketServer
+import sys
+import threading
+import time
+
+import fix_stack_using_bpsyms
+
+
+class SymbolRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            request = json.loads(line)
+            symbolsDir = request['symbolsDir'].encode('latin-1')
+            symbols = {}
+            errors = {}
+            for file, addresses in request['modules'].iteritems():
+                try:
+                    # The cache does its own locking and the lookups
+                    # only read the symbol file, so requests for other
+                    # modules are answered while a module loads.
+                    p = self.server.cache.get(file.encode('latin-1'), symbolsDir)
+                    if p:
+                        symbols[file] = p.addrsToSymbols(addresses)
+                    else:
+                        symbols[file] = [""] * len(addresses)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    errors[file] = str(e)
+            self.wfile.write(json.dumps({'symbols': symbols, 'errors': errors},
+                                        encoding='latin-1') + '\n')
+            self.wfile.flush()
+
+
+class SymbolServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, maxbytes):
+        self.cache = fix_stack_using_bpsyms.SymbolCache(maxbytes)
+        # Builds are replaced in place, so check that a cached symbol
+        # file still exists before using it.
+        self.cache.verifyPaths = True
+        SocketServer.UnixStreamServer.__init__(self, path, SymbolRequestHandler)
+
+
+def main():
+    usage = '%prog [options]'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--socket', action='store', type='string',
+                      dest='socket',
+                      default=fix_stack_using_bpsyms.SYMBOL_SERVER_SOCKET,
+                      help='Path of the Unix socket. Defaults to %s' %
+                      fix_stack_using_bpsyms.SYMBOL_SERVER_SOCKET)
+    parser.add_option('--cache-size', action='store', type='int',
+                      dest='cache_size',
+                      default=2048,
+                      help='Maximum size in megabytes of the cached symbols. '
+                      'Defaults to 2048.')
+    parser.add_option('--stats-interval', action='store', type='int',
+                      dest='stats_interval',
+                      default=3600,
+                      help='Seconds between printing the cache statistics. '
+                      'Defaults to 3600.')
+    (options, args) = parser.parse_args()
+
+    if os.path.exists(options.socket):
+        os.unlink(options.socket)
+
+    server = SymbolServer(options.socket, options.cache_size * 1024 * 1024)
+
+    def term_handler(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, term_handler)
+
+    def print_stats():
+        while True:
+            time.sleep(options.stats_interval)
+            print '%s: %s' % (time.ctime(), server.cache.stats())
+            sys.stdout.flush()
+
+    stats_thread = threading.Thread(target=print_stats)
+    stats_thread.daemon = True
+    stats_thread.start()
+
+    print '%s: symbol server listening on %s' % (time.ctime(), options.socket)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(options.socket):
+            os.unlink(options.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
 import json
 import re
+import sys
+import time
+
+# The version of the crash data produced from the tool output. Increase
+# it when the parsing changes so that cached results are not reused.
+CRASH_DATA_VERSION = 1
 
 # http://code.google.com/p/socorro/wiki/SignatureGeneration
 # http://code.google.com/p/socorro/source/browse/trunk/socorro/processor/processor.py#356
@@ -116,13 +123,132 @@ prefixSignatureRegEx = '|'.join([
   ])
 rePrefixSignature = re.compile(prefixSignatureRegEx)
 
+# the frame names of signatureSentinels, used to find candidate
+# sentinels in a stack with a single set lookup per frame.
+signatureSentinelNames = frozenset([aSentinel[0] if type(aSentinel) == tuple else aSentinel
+                                    for aSentinel in signatureSentinels])
+
 # parse_crashreport customizations
 
 # any signatures that match this list should be combined with their associated source code line numbers
 reSignaturesWithLineNumbers = re.compile(r'js_Interpret')
 
+reBlankLine           = re.compile(r'\s*$')
+reInitOperatingSystem = re.compile(r'Operating system: (.*)')
+reCpuType             = re.compile(r'CPU:\s(.*)')
+reCpuCount            = re.compile(r'\s+([0-9]+)\sCPU')
+reCrashReason         = re.compile(r'Crash reason:\s+(.*)')
+reCrashAddress        = re.compile(r'Crash address:\s+(.*)')
+reCrashThread         = re.compile(r'Thread ([0-9]+) [(]crashed[)]')
+reThread              = re.compile(r'Thread ([0-9]+)')
+reFrameModuleSrce     = re.compile(r'\s*([0-9]+)\s+([^!]+)!(.*) [\[](.*) : ([0-9]+) \+ 0x[0-9a-fA-F]+[\]]')
+reFrameModuleNoSrce   = re.compile(r'\s*([0-9]+)\s+([^!]+)!(.*)')
+reFrameLibrary        = re.compile(r'\s*([0-9]+)\s+([^+]+)\s\+\s(0x[0-9a-fA-F]+)')
+reFrameAddress        = re.compile(r'\s*([0-9]+)\s+(0x[0-9a-fA-F]+)')
+reFrameRegister       = re.compile(r'\s+([a-zA-Z0-9]+)\s=\s(0x[0-9a-fA-F]+)')
+reFrameFoundBy        = re.compile(r'\s+Found by:')
+reLoadedModules       = re.compile(r'Loaded modules:')
+reMainModule          = re.compile(r'0x[a-zA-Z0-9]+\s-\s0x[a-zA-Z0-9]+\s+([^\s]+)\s+[^\s]+\s+[(]main[)]')
+
+# socorro processor
+reFixupSpace = re.compile(r' (?=[\*&,])')
+reFixupComma = re.compile(r',(?! )')
+reFixupInteger = re.compile(r'(<|, )(\d+)([uUlL]?)([^\w])')
+
+# generateCrashSignature
+reAddressSignature = re.compile(r'@0x[0-9a-fA-F]+')
+
+
+FRAME_IRRELEVANT = 'irrelevant'
+FRAME_PREFIX     = 'prefix'
+FRAME_RELEVANT   = 'relevant'
+
+def classifyFrame(signature):
+    """
+    Classify the frame signature for generateSignatureFromList and
+    return a tuple (kind, name, name_irrelevant) where
+
+    kind            is FRAME_IRRELEVANT, FRAME_PREFIX or FRAME_RELEVANT
+    name            is the signature without its argument declaration list
+    name_irrelevant is True if name matches reIrrelevantSignature
+
+    Sentinel frames are recognized separately by their membership in
+    signatureSentinelNames since their conditions depend on the whole
+    stack.
+    """
+
+    if reIrrelevantSignature.match(signature):
+        kind = FRAME_IRRELEVANT
+    elif rePrefixSignature.match(signature):
+        kind = FRAME_PREFIX
+    else:
+        kind = FRAME_RELEVANT
+
+    name = signature.partition('(')[0]
+    name_irrelevant = reIrrelevantSignature.match(name) is not None
+
+    return (kind, name, name_irrelevant)
+
+class FrameClassificationCache(object):
+    """
+    A bounded cache of classifyFrame results keyed by the frame
+    signature. The same Gecko frames occur in nearly every crash
+    report, so once the cache is warm signature generation is a
+    dictionary lookup per frame instead of several regular expression
+    matches.
+
+    Eviction is least recently used by generation: entries live in a
+    current and a previous generation of at most maxsize/2 entries
+    each. Entries found in the previous generation are promoted, and
+    when the current generation fills, the previous generation and
+    anything not used since it was current are discarded. This keeps
+    a hit to a single dictionary lookup.
+    """
+
+    def __init__(self, maxsize=20000):
+        self.generation_size = max(1, maxsize // 2)
+        self.current  = {}
+        self.previous = {}
+        self.hits     = 0
+        self.misses   = 0
 
-def generateSignatureFromList(signatureList):
+    def classify(self, signature):
+        try:
+            classification = self.current[signature]
+            self.hits += 1
+            return classification
+        except KeyError:
+            pass
+
+        classification = self.previous.get(signature)
+        if classification is None:
+            classification = classifyFrame(signature)
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        if len(self.current) >= self.generation_size:
+            self.previous = self.current
+            self.current  = {}
+        self.current[signature] = classification
+        return classification
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+    def clear(self):
+        """
+        Discard the cached classifications. Call this after modifying
+        reIrrelevantSignature or rePrefixSignature at run time.
+        """
+        self.current  = {}
+        self.previous = {}
+        self.hits     = 0
+        self.misses   = 0
+
+frameClassificationCache = FrameClassificationCache()
+
+def generateSignatureFromList(signatureList, classify=None):
     """
     each element of signatureList names a frame in the crash stack; and is:
     - a prefix of a relevant frame: Append this element to the signature
@@ -130,84 +256,123 @@ def generateSignatureFromList(signatureList):
     - irrelevant: Append this element only after we have seen a prefix frame
     The signature is a ' | ' separated string of frame names
     Although the database holds only 255 characters, we don't truncate here
+
+    classify is the function used to classify each frame and defaults
+    to the shared frameClassificationCache.
     """
 
+    if classify is None:
+        classify = frameClassificationCache.classify
+
     # shorten signatureList to the first signatureSentinel
-    sentinelLocations = []
-    for aSentinel in signatureSentinels:
-        if type(aSentinel) == tuple:
-            aSentinel, conditionFn = aSentinel
-            if not conditionFn(signatureList):
-                continue
-        try:
-            sentinelLocations.append(signatureList.index(aSentinel))
-        except ValueError:
-            pass
-    if sentinelLocations:
-        signatureList = signatureList[min(sentinelLocations):]
+    for iframe, aSignature in enumerate(signatureList):
+        if aSignature in signatureSentinelNames and isActiveSentinel(aSignature, signatureList):
+            signatureList = signatureList[iframe:]
+            break
 
     newSignatureList = []
     prefixFound = False
-    ignored_frame_count = 0
+    consumed = 0
 
     # Remove parenthesised argument declaration list from the frames.
     # This helps consolidate signatures across platforms which may or
     # may not include argument declartion lists.
 
     for aSignature in signatureList:
-        if reIrrelevantSignature.match(aSignature):
+        kind, name, name_irrelevant = classify(aSignature)
+        consumed += 1
+        if kind == FRAME_IRRELEVANT:
             if prefixFound:
-                newSignatureList.append(aSignature.partition('(')[0])
-            else:
-                ignored_frame_count += 1
+                newSignatureList.append(name)
             continue
-        newSignatureList.append(aSignature.partition('(')[0])
-        if not rePrefixSignature.match(aSignature):
+        newSignatureList.append(name)
+        if kind != FRAME_PREFIX:
             break
         prefixFound = True
 
-    remainderSignatureList = signatureList[len(newSignatureList) + ignored_frame_count:]
-    remainderSignatureList = [remainderSignature.partition('(')[0] for remainderSignature in remainderSignatureList]
-
     socorroSignature = ' | '.join(newSignatureList)
     if socorroSignature == "":
         socorroSignature = '(no signature)'
 
     sisyphusSignatureList = [socorroSignature]
-    sisyphusSignatureList.extend(remainderSignatureList)
     # remove irrelevant signatures from the non-socorro part of the signature.
-    indices = range(1,len(sisyphusSignatureList))
-    indices.reverse()
-    for isignature in indices:
-        if reIrrelevantSignature.match(sisyphusSignatureList[isignature]):
-            del sisyphusSignatureList[isignature]
-    sisyphusSignatureList = sisyphusSignatureList[:5]
+    for aSignature in signatureList[consumed:]:
+        if len(sisyphusSignatureList) == 5:
+            break
+        kind, name, name_irrelevant = classify(aSignature)
+        if not name_irrelevant:
+            sisyphusSignatureList.append(name)
 
     return sisyphusSignatureList
 
-def parse_crashreport(crashreport):
-
-    reBlankLine           = re.compile(r'\s*$')
-    reInitOperatingSystem = re.compile(r'Operating system: (.*)')
-    reCpuType             = re.compile(r'CPU:\s(.*)')
-    reCpuCount            = re.compile(r'\s+([0-9]+)\sCPU')
-    reCrashReason         = re.compile(r'Crash reason:\s+(.*)')
-    reCrashAddress        = re.compile(r'Crash address:\s+(.*)')
-    reCrashThread         = re.compile(r'Thread ([0-9]+) [(]crashed[)]')
-    reThread              = re.compile(r'Thread ([0-9]+)')
-    reFrameModuleSrce     = re.compile(r'\s*([0-9]+)\s+([^!]+)!(.*) [\[](.*) : ([0-9]+) \+ 0x[0-9a-fA-F]+[\]]')
-    reFrameModuleNoSrce   = re.compile(r'\s*([0-9]+)\s+([^!]+)!(.*)')
-    reFrameLibrary        = re.compile(r'\s*([0-9]+)\s+([^+]+)\s\+\s(0x[0-9a-fA-F]+)')
-    reFrameAddress        = re.compile(r'\s*([0-9]+)\s+(0x[0-9a-fA-F]+)')
-    reFrameRegister       = re.compile(r'\s+([a-zA-Z0-9]+)\s=\s(0x[0-9a-fA-F]+)')
-    reFrameFoundBy        = re.compile(r'\s+Found by:')
-    reLoadedModules       = re.compile(r'Loaded modules:')
-    reMainModule          = re.compile(r'0x[a-zA-Z0-9]+\s-\s0x[a-zA-Z0-9]+\s+([^\s]+)\s+[^\s]+\s+[(]main[)]')
-
-    # socorro processor
-    reFixupSpace = re.compile(r' (?=[\*&,])')
-    reFixupComma = re.compile(r',(?! )')
-    reFixupInteger = re.compile(r'(<|, )(\d+)([uUlL]?)([^\w])')
+def generateCrashSignature(signatureList):
+    """
+    Return the Crash.signature for the signature_list of a parsed
+    crash report. Each pure address in a frame is removed to prevent
+    random addresses from polluting the signature and preventing
+    matches.
+    """
+
+    return ' '.join([reAddressSignature.sub('', aSignature.rstrip()) for aSignature in signatureList])
+
+def isActiveSentinel(signature, signatureList):
+    """
+    Return True if signature is a signatureSentinel whose condition,
+    if any, holds for signatureList.
+    """
+
+    for aSentinel in signatureSentinels:
+        if type(aSentinel) == tuple:
+            aSentinel, conditionFn = aSentinel
+            if signature == aSentinel and conditionFn(signatureList):
+                return True
+        elif signature == aSentinel:
+            return True
+    return False
+
+def normalizeFrameSignature(function, linenumber=None):
+    """
+    Return the signature for a module frame's function name using the
+    socorro processor's normalizations.
+    """
+
+    if linenumber is not None and reSignaturesWithLineNumbers.match(function):
+        signature = "%s:%s" % (function, linenumber)
+    else:
+        signature = function
+
+    # Remove spaces before all stars, ampersands, and commas
+    signature = reFixupSpace.sub('', signature)
+
+    # Ensure a space after commas
+    signature = reFixupComma.sub(', ', signature)
+
+    # normalize template signatures with manifest const integers to 'int': Bug 481445
+    signature = reFixupInteger.sub(r'\1int\4', signature)
+
+    return signature
+
+def iterReportLines(crashreport):
+    """
+    Return an iterator over the lines of crashreport without their
+    trailing newlines. crashreport may be a string or any iterable of
+    lines such as a file object or the stdout pipe of minidump_stackwalk.
+    """
+
+    if isinstance(crashreport, basestring):
+        return iter(crashreport.split('\n'))
+    return (line[:-1] if line.endswith('\n') else line for line in crashreport)
+
+def parse_crashreport(crashreport, trace=False):
+    """
+    Parse the human readable output of minidump_stackwalk in a single
+    pass and return the crash_data dictionary.
+
+    crashreport may be a string or an iterable of lines. Parsing stops
+    once the main module has been found so that the remaining loaded
+    modules are not consumed. If trace is True, a diagnostic message is
+    recorded in crash_data['messages'] for each line processed.
+    """
 
     crash_data = {
         "operating_system" : "",
@@ -227,13 +392,97 @@ def parse_crashreport(crashreport):
 
     state = 'init'
 
-    lines = crashreport.split('\n')
+    for line in iterReportLines(crashreport):
 
-    while len(lines) > 0:
+        if trace:
+            messages.append("state: %s, line: '%s'" % (state, line))
 
-        line = lines.pop(0)
+        if state == 'expect_frame_start':
+            # The frame patterns are tested in the same order as
+            # before, but only when the line contains the literals
+            # the pattern requires.
+            match = None
+            if '!' in line:
+                if ' [' in line:
+                    match = reFrameModuleSrce.match(line)
+                if match:
+                    frame =  {
+                        'frame_type' : 'module',
+                        'frame_number' : match.group(1),
+                        'frame_module' : match.group(2),
+                        'frame_function' : match.group(3),
+                        'frame_filename' : match.group(4),
+                        'frame_linenumber' : match.group(5),
+                        'frame_registers' : {}
+                        }
+                    frame['frame_signature'] = normalizeFrameSignature(frame['frame_function'],
+                                                                       frame['frame_linenumber'])
+                else:
+                    match = reFrameModuleNoSrce.match(line)
+                    if match:
+                        frame =  {
+                            'frame_type' : 'module',
+                            'frame_number' : match.group(1),
+                            'frame_module' : match.group(2),
+                            'frame_function' : match.group(3),
+                            'frame_registers' : {}
+                            }
+                        frame['frame_signature'] = normalizeFrameSignature(frame['frame_function'])
+            if not match and '+' in line:
+                match = reFrameLibrary.match(line)
+                if match:
+                    frame = {
+                        'frame_type' : 'library',
+                        'frame_number' : match.group(1),
+                        'frame_library' : match.group(2),
+                        'frame_library_address' : match.group(3),
+                        'frame_registers' : {}
+                        }
+                    frame['frame_signature'] = '%s@%s' % (frame['frame_library'], frame['frame_library_address'])
+            if not match and '0x' in line:
+                match = reFrameAddress.match(line)
+                if match:
+                    frame = {
+                        'frame_type' : 'address',
+                        'frame_number' : match.group(1),
+                        'frame_address' : match.group(2),
+                        'frame_registers' : {}
+                        }
+                    frame['frame_signature'] = '@%s' % frame['frame_address']
+            if match:
+                frames.append(frame)
+                state = 'expect_frame_registers'
+            elif reBlankLine.match(line):
+                state = 'expect_loaded_modules'
+            elif trace:
+                messages.append('no frame found')
+            continue
 
-        messages.append("state: %s, line: '%s'" % (state, line))
+        if state == 'expect_frame_registers':
+            match = reFrameRegister.search(line)
+            if match:
+                frame_registers = frames[-1]['frame_registers']
+                while match:
+                    frame_registers[match.group(1)] = match.group(2)
+                    match = reFrameRegister.search(line, match.end(0))
+            elif reFrameFoundBy.match(line):
+                state = 'expect_frame_start'
+            else:
+                messages.append('error state: %s, unexpected: %s' % (state, line))
+            continue
+
+        if state == 'expect_main_module':
+            match = reMainModule.match(line)
+            if match:
+                crash_data['main'] = match.group(1)
+                state = 'complete'
+                break
+            continue
+
+        if state == 'expect_loaded_modules':
+            if reLoadedModules.match(line):
+                state = 'expect_main_module'
+            continue
 
         if state == 'init':
             if not line:
@@ -262,13 +511,14 @@ def parse_crashreport(crashreport):
             continue
 
         if state == 'expect_cpu_family_or_count':
-            lines.insert(0, line)
-            match = reCpuCount.match(line)
-            if match:
+            # Decide which state the line belongs to then fall
+            # through to process it in that state.
+            if reCpuCount.match(line):
                 state = 'expect_cpu_count'
             else:
                 state = 'expect_cpu_family'
-            continue
+            if trace:
+                messages.append("state: %s, line: '%s'" % (state, line))
 
         if state == 'expect_cpu_family':
             crash_data['cpu_family'] = line.strip()
@@ -285,8 +535,7 @@ def parse_crashreport(crashreport):
             continue
 
         if state == 'expect_crash_reason_blank_line':
-            match = reBlankLine.match(line)
-            if match:
+            if reBlankLine.match(line):
                 state = 'expect_crash_reason'
             else:
                 messages.append('error state: %s, unexpected: %s' % (state, line))
@@ -311,10 +560,8 @@ def parse_crashreport(crashreport):
             continue
 
         if state == 'expect_thread_crash_blank_line':
-            match = reBlankLine.match(line)
-            if match:
+            if reBlankLine.match(line):
                 state = 'expect_thread_crash'
-                continue
             else:
                 messages.append('error state: %s, unexpected: %s' % (state, line))
             continue
@@ -331,156 +578,167 @@ def parse_crashreport(crashreport):
                     # but we will pretend it is the crashing thread.
                     crash_data['crashing_thread'] = match.group(1)
                     state = 'expect_frame_start'
+                elif reLoadedModules.match(line):
+                    # In this case, there are no threads.
+                    state = 'expect_main_module'
                 else:
-                    messages.append('checking reLoadedModules')
-                    match = reLoadedModules.match(line)
-                    if match:
-                        # In this case, there are no threads.
-                        messages.append('found')
-                        state = 'expect_main_module'
-                    else:
-                        messages.append('error state: %s, unexpected: %s' % (state, line))
+                    messages.append('error state: %s, unexpected: %s' % (state, line))
             continue
 
-        if state == 'expect_frame_start':
-            messages.append('checking reFrameModuleSrce')
-            match = reFrameModuleSrce.match(line)
-            if match:
-                messages.append('found')
-                frame =  {
-                    'frame_type' : 'module',
-                    'frame_number' : match.group(1),
-                    'frame_module' : match.group(2),
-                    'frame_function' : match.group(3),
-                    'frame_filename' : match.group(4),
-                    'frame_linenumber' : match.group(5),
-                    'frame_registers' : {}
-                    }
+        messages.append('error state: %s, unexpected: %s' % (state, line))
 
-                if reSignaturesWithLineNumbers.match(frame['frame_function']):
-                    frame['frame_signature'] = "%s:%s" % (frame['frame_function'], frame['frame_linenumber'])
-                else:
-                    frame['frame_signature'] = frame['frame_function']
+    if trace:
+        messages.append("state: %s" % state)
 
-                # Remove spaces before all stars, ampersands, and commas
-                frame['frame_signature'] = reFixupSpace.sub('', frame['frame_signature'])
+    signatureList = [frame['frame_signature'] for frame in crash_data['frames']]
 
-                # Ensure a space after commas
-                frame['frame_signature'] = reFixupComma.sub(', ', frame['frame_signature'])
+    if len(signatureList) == 0 and crash_data['main']:
+        signatureList = ['(' + crash_data['main'] + ')']
+    crash_data['signature_list'] = generateSignatureFromList(signatureList)
 
-                # normalize template signatures with manifest const integers to 'int': Bug 481445
-                frame['frame_signature'] = reFixupInteger.sub(r'\1int\4', frame['frame_signature'])
+    return crash_data
 
-                frames.append(frame)
-                state = 'expect_frame_registers'
-            else:
-                messages.append('checking reFrameModuleNoSrce')
-                match = reFrameModuleNoSrce.match(line)
-                if match:
-                    messages.append('found')
-                    frame =  {
-                        'frame_type' : 'module',
-                        'frame_number' : match.group(1),
-                        'frame_module' : match.group(2),
-                        'frame_function' : match.group(3),
-                        'frame_registers' : {}
-                        }
+def stripPathname(path):
+    """
+    Return the file name portion of a unix or windows path the same
+    way minidump_stackwalk does for its human readable output.
+    """
 
-                    if reSignaturesWithLineNumbers.match(frame['frame_function']):
-                        frame['frame_signature'] = "%s:%s" % (frame['frame_function'], frame['frame_linenumber'])
-                    else:
-                        frame['frame_signature'] = frame['frame_function']
+    return path[max(path.rfind('/'), path.rfind('\\')) + 1:]
 
-                    # Remove spaces before all stars, ampersands, and commas
-                    frame['frame_signature'] = reFixupSpace.sub('', frame['frame_signature'])
+def parse_machine_crashreport(crashreport, trace=False):
+    """
+    Parse the machine readable (minidump_stackwalk -m) output and
+    return the same crash_data dictionary as parse_crashreport.
+
+    Each line is split on the '|' separator rather than matched with
+    regular expressions. Frames are recreated in the form they take in
+    the human readable output so that the signatures agree. The
+    machine readable output does not contain registers, so
+    frame_registers is always empty. Parsing stops once the frames of
+    the crashing thread have been read.
+    """
 
-                    # Ensure a space after commas
-                    frame['frame_signature'] = reFixupComma.sub(', ', frame['frame_signature'])
+    crash_data = {
+        "operating_system" : "",
+        "operating_system_version" : "",
+        "cpu_type" : "",
+        "cpu_family" : "",
+        "cpu_count" : "",
+        "crash_address" : "",
+        "crashing_thread" : "",
+        "frames" : [],
+        "messages": [],
+        "main": ""
+        }
 
-                    # normalize template signatures with manifest const integers to 'int': Bug 481445
-                    frame['frame_signature'] = reFixupInteger.sub(r'\1int\4', frame['frame_signature'])
+    frames = crash_data['frames']
+    messages = crash_data['messages']
 
-                    frames.append(frame)
-                    state = 'expect_frame_registers'
-                else:
-                    messages.append('checking reFrameLibrary')
-                    match = reFrameLibrary.match(line)
-                    if match:
-                        messages.append('found')
-                        frame = {
-                            'frame_type' : 'library',
-                            'frame_number' : match.group(1),
-                            'frame_library' : match.group(2),
-                            'frame_library_address' : match.group(3),
-                            'frame_registers' : {}
-                            }
-                        frame['frame_signature'] = '%s@%s' % (frame['frame_library'], frame['frame_library_address'])
-                        frames.append(frame)
-                        state = 'expect_frame_registers'
-                    else:
-                        messages.append('checking reFrameAddress')
-                        match = reFrameAddress.match(line)
-                        if match:
-                            messages.append('found')
-                            frame = {
-                                'frame_type' : 'address',
-                                'frame_number' : match.group(1),
-                                'frame_address' : match.group(2),
-                                'frame_registers' : {}
-                                }
-                            frame['frame_signature'] = '@%s' % frame['frame_address']
-                            frames.append(frame)
-                            state = 'expect_frame_registers'
-                        else:
-                            messages.append('checking reBlankLine')
-                            match = reBlankLine.match(line)
-                            if match:
-                                messages.append('found')
-                                state = 'expect_loaded_modules'
-            continue
+    # The thread whose frames are collected. The requesting thread is
+    # output first. If there is none, we pretend the first thread is
+    # the crashing thread as parse_crashreport does.
+    frame_thread = None
 
-        if state == 'expect_frame_registers':
-            messages.append('checking reFrameRegister')
-            match = re.search(reFrameRegister, line)
-            if match:
-                messages.append('found')
-                while match:
-                    frames[-1]['frame_registers'][match.group(1)] = match.group(2)
-                    match = reFrameRegister.search(line, match.end(0))
+    for line in iterReportLines(crashreport):
+
+        if trace:
+            messages.append("line: '%s'" % line)
+
+        fields = line.split('|')
+        record = fields[0]
+
+        if record.isdigit():
+            if len(fields) != 7:
+                messages.append('error unexpected frame: %s' % line)
+                continue
+
+            (thread, frame_number, module, function, filename, linenumber, offset) = fields
+
+            if frame_thread is None:
+                frame_thread = thread
+                if not crash_data['crashing_thread']:
+                    crash_data['crashing_thread'] = thread
+            elif thread != frame_thread:
+                break
+
+            if module and function and filename:
+                frame = {
+                    'frame_type' : 'module',
+                    'frame_number' : frame_number,
+                    'frame_module' : module,
+                    'frame_function' : function,
+                    'frame_filename' : stripPathname(filename),
+                    'frame_linenumber' : linenumber,
+                    'frame_registers' : {}
+                    }
+                frame['frame_signature'] = normalizeFrameSignature(function, linenumber)
+            elif module and function:
+                frame = {
+                    'frame_type' : 'module',
+                    'frame_number' : frame_number,
+                    'frame_module' : module,
+                    'frame_function' : '%s + %s' % (function, offset),
+                    'frame_registers' : {}
+                    }
+                frame['frame_signature'] = normalizeFrameSignature(frame['frame_function'])
+            elif module:
+                frame = {
+                    'frame_type' : 'library',
+                    'frame_number' : frame_number,
+                    'frame_library' : module,
+                    'frame_library_address' : offset,
+                    'frame_registers' : {}
+                    }
+                frame['frame_signature'] = '%s@%s' % (module, offset)
             else:
-                messages.append('checking reFrameFoundBy')
-                match = reFrameFoundBy.match(line)
-                if match:
-                    messages.append('found')
-                    state = 'expect_frame_start'
-                else:
-                    messages.append('error state: %s, unexpected: %s' % (state, line))
+                frame = {
+                    'frame_type' : 'address',
+                    'frame_number' : frame_number,
+                    'frame_address' : offset,
+                    'frame_registers' : {}
+                    }
+                frame['frame_signature'] = '@%s' % offset
+            frames.append(frame)
             continue
 
-        if state == 'expect_loaded_modules':
-            messages.append('checking reLoadedModules')
-            match = reLoadedModules.match(line)
-            if match:
-                messages.append('found')
-                state = 'expect_main_module'
+        if record == 'Module':
+            # Module|file|version|debug file|debug id|base|max|main
+            if len(fields) > 7 and fields[7] == '1':
+                crash_data['main'] = fields[1]
             continue
 
-        if state == 'expect_main_module':
-            messages.append('checking reMainModule')
-            match = reMainModule.match(line)
-            if match:
-                messages.append('found')
-                crash_data['main'] = match.group(1)
-                state = 'complete'
-                break
+        if record == 'OS':
+            if len(fields) > 2:
+                crash_data['operating_system'] = fields[1]
+                crash_data['operating_system_version'] = fields[2].strip()
+            else:
+                messages.append('error unexpected: %s' % line)
             continue
 
-        messages.append('error state: %s, unexpected: %s' % (state, line))
-        continue
+        if record == 'CPU':
+            if len(fields) > 3:
+                crash_data['cpu_type'] = fields[1]
+                crash_data['cpu_family'] = fields[2].strip()
+                crash_data['cpu_count'] = fields[3]
+            else:
+                messages.append('error unexpected: %s' % line)
+            continue
 
-    messages.append("state: %s" % state)
+        if record == 'Crash':
+            if len(fields) > 3:
+                if fields[1]:
+                    crash_data['crash_reason'] = fields[1]
+                crash_data['crash_address'] = fields[2]
+                crash_data['crashing_thread'] = fields[3]
+            else:
+                messages.append('error unexpected: %s' % line)
+            continue
 
-    signatureList = [frame['frame_signature'] for frame in crash_data['frames']]
+        # Blank lines, the exit status appended by timed_run.py and
+        # records such as GPU which are not used.
+
+    signatureList = [frame['frame_signature'] for frame in frames]
 
     if len(signatureList) == 0 and crash_data['main']:
         signatureList = ['(' + crash_data['main'] + ')']
@@ -488,6 +746,27 @@ def parse_crashreport(crashreport):
 
     return crash_data
 
+def parse_stackwalk_output(crashreport, trace=False):
+    """
+    Parse either the human readable or the machine readable output
+    of minidump_stackwalk depending on the form of its first non blank
+    line.
+    """
+
+    lines = iterReportLines(crashreport)
+    first_lines = []
+    for line in lines:
+        first_lines.append(line)
+        if line.strip():
+            break
+
+    if first_lines and first_lines[-1].startswith('OS|'):
+        parser = parse_machine_crashreport
+    else:
+        parser = parse_crashreport
+
+    return parser(itertools.chain(first_lines, lines), trace)
+
 if __name__ == "__main__":
 
     crashreport_list = ["""
@@ -10497,6 +10776,35 @@ Loaded modules:
 
  EXIT STATUS: NORMAL (11.359731 seconds)""",]
 
+    if '--benchmark' in sys.argv:
+        # Compare signature generation with and without the frame
+        # classification cache over the stacks of the reports above.
+        iterations = 2000
+        signatureLists = [[frame['frame_signature'] for frame in parse_crashreport(crashreport)['frames']]
+                          for crashreport in crashreport_list]
+        frameCount = sum([len(signatureList) for signatureList in signatureLists])
+
+        starttime = time.time()
+        for iteration in xrange(iterations):
+            for signatureList in signatureLists:
+                generateSignatureFromList(signatureList, classifyFrame)
+        uncachedtime = time.time() - starttime
+
+        frameClassificationCache.clear()
+        starttime = time.time()
+        for iteration in xrange(iterations):
+            for signatureList in signatureLists:
+                generateSignatureFromList(signatureList)
+        cachedtime = time.time() - starttime
+
+        print "stacks: %d, frames: %d, iterations: %d" % (len(signatureLists), frameCount, iterations)
+        print "uncached: %f seconds, %f stacks/second" % (uncachedtime, iterations * len(signatureLists) / uncachedtime)
+        print "cached:   %f seconds, %f stacks/second" % (cachedtime, iterations * len(signatureLists) / cachedtime)
+        print "speedup:  %.1fx, cache hits: %d, misses: %d" % (uncachedtime / cachedtime,
+                                                                frameClassificationCache.hits,
+                                                                frameClassificationCache.misses)
+        sys.exit(0)
+
     for crashreport in crashreport_list:
 
         crash_data = parse_crashreport(crashreport)
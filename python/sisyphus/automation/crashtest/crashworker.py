@@ -2,15 +2,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import copy
 import datetime
+import multiprocessing
 import os
-import random
+import Queue
 import re
 import shutil
-import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 from optparse import OptionParser
@@ -42,12 +44,14 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'sisyphus.webapp.settings'
 import django
 django.setup()
 
+from django.db import connection
+
 import sisyphus.webapp.settings
 sisyphus_url      = os.environ["SISYPHUS_URL"]
 post_files_url    = sisyphus_url + '/post_files/'
 
 from sisyphus.webapp.bughunter import models
-from sisyphus.automation import utils, worker, program_info
+from sisyphus.automation import utils, worker, program_info, geckolog, minidumpwatcher
 
 import fix_stack_using_bpsyms
 
@@ -64,6 +68,9 @@ if "MINIDUMP_STACKWALK" not in os.environ or not os.environ["MINIDUMP_STACKWALK"
 if not os.path.exists(os.environ["MINIDUMP_STACKWALK"]):
     del os.environ["MINIDUMP_STACKWALK"]
 
+# Maximum number of slots per worker and the size of each worker's
+# range of Marionette ports.
+max_slots = 16
 
 class CrashTestWorker(worker.Worker):
 
@@ -77,8 +84,38 @@ class CrashTestWorker(worker.Worker):
         self.model_test_crash_dump_meta_data = models.SiteTestCrashDumpMetaData
 
         self.testrun_row = None
+        # The other jobs claimed with testrun_row in batch mode.
+        self.batch_testrun_rows = []
+        self.batch_size = options.batch_size
+
+        # In slot mode up to slots tests are run concurrently using the
+        # installed build. Each slot runs its test on a copy of the
+        # worker with its own profile directory, Marionette port and
+        # log files and only kills the processes it started. slot_dir
+        # is None when the worker is not running a slot.
+        #
+        # Several workers may run on the same host. The slot directories
+        # contain the worker's id since the processes of a slot are found
+        # by their command lines, and each worker uses its own range of
+        # max_slots Marionette ports.
+        self.slot = 0
+        self.slot_dir = None
+        self.slots = options.slots
+        self.active_slots = {}
         self.save()
 
+        if options.marionette_port:
+            self.marionette_port = options.marionette_port
+        else:
+            self.marionette_port = 2828 + (self.worker_row.id % 256) * max_slots
+
+        if self.slots > 1 and self.os_name == "Windows NT":
+            self.logMessage('Slots are not supported on Windows. Using one slot.')
+            self.slots = 1
+        elif self.slots > max_slots:
+            self.logMessage('At most %d slots are supported. Using %d slots.' % (max_slots, max_slots))
+            self.slots = max_slots
+
         # Workers obtain signatures to process by retrieving them from
         # the pending jobs view.
 
@@ -115,6 +152,22 @@ class CrashTestWorker(worker.Worker):
         # for each page load.
         self.userhook = sisyphus.webapp.settings.SISYPHUS_URL + '/media/userhooks/' + options.userhook
 
+        # Directory of the profile templates the runner clones for
+        # each test or None to create the profile for each test.
+        self.profile_template_dir = options.profile_template_dir
+
+        # The runner is killed if its output exceeds max_log_size bytes.
+        self.max_log_size = options.max_log_size * 1024 * 1024
+
+        # A test which is not run in batch mode is ended
+        # crash_exit_delay seconds after its first minidump is
+        # complete. None lets the runner finish.
+        self.crash_exit_delay = options.crash_exit_delay
+
+        # Whether the runner waits for the page to be idle instead of
+        # always waiting the full time after each page is loaded.
+        self.adaptive_wait = options.adaptive_wait
+
         self.page_timeout = options.page_timeout
         self.site_timeout = options.site_timeout
 
@@ -122,14 +175,40 @@ class CrashTestWorker(worker.Worker):
         # for use by minidump_stackwalk
         self.symbols_paths = options.symbols_paths.split(' ')
 
+        fix_stack_using_bpsyms.symbolCache.maxbytes = options.symbol_cache_size * 1024 * 1024
+
         # Use a property to record whether the test process has been hung in order
         # to allow the hung alarm signal to set its value.
         self.hung_process = False
 
         self.do_not_reproduce_bogus_signatures = options.do_not_reproduce_bogus_signatures
 
+        # In pipelined mode the results of each test are processed by
+        # a background thread while the next test runs. At most
+        # pipeline_depth tests wait to be processed.
+        self.postprocess_queue = None
+        self.postprocess_exception = None
+        if options.pipeline_depth > 0:
+            self.postprocess_queue = Queue.Queue(options.pipeline_depth)
+            postprocess_thread = threading.Thread(target=self.postProcessTests)
+            postprocess_thread.daemon = True
+            postprocess_thread.start()
+
     def runTest(self, extra_test_args):
 
+        run = self.prepareTest(extra_test_args)
+        if not run:
+            return []
+        (result, exc_info) = self.runRunner(run)
+        return self.finishTest(run, result, exc_info)
+
+    def prepareTest(self, extra_test_args):
+        """
+        Claim the resources for the current jobs and return the
+        arguments and environment of the runner and the paths of the
+        test's output. Return None if the job can not be run.
+        """
+
         self.debugMessage("testing firefox %s %s %s" % (self.branch, self.buildtype, self.testrun_row.socorro.url))
         #self.debugMessage('runTest: \n%s\n' % '\n'.join(tr.format_diff()))
         self.hung_process = False
@@ -137,10 +216,10 @@ class CrashTestWorker(worker.Worker):
         self.save()
 
         # kill any test processes still running.
-        test_process_dict = self.psTest()
+        test_process_dict = self.psTest(self.slot_dir)
         if test_process_dict:
             self.logMessage('runTest: test processes running before test')
-            self.killTest()
+            self.killTest(scope=self.slot_dir)
 
         socorro_row = self.testrun_row.socorro
 
@@ -154,42 +233,29 @@ class CrashTestWorker(worker.Worker):
             self.testrun_row.save()
             self.testrun_row  = None
             self.save()
-            return
+            return None
 
         self.testrun_row.changeset = self.build_row.changeset
         self.testrun_row.extra_test_args = extra_test_args
         self.testrun_row.save()
 
-        reAssertionFail    = re.compile(r'(Assertion failure: .*), at .*')
-        reMOZ_CRASH        = re.compile(r'(Hit MOZ_CRASH.*) at .*')
-        reABORT            = re.compile(r'###\!\!\! (ABORT: .*)')
-        reABORT2           = re.compile(r'###\!\!\! (ABORT: .*), file (.*), line [0-9]+.*')
-        reABORT3           = re.compile(r'###\!\!\! (ABORT: .*) file (.*), line [0-9]+.*')
-        reASSERTION        = re.compile(r'###\!\!\! ASSERTION: (.*), file (.*), line [0-9]+.*')
-        reValgrindLeader   = re.compile(r'^==[0-9]+==')
-        # AddressSanitizer patterns
-        # reAsanStart pid - group 1, message - group 2
-        reAsanStart        = re.compile(r'^==(\d+)==ERROR: (AddressSanitizer: .*)')
-        # reAsanEnd pid - group 1 must match, reason - group 2
-        reAsanEnd          = re.compile(r'^==(\d+)==(.*)')
-        # reAsanFrame frame number - group 1, address - group 2, funcdecl - group 3
-        reAsanFrame        = re.compile(r'^ {4}(#\d+) (0x[0-9a-fA-F]+) in (.*) [^ ]+$')
-        reAsanThread       = re.compile(r'Thread.*created by.*here:')
-        # rAsanSummary - reason - group 1
-        reAsanSummary      = re.compile(r'SUMMARY: AddressSanitizer: ([^ ]*)')
-        reAsan             = re.compile(r'AddressSanitizer')
-        reAsanBlank        = re.compile(r' *$')
-        rePanic            = re.compile(r"(thread '[^']+' panicked at '.*'),.*")
-
-        # buffers to hold assertions and valgrind messages until
-        # a test result is seen in the output.
-        assertion_dict = {}
-        valgrind_text  = ""
-        # There may be an Asan message for each process.
-        asan_list = []
-
-        # attempt to silence undefined errors if exception thrown during communicate.
-        stdout = ''
+        # In batch mode the urls of the other jobs in the batch are
+        # loaded after url in the same browser session.
+        urls = [url]
+        for batch_testrun_row in list(self.batch_testrun_rows):
+            try:
+                urls.append(utils.encodeUrl(batch_testrun_row.socorro.url)[:1000])
+            except Exception, e:
+                exceptionType, exceptionValue, errorMessage = utils.formatException()
+                self.logMessage('runTest: exception: %s, %s: url: %s' % (exceptionValue, errorMessage,
+                                                                          batch_testrun_row.socorro.url))
+                batch_testrun_row.state = 'completed'
+                batch_testrun_row.save()
+                self.batch_testrun_rows.remove(batch_testrun_row)
+                continue
+            batch_testrun_row.changeset = self.build_row.changeset
+            batch_testrun_row.extra_test_args = extra_test_args
+            batch_testrun_row.save()
 
         fatal_error = False
         buildspec = self.parse_buildspec(self.buildtype)
@@ -198,19 +264,30 @@ class CrashTestWorker(worker.Worker):
         else:
             branch = self.branch
 
-        profile_dir = '/tmp/firefox-%s' % branch
+        if self.slot_dir:
+            profile_dir = os.path.join(self.slot_dir, branch)
+        else:
+            profile_dir = '/tmp/firefox-%s' % branch
         if os.path.exists(profile_dir):
             shutil.rmtree(profile_dir)
-        os.mkdir(profile_dir)
-        minidumps_savepath = os.path.join(profile_dir, 'minidumps_save')
-        os.mkdir(minidumps_savepath)
+        os.makedirs(profile_dir)
+        # The minidumps are saved outside of the profile so that they
+        # survive until the test's results have been processed even if
+        # the next test has already started.
+        minidumps_dir = tempfile.mkdtemp(prefix='minidumps-')
+        minidumps_savepath = minidumps_dir
 
         (executablepath, symbolspath, preferencespath) = self.get_paths()
         symbolspath_save = symbolspath
 
+        # The job id keeps the names of tests started in the same
+        # second distinct.
         test_date = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-        logfilename = "%s/results/%s,%s,%s,%s,%s.log" % (
-            sisyphus_dir, test_date, self.branch, self.buildtype, self.os_id, self.hostname)
+        logfilename = "%s/results/%s,%s,%s,%s,%s,%s.log" % (
+            sisyphus_dir, test_date, self.branch, self.buildtype, self.os_id, self.hostname,
+            self.testrun_row.id)
+        if self.slot_dir:
+            logfilename = logfilename.replace('.log', '-slot%d.log' % self.slot)
         baselogfilename = os.path.basename(logfilename)
         loguploadpath = 'logs/' + baselogfilename[:16].replace('-', '/') # CCYY/MM/DD/HH/MM
         dmpuploadpath = 'minidumps/' + baselogfilename[:16].replace('-', '/') # CCYY/MM/DD/HH/MM
@@ -222,6 +299,13 @@ class CrashTestWorker(worker.Worker):
         geckologfile.close()
         geckologfilename = geckologfile.name
 
+        urlfilename = None
+        if self.batch_testrun_rows:
+            urlfile = tempfile.NamedTemporaryFile(mode='w', prefix='urls-', delete=False)
+            urlfile.write(''.join(['%s\n' % batch_url for batch_url in urls]))
+            urlfile.close()
+            urlfilename = urlfile.name
+
         args = []
         runnerpath = "%s/python/sisyphus/automation/runner.py" % sisyphus_dir
         stackwalk_binarypath = os.environ["MINIDUMP_STACKWALK"]
@@ -238,10 +322,17 @@ class CrashTestWorker(worker.Worker):
             stackwalk_binarypath = subprocess.check_output(["cygpath", "-w", stackwalk_binarypath]).strip()
             symbolspath = subprocess.check_output(["cygpath", "-w", symbolspath]).strip()
             minidumps_savepath = subprocess.check_output(["cygpath", "-w", minidumps_savepath]).strip()
+            if self.profile_template_dir:
+                profiletemplatepath = subprocess.check_output(["cygpath", "-w", self.profile_template_dir]).strip()
             geckologfilepath = subprocess.check_output(["cygpath", "-w", geckologfilename]).strip()
+            if self.batch_testrun_rows:
+                urlfilepath = subprocess.check_output(["cygpath", "-w", urlfilename]).strip()
         else:
             profilepath = profile_dir
+            profiletemplatepath = self.profile_template_dir
             geckologfilepath = geckologfilename
+            if self.batch_testrun_rows:
+                urlfilepath = urlfilename
             args.extend(["python"])
 
         args.extend([
@@ -263,13 +354,23 @@ class CrashTestWorker(worker.Worker):
             "--symbols-path",
             symbolspath,
         ])
-
-        timed_run_args = [
-            "python",
-            sisyphus_dir + "/bin/timed_run.py",
-            "300",
-            "-",
-        ] + args
+        if self.adaptive_wait:
+            args.append("--adaptive-wait")
+        if self.profile_template_dir:
+            args.extend([
+                "--profile-template",
+                profiletemplatepath,
+            ])
+        if self.slot_dir:
+            args.extend([
+                "--marionette-port",
+                "%s" % self.marionette_port,
+            ])
+        if self.batch_testrun_rows:
+            args.extend([
+                "--url-file",
+                urlfilepath,
+            ])
 
         # set up environment.
         environment = dict(os.environ)
@@ -317,53 +418,106 @@ class CrashTestWorker(worker.Worker):
         self.debugMessage('Running test: %s' % args)
         #self.debugMessage('runTest before runner: \n%s\n' % '\n'.join(tr.format_diff()))
 
+        return {
+            'url'               : url,
+            'urls'              : urls,
+            'profile_dir'       : profile_dir,
+            'extra_test_args'   : extra_test_args,
+            'args'              : args,
+            'environment'       : environment,
+            'fatal_error'       : fatal_error,
+            'logfilename'       : logfilename,
+            'baselogfilename'   : baselogfilename,
+            'loguploadpath'     : loguploadpath,
+            'dmpuploadpath'     : dmpuploadpath,
+            'geckologfilename'  : geckologfilename,
+            'urlfilename'       : urlfilename,
+            'symbolspath'       : symbolspath,
+            'symbolspath_save'  : symbolspath_save,
+            'minidumps_dir'     : minidumps_dir,
+            'minidumps_savepath': minidumps_savepath,
+            }
+
+    def runRunner(self, run):
+        """
+        Run the runner prepared by prepareTest and return the
+        TimedCommandResult and the exception info of any exception
+        raised. This does not use the database so that it can be run
+        in a slot's thread.
+
+        The output of the runner is written to the log as it is read.
+        Only its tail is kept in the result. The minidumps written
+        while the runner runs are recorded in run['minidump_events'].
+        """
+
         try:
-            # When a stuck plugin-container process or other process
-            # spawned by the test is not killed by the normal time out
-            # procedure, we need to kill the process ourselves. Fire
-            # the time out alarm 30 seconds after the test should have
-            # timed out.
-            def timeout_handler(signum, frame):
-                self.logMessage("runTest: %s timed out" % url)
-                self.hung_process = True
-                self.killTest(proc.pid)
-
-            proc = subprocess.Popen(
-                timed_run_args,
-                preexec_fn=lambda : os.setpgid(0,0), # make the process its own process group
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                close_fds=True,
-                env=environment)
-
-            default_alarm_handler = signal.getsignal(signal.SIGALRM)
+            # In batch mode the runner restarts the browser after a
+            # crash, so the test is not ended early.
+            exitdelay = self.crash_exit_delay
+            if run['urlfilename']:
+                exitdelay = None
+            watcher = minidumpwatcher.MinidumpWatcher([os.path.join(run['profile_dir'], 'minidumps'),
+                                                       run['minidumps_dir']],
+                                                      exitdelay)
+            run['minidump_events'] = watcher.events
+            logfile = open(run['logfilename'], 'w')
+            watcher.start()
             try:
-                signal.signal(signal.SIGALRM, timeout_handler)
-                signal.alarm(self.site_timeout + 60)
-                stdout = ''
-                while proc.poll() is None:
-                    stdout += proc.stdout.readline()
+                if not run['urlfilename']:
+                    # In batch mode splitBatchResults writes the
+                    # header of each job's log.
+                    logfile.write("\n==== Marionette Log ====\n\n")
+                    logfile.write("%s\n\n" % run['args'])
+                # The runner and any processes it spawned in its process
+                # group are killed if the site has not completed within
+                # the site timeout or its output is too large.
+                result = utils.runTimedCommand(run['args'], self.site_timeout * len(run['urls']),
+                                               env=run['environment'], stderr=subprocess.STDOUT,
+                                               outputfile=logfile, maxsize=self.max_log_size,
+                                               stopevent=watcher.stopevent)
+            finally:
+                watcher.stop()
+                logfile.close()
+            return (result, None)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            return (None, sys.exc_info())
+
+    def finishTest(self, run, result, exc_info):
+        """
+        Handle the outcome of the runner and return the results of
+        each job which was run for processTestResults.
+        """
+
+        url = run['url']
+
+        # attempt to silence undefined errors if exception thrown during communicate.
+        stdout = ''
+        test_pid = None
+
+        try:
+            try:
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                stdout = result.stdout
+                test_pid = result.pid
+                if result.timedout:
+                    self.logMessage("runTest: %s timed out" % url)
+                    self.hung_process = True
+                if result.oversize:
+                    self.logMessage("runTest: %s total test output exceeded limit: %d" %
+                                    (url, result.outputsize))
+                for (elapsedtime, dumppath) in run.get('minidump_events', []):
+                    self.logMessage("runTest: %s minidump %s after %.1f seconds" %
+                                    (url, os.path.basename(dumppath), elapsedtime))
+                if result.stopped:
+                    self.logMessage("runTest: %s stopped %d seconds after the first minidump" %
+                                    (url, self.crash_exit_delay))
             except OSError, oserror:
                 if oserror.errno != 10:
                     raise
                 # Ignore OSError 10: No child process
-            finally:
-                signal.alarm(0)
-                signal.signal(signal.SIGALRM, default_alarm_handler)
-                line = proc.stdout.readline()
-                while line:
-                    stdout += line
-                    try:
-                        line = proc.stdout.readline()
-                    except OSError, e:
-                        if e.errno == 11:
-                            # Resource temporarily unavailable
-                            # try once more but don't raise the error.
-                            try:
-                                line = proc.stdout.readline()
-                            except Exception:
-                                (etype, evalue, etraceback) = utils.formatException()
-                                self.debugMessage("runTest: %s" % etraceback)
         except (KeyboardInterrupt, SystemExit):
             raise
         except Exception, e:
@@ -404,10 +558,167 @@ class CrashTestWorker(worker.Worker):
 
         #self.debugMessage('runTest after runner: \n%s\n' % '\n'.join(tr.format_diff()))
 
-        logfile = open(logfilename, "w")
-        logfile.write("\n==== Marionette Log ====\n\n")
-        logfile.write("%s\n\n" % args)
-        logfile.write(stdout)
+        test_process_dict = self.psTest(self.slot_dir)
+        if test_process_dict:
+            self.hung_process = True
+            self.logMessage('runTest: %s, test processes still running' % url)
+            self.killTest(test_pid, self.slot_dir)
+
+        if not self.batch_testrun_rows:
+            # Firefox's minidumps are left in the profile if the
+            # runner was ended before it could save them.
+            profile_minidumps_dir = os.path.join(run['profile_dir'], 'minidumps')
+            if os.path.isdir(profile_minidumps_dir):
+                for dumpname in os.listdir(profile_minidumps_dir):
+                    if os.path.splitext(dumpname)[1] in ('.dmp', '.extra'):
+                        shutil.move(os.path.join(profile_minidumps_dir, dumpname), run['minidumps_dir'])
+
+        test = dict(run)
+        del test['environment']
+        test['stdout'] = stdout
+
+        if self.batch_testrun_rows:
+            os.unlink(run['urlfilename'])
+            return self.splitBatchResults(run['urls'], test)
+
+        test['testrun_row'] = self.testrun_row
+        test['hung_process'] = self.hung_process
+        return [test]
+
+    def splitBatchResults(self, urls, batch):
+        """
+        Split the runner output, gecko log and minidumps of a batch
+        run at the url markers written by runner.py and return the
+        results of each job which was started. Jobs which were not
+        started are returned to the waiting pool.
+        """
+
+        reURLMarker = re.compile(r'Sisyphus Runner: URL (START|END) ([0-9]+)(?: (.*))?')
+
+        # Copy the gecko log of each job into its own file as the
+        # markers are read rather than collecting it in memory.
+        geckologfiles = [tempfile.NamedTemporaryFile(mode='w', delete=False)
+                         for index in range(len(urls))]
+        geckologfile = open(batch['geckologfilename'], 'r')
+        index = 0
+        for line in geckologfile:
+            match = reURLMarker.search(line)
+            if match and match.group(1) == 'START':
+                index = int(match.group(2))
+            if index < len(geckologfiles):
+                geckologfiles[index].write(line)
+        geckologfile.close()
+        os.unlink(batch['geckologfilename'])
+        for geckologfile in geckologfiles:
+            geckologfile.close()
+
+        # Copy the runner output of each job from the batch log into
+        # the job's own log without reading the whole output.
+        logfilenames = [batch['logfilename'].replace('.log', '-%d.log' % index)
+                        for index in range(len(urls))]
+        logfiles = []
+        for logfilename in logfilenames:
+            logfile = open(logfilename, 'w')
+            logfile.write("\n==== Marionette Log ====\n\n")
+            logfile.write("%s\n\n" % batch['args'])
+            logfiles.append(logfile)
+
+        started = set()
+        statuses = {}
+        index = 0
+        if os.path.exists(batch['logfilename']):
+            batchlogfile = open(batch['logfilename'], 'r')
+            for line in batchlogfile:
+                match = reURLMarker.search(line)
+                if match:
+                    if match.group(1) == 'START':
+                        index = int(match.group(2))
+                        started.add(index)
+                    else:
+                        statuses[int(match.group(2))] = match.group(3)
+                if index < len(logfiles):
+                    logfiles[index].write(line)
+            batchlogfile.close()
+            os.unlink(batch['logfilename'])
+        for logfile in logfiles:
+            logfile.close()
+
+        testrun_rows = [self.testrun_row] + self.batch_testrun_rows
+        last_started = max(started) if started else None
+        tests = []
+        for index, testrun_row in enumerate(testrun_rows):
+            if index not in started:
+                self.logMessage('runTest: %s not started, returning to waiting' % urls[index])
+                testrun_row.state = 'waiting'
+                testrun_row.worker = None
+                testrun_row.save()
+                os.unlink(logfilenames[index])
+                os.unlink(geckologfiles[index].name)
+                continue
+
+            # Move the job's minidumps into their own directory so
+            # that each job can remove them once processed.
+            minidumps_dir = tempfile.mkdtemp(prefix='minidumps-')
+            url_minidumps_dir = os.path.join(batch['minidumps_dir'], str(index))
+            if os.path.isdir(url_minidumps_dir):
+                for dumpname in os.listdir(url_minidumps_dir):
+                    shutil.move(os.path.join(url_minidumps_dir, dumpname), minidumps_dir)
+
+            # The job which was loading when the runner was killed or
+            # which left processes running is the one which hung.
+            hung_process = (statuses.get(index) in (None, 'TIMED OUT') or
+                            (self.hung_process and index == last_started))
+
+            logfilename = logfilenames[index]
+            test = dict(batch)
+            test.update({
+                'testrun_row'       : testrun_row,
+                'hung_process'      : hung_process,
+                'url'               : urls[index],
+                'logfilename'       : logfilename,
+                'baselogfilename'   : os.path.basename(logfilename),
+                'geckologfilename'  : geckologfiles[index].name,
+                'minidumps_dir'     : minidumps_dir,
+                'minidumps_savepath': minidumps_dir,
+                })
+            tests.append(test)
+
+        shutil.rmtree(batch['minidumps_dir'], True)
+        if self.testrun_row not in [test['testrun_row'] for test in tests]:
+            self.testrun_row = None
+        self.batch_testrun_rows = [test['testrun_row'] for test in tests
+                                   if test['testrun_row'] is not self.testrun_row]
+        return tests
+
+    def processTestResults(self, test):
+        """
+        Scan the logs and process the minidumps of a test run by
+        runTest, upload its log and create the reproducer jobs for any
+        crashes. In pipelined mode this is called on a copy of the
+        worker in the post processing thread while the next test runs.
+        """
+
+        url              = test['url']
+        extra_test_args  = test['extra_test_args']
+        args             = test['args']
+        fatal_error      = test['fatal_error']
+        logfilename      = test['logfilename']
+        baselogfilename  = test['baselogfilename']
+        loguploadpath    = test['loguploadpath']
+        dmpuploadpath    = test['dmpuploadpath']
+        geckologfilename = test['geckologfilename']
+        symbolspath      = test['symbolspath']
+        symbolspath_save = test['symbolspath_save']
+
+        # buffers to hold assertions and valgrind messages until
+        # a test result is seen in the output.
+        assertion_dict = {}
+        valgrind_text  = ""
+        # There may be an Asan message for each process.
+        asan_list = []
+
+        # The runner output has already been written to the log.
+        logfile = open(logfilename, "a")
         logfile.write("\n==== Gecko Log ====\n\n")
 
         try:
@@ -423,22 +734,28 @@ class CrashTestWorker(worker.Worker):
             #    ])
 
             geckologfile = open(geckologfilename, "r")
-            for line in iter(geckologfile.readline, ''):
-                if self.os_name == "Windows NT":
-                    # Convert backslashes on Windows into slashes which
-                    # makes the path compatible with cygwin.
-                    line = re.sub(r'\\', '/', line)
-                try:
-                    line = fix_stack_using_bpsyms.fixSymbols(line, symbolspath_save)
-                except:
-                    (etype, evalue, etraceback) = utils.formatException()
-                    self.debugMessage("Exception: %s" % etraceback)
-                logfile.write(line)
-                # decode to unicode
-                line = utils.makeUnicodeString(line)
-
-                match = reAsanStart.match(line)
-                if match:
+            geckolines = geckologfile
+            if self.os_name == "Windows NT":
+                # Convert backslashes on Windows into slashes which
+                # makes the path compatible with cygwin.
+                geckolines = (line.replace('\\', '/') for line in geckolines)
+            # Symbolicate the log a window at a time so that the
+            # addresses of each module in a stack are resolved in a
+            # single batch without reading the whole log into memory.
+            symbol_errors = []
+            geckolines = fix_stack_using_bpsyms.fixSymbolsInWindows(geckolines, symbolspath_save, symbol_errors)
+
+            def loggedlines(lines):
+                for line in lines:
+                    logfile.write(line)
+                    yield line
+
+            def fatal_message_set():
+                return bool(self.testrun_row.fatal_message)
+
+            for (event, match, line) in geckolog.scan_lines(loggedlines(geckolines), fatal_message_set):
+
+                if event == 'asan_start':
                     asan_list.append({
                         'pid': match.group(1),
                         'error': match.group(2),
@@ -452,70 +769,33 @@ class CrashTestWorker(worker.Worker):
                         self.testrun_row.fatal_message = match.group(2).rstrip()
                     else:
                         self.testrun_row.fatal_message += ' | ' + match.group(2).rstrip()
-                    continue
-                if asan_list and not asan_list[-1]['completed']:
-                    match = reAsanFrame.match(line)
-                    if match:
-                        asan_list[-1]['text'] += line
-                        if not asan_list[-1]['frames_collected']:
-                            asan_list[-1]['frames'].append(match.group(3))
-                        continue
-                    match = reAsanBlank.match(line)
-                    if match:
-                        asan_list[-1]['text'] += line
-                    match = reAsan.match(line)
-                    if match:
-                        asan_list[-1]['text'] += line
-                        continue
-                    match = reAsanThread.match(line)
-                    if match:
-                        asan_list[-1]['text'] += line
-                        continue
-                    match = reAsanSummary.match(line)
-                    if match:
-                        asan_list[-1]['text'] += line
-                        asan_list[-1]['reason'] = match.group(1)
-                        asan_list[-1]['frames_collected'] = True
-                        continue
-                    if not asan_list[-1]['reason']:
-                        # ignore lines such as ==7924==WARNING: ...
-                        match = reAsanEnd.match(line)
-                        if match:
-                            if match.group(1) != asan_list[-1]['pid']:
-                                self.debugMessage('Asan pid %s mismatch %s: %s' % (
-                                    match.group(1), asan_list[-1]['pid'], line))
-                            asan_list[-1]['completed'] = True
-                            asan_list[-1]['text'] += line
-
-                # Collect the first occurrence of a fatal message
-                match = reAssertionFail.search(line)
-                if match and not self.testrun_row.fatal_message:
-                    self.testrun_row.fatal_message = match.group(1)
-                    continue
 
-                match = reMOZ_CRASH.search(line)
-                if match and not self.testrun_row.fatal_message:
-                    self.testrun_row.fatal_message = match.group(1)
-                    continue
+                elif event == 'asan_frame':
+                    asan_list[-1]['text'] += line
+                    if not asan_list[-1]['frames_collected']:
+                        asan_list[-1]['frames'].append(match.group(3))
 
-                match = rePanic.search(line)
-                if match and not self.testrun_row.fatal_message:
-                    self.testrun_row.fatal_message = match.group(1)
-                    continue
+                elif event == 'asan_text':
+                    asan_list[-1]['text'] += line
 
-                match = reABORT.search(line)
-                if match and not self.testrun_row.fatal_message:
-                    self.testrun_row.fatal_message = match.group(1).rstrip()
-                    match = reABORT2.search(line)
-                    if match:
-                        self.testrun_row.fatal_message = match.group(1)
-                    match = reABORT3.search(line)
-                    if match:
-                        self.testrun_row.fatal_message = match.group(1)
-                    continue
+                elif event == 'asan_summary':
+                    asan_list[-1]['text'] += line
+                    asan_list[-1]['reason'] = match.group(1)
+                    asan_list[-1]['frames_collected'] = True
 
-                match = reASSERTION.search(line)
-                if match:
+                elif event == 'asan_end':
+                    if match.group(1) != asan_list[-1]['pid']:
+                        self.debugMessage('Asan pid %s mismatch %s: %s' % (
+                            match.group(1), asan_list[-1]['pid'], line))
+                    asan_list[-1]['completed'] = True
+                    asan_list[-1]['text'] += line
+
+                elif event in ('assertion_failure', 'moz_crash', 'panic', 'abort'):
+                    # Collect the first occurrence of a fatal message
+                    if not self.testrun_row.fatal_message:
+                        self.testrun_row.fatal_message = geckolog.fatal_message(match)
+
+                elif event == 'assertion':
                     # record the assertion for later output when we know the test
                     assertionmessage = match.group(1)
                     assertionfile    = re.sub('^([a-zA-Z]:/|/[a-zA-Z]/)', '/', re.sub(r'\\', '/', match.group(2)))
@@ -529,20 +809,20 @@ class CrashTestWorker(worker.Worker):
                             "stack"  : "", # need to collect stack
                             "count"  : 1
                             }
-                    continue
 
-                match = reValgrindLeader.match(line)
-                if match:
+                elif event == 'valgrind':
                     valgrind_text += line
-                    continue
+
+            for error in symbol_errors:
+                self.debugMessage("Exception: fixSymbolsInLines: %s" % error)
 
         except Exception:
             (etype, evalue, etraceback) = utils.formatException()
             self.logMessage("Exception: %s" % etraceback)
         finally:
-            # Reset the parsedSymbolFiles between crashes, otherwise
-            # it grows without bound.
-            fix_stack_using_bpsyms.parsedSymbolFiles = {}
+            # The symbol cache is bounded by --symbol-cache-size and is
+            # kept across tests on the same build.
+            self.debugMessage(fix_stack_using_bpsyms.symbolCache.stats())
             # process any assertion or valgrind messages.
             #self.debugMessage('runTest after log processing: \n%s\n' % '\n'.join(tr.format_diff()))
             self.process_assertions(assertion_dict, url, "crashtest", extra_test_args)
@@ -555,13 +835,14 @@ class CrashTestWorker(worker.Worker):
                 self.logMessage("%s: Unable to remove %s" % (e, geckologfilename))
             symbolsPathList = [symbolspath]
             symbolsPathList.extend(self.symbols_paths)
-            crash_reports = self.process_dump_files(minidumps_savepath,
+            crash_reports = self.process_dump_files(test['minidumps_savepath'],
                                                     url,
                                                     symbolsPathList,
                                                     dmpuploadpath)
             if crash_reports:
                 self.logMessage("crashed firefox %s %s %s" % (self.branch, self.buildtype, self.testrun_row.socorro.url))
             logfile.close()
+            shutil.rmtree(test['minidumps_dir'], True)
 
         if self.testrun_row.fatal_message:
             # remove any trailing commas or colons and convert any raw hex addresses to 0x
@@ -592,13 +873,7 @@ class CrashTestWorker(worker.Worker):
         uploader.add('log', baselogfilename, logfilename, True)
         self.testrun_row = uploader.send()
 
-        test_process_dict = self.psTest()
-        if test_process_dict:
-            self.hung_process = True
-            self.logMessage('runTest: %s, test processes still running' % url)
-            self.killTest(proc.pid)
-
-        if self.hung_process:
+        if test['hung_process']:
             if self.testrun_row.exitstatus:
                 self.testrun_row.exitstatus += ' HANG'
             else:
@@ -790,6 +1065,234 @@ class CrashTestWorker(worker.Worker):
                 self.logMessage('runTest: unable to duplicate signature %s for reproduction: %s' % (self.testrun_row, errorMessage))
 
 
+    def processTests(self, tests):
+        """
+        Process the results of each test returned by runTest and
+        complete its job.
+        """
+
+        while tests:
+            test = tests.pop(0)
+            self.testrun_row = test['testrun_row']
+            self.batch_testrun_rows = [batch_test['testrun_row'] for batch_test in tests]
+            if self.postprocess_queue:
+                self.queuePostProcessing(test)
+            else:
+                self.processTestResults(test)
+                if tests:
+                    self.testrun_row.state = 'completed'
+                    self.testrun_row.save()
+                    self.testrun_row = None
+        if self.testrun_row:
+            self.testrun_row.state = 'completed'
+            self.testrun_row.save()
+
+    def startSlot(self, extra_test_args):
+        """
+        Start the runner for the current jobs in a free slot. The
+        runner is run in a thread while the database work for the
+        slot is done by the main thread in finishSlot.
+        """
+
+        slot = [free_slot for free_slot in range(self.slots)
+                if free_slot not in self.active_slots][0]
+
+        slotworker = copy.copy(self)
+        slotworker.slot = slot
+        slotworker.slot_dir = '/tmp/firefox-worker%d-slot%d/' % (self.worker_row.id, slot)
+        slotworker.marionette_port = self.marionette_port + slot
+
+        run = slotworker.prepareTest(extra_test_args)
+        # The jobs now belong to the slot.
+        self.testrun_row = None
+        self.batch_testrun_rows = []
+        if not run:
+            slotworker.releaseJobBatch()
+            return
+
+        outcome = {}
+        def run_slot():
+            outcome['result'] = slotworker.runRunner(run)
+
+        slot_thread = threading.Thread(target=run_slot)
+        slot_thread.daemon = True
+        slot_thread.start()
+        self.active_slots[slot] = (slotworker, run, slot_thread, outcome)
+
+    def finishSlot(self, slot):
+        """
+        Process the results of the runner which has completed in slot.
+        """
+
+        (slotworker, run, slot_thread, outcome) = self.active_slots[slot]
+        try:
+            (result, exc_info) = outcome.get('result', (None, None))
+            slotworker.processTests(slotworker.finishTest(run, result, exc_info))
+            slotworker.testrun_row = None
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            exceptionType, exceptionValue, errorMessage = utils.formatException()
+            if str(exceptionValue) == 'CrashWorker.runTest.FatalError':
+                raise
+            self.logMessage("finishSlot: error in slot %d. %s url: %s, exception: %s" %
+                            (slot, exceptionValue, run['url'], errorMessage))
+
+            try:
+                self.reloadProgram()
+            except:
+                pass
+            # Exit if we can't restart the program.
+            sys.exit(2)
+        finally:
+            if slotworker.testrun_row:
+                slotworker.testrun_row.state = 'waiting'
+                slotworker.testrun_row.save()
+                slotworker.testrun_row = None
+            slotworker.releaseJobBatch()
+            self.active_slots.pop(slot, None)
+
+    def checkSlots(self):
+        """
+        Finish each slot whose runner has completed.
+        """
+
+        for slot in sorted(self.active_slots.keys()):
+            if not self.active_slots[slot][2].isAlive():
+                self.finishSlot(slot)
+
+    def waitForSlots(self):
+        """
+        Wait until every slot has been finished. Called before the
+        build or the program is replaced.
+        """
+
+        while self.active_slots:
+            self.checkSlots()
+            if self.active_slots:
+                time.sleep(1)
+
+    def releaseSlots(self):
+        """
+        Kill the test processes of each active slot and return its
+        jobs to the waiting pool.
+        """
+
+        for slot in sorted(self.active_slots.keys()):
+            slotworker = self.active_slots.pop(slot)[0]
+            try:
+                slotworker.killTest(scope=slotworker.slot_dir)
+            except:
+                pass
+            if slotworker.testrun_row:
+                slotworker.testrun_row.state = 'waiting'
+                slotworker.testrun_row.worker = None
+                slotworker.testrun_row.save()
+                slotworker.testrun_row = None
+            slotworker.releaseJobBatch()
+
+    def queuePostProcessing(self, test):
+        """
+        Hand the current test run to the post processing thread. The
+        job remains executing until its results have been processed.
+        """
+
+        # Process the results on a copy of the worker so that the
+        # test run and build attributes do not change underneath it
+        # when the next job is claimed.
+        postprocessor = copy.copy(self)
+        while True:
+            try:
+                # Use a timeout so that signals are still delivered.
+                self.postprocess_queue.put((postprocessor, test), True, 1)
+                break
+            except Queue.Full:
+                pass
+        self.testrun_row = None
+
+    def postProcessTests(self):
+        while True:
+            (postprocessor, test) = self.postprocess_queue.get()
+            try:
+                postprocessor.processTestResults(test)
+                postprocessor.testrun_row.state = 'completed'
+                postprocessor.testrun_row.save()
+            except:
+                exceptionType, exceptionValue, errorMessage = utils.formatException()
+                self.logMessage("postProcessTests: error processing %s url: %s, exception: %s" %
+                                (postprocessor.testrun_row, test['url'], errorMessage))
+                try:
+                    if postprocessor.testrun_row:
+                        postprocessor.testrun_row.state = 'waiting'
+                        postprocessor.testrun_row.worker = None
+                        postprocessor.testrun_row.save()
+                except:
+                    pass
+                self.postprocess_exception = exceptionValue
+            finally:
+                self.postprocess_queue.task_done()
+
+    def checkPostProcessing(self):
+        """
+        Handle a failure in the post processing thread as doWork
+        handles a failure in runTest.
+        """
+
+        exceptionValue = self.postprocess_exception
+        if exceptionValue is None:
+            return
+        self.postprocess_exception = None
+        if str(exceptionValue) == 'CrashWorker.runTest.FatalError':
+            raise exceptionValue
+        try:
+            self.reloadProgram()
+        except:
+            pass
+        # Exit if we can't restart the program.
+        sys.exit(2)
+
+    def waitForPostProcessing(self):
+        """
+        Wait until the results of every queued test have been
+        processed. Called before the build or the program is replaced.
+        """
+
+        if not self.postprocess_queue:
+            return
+        while self.postprocess_queue.unfinished_tasks:
+            time.sleep(1)
+        self.checkPostProcessing()
+
+    def releasePostProcessing(self, timeout=900):
+        """
+        Wait up to timeout seconds for the queued tests to be
+        processed then return the jobs of the tests still queued to the
+        waiting pool. Called before the program is reloaded or exits
+        since the post processing thread dies with it.
+        """
+
+        if not self.postprocess_queue:
+            return
+        deadline = time.time() + timeout
+        while self.postprocess_queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(1)
+        while True:
+            try:
+                (postprocessor, test) = self.postprocess_queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                self.logMessage('releasePostProcessing: %s url: %s not processed, returning to waiting' %
+                                (postprocessor.testrun_row, test['url']))
+                if postprocessor.testrun_row:
+                    postprocessor.testrun_row.state = 'waiting'
+                    postprocessor.testrun_row.worker = None
+                    postprocessor.testrun_row.save()
+            except:
+                pass
+            finally:
+                self.postprocess_queue.task_done()
+
     def reloadProgram(self, db_available=True):
 
         if db_available and self.testrun_row:
@@ -798,6 +1301,11 @@ class CrashTestWorker(worker.Worker):
             self.testrun_row.save()
             self.testrun_row = None
 
+        if db_available:
+            self.releaseJobBatch()
+            self.releaseSlots()
+            self.releasePostProcessing()
+
         worker.Worker.reloadProgram(self, db_available=db_available)
 
     def freeOrphanJobs(self):
@@ -840,62 +1348,87 @@ class CrashTestWorker(worker.Worker):
         """
         return a signature unprocessed by this worker
         matches on priority, os_name, cpu_name, os_version.
+
+        The job is claimed with a single UPDATE which only changes a
+        waiting row so that workers do not need to lock each other
+        out. LAST_INSERT_ID(id) records the id of the claimed row.
         """
 
+        buildspecs = self.buildspecs.split(',')
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE SiteTestRun "
+            "SET id = LAST_INSERT_ID(id), worker_id = %s, state = 'executing', datetime = %s "
+            "WHERE state = 'waiting' AND priority IN ('0', '1', '3') AND "
+            "os_name = %s AND os_version = %s AND cpu_name = %s AND build_cpu_name = %s AND "
+            "buildtype IN (" + ', '.join(['%s'] * len(buildspecs)) + ") "
+            "ORDER BY priority LIMIT 1",
+            [self.worker_row.id, datetime.datetime.now(),
+             self.os_name, self.os_version, self.cpu_name, self.build_cpu_name] + buildspecs)
+
         sitetestrun_row = None
-        locktimeout     = 300
-
-        for priority in 0, 1, 3:
-            # Randomize the order we process buildspecs to reduce
-            # lock contentions.
-            buildspecs = self.buildspecs.split(',')
-            random.shuffle(buildspecs)
-            for buildspec in buildspecs:
-                lock_name = 'sitetestrun_%s_%s_%s_%s_%s_%s_%s' % (
-                    priority,
-                    "waiting",
-                    self.os_name,
-                    self.os_version,
-                    self.cpu_name,
-                    self.build_cpu_name,
-                    buildspec)
-                lock_name = re.sub('[^\w]+', '_', lock_name)
-
-                if not utils.getLock(lock_name, locktimeout):
-                    self.debugMessage("getJob: lock timed out %s" % lock_name)
-                else:
-                    try:
-                        sitetestrun_row = models.SiteTestRun.objects.filter(
-                            priority__exact = str(priority),
-                            state__exact = "waiting",
-                            os_name__exact = self.os_name,
-                            os_version__exact = self.os_version,
-                            cpu_name__exact = self.cpu_name,
-                            build_cpu_name__exact = self.build_cpu_name,
-                            buildtype__exact = buildspec
-                        )[0]
-                        sitetestrun_row.worker = self.worker_row
-                        sitetestrun_row.state = 'executing'
-                        sitetestrun_row.save()
+        if cursor.rowcount == 1:
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            sitetestrun_row = models.SiteTestRun.objects.get(pk = cursor.fetchone()[0])
+
+        self.debugMessage('getJob: %s' % sitetestrun_row)
 
-                    except IndexError:
-                        sitetestrun_row = None
+        return sitetestrun_row
 
-                    except models.SiteTestRun.DoesNotExist:
-                        sitetestrun_row = None
+    def getJobBatch(self, sitetestrun_row, count):
+        """
+        return up to count more waiting jobs which can be run in the
+        same browser session as sitetestrun_row.
 
-                    finally:
-                        lockDuration = utils.releaseLock(lock_name)
-                        if lockDuration > datetime.timedelta(seconds=5):
-                            self.logMessage("getJobs: releaseLock(%s) duration: %s" % (lock_name, lockDuration))
-                        self.debugMessage('getJob: %s %s' % (sitetestrun_row, lockDuration))
+        Each job is claimed with an UPDATE which only changes a
+        waiting row, so a job taken by another worker in the meantime
+        is skipped.
+        """
 
-                if sitetestrun_row:
+        sitetestrun_rows = []
+        if count <= 0:
+            return sitetestrun_rows
+
+        candidate_rows = models.SiteTestRun.objects.filter(
+            priority__exact = sitetestrun_row.priority,
+            state__exact = "waiting",
+            os_name__exact = self.os_name,
+            os_version__exact = self.os_version,
+            cpu_name__exact = self.cpu_name,
+            build_cpu_name__exact = self.build_cpu_name,
+            product__exact = sitetestrun_row.product,
+            branch__exact = sitetestrun_row.branch,
+            buildtype__exact = sitetestrun_row.buildtype
+        )[:2*count]
+        for batch_row in candidate_rows:
+            claimed = models.SiteTestRun.objects.filter(
+                pk = batch_row.pk,
+                state__exact = "waiting").update(worker = self.worker_row,
+                                                 state = 'executing',
+                                                 datetime = datetime.datetime.now())
+            if claimed:
+                batch_row.worker = self.worker_row
+                batch_row.state = 'executing'
+                sitetestrun_rows.append(batch_row)
+                if len(sitetestrun_rows) == count:
                     break
-            if sitetestrun_row:
-                break
 
-        return sitetestrun_row
+        self.debugMessage('getJobBatch: %d jobs' % len(sitetestrun_rows))
+
+        return sitetestrun_rows
+
+    def releaseJobBatch(self):
+        """
+        Return the jobs claimed by getJobBatch which have not been
+        processed to the waiting pool.
+        """
+
+        for batch_row in self.batch_testrun_rows:
+            batch_row.state = 'waiting'
+            batch_row.worker = None
+            batch_row.save()
+        self.batch_testrun_rows = []
 
     def doWork(self):
 
@@ -914,7 +1447,15 @@ class CrashTestWorker(worker.Worker):
             #self.debugMessage(mem_top())
             #self.debugMessage('doWork: \n%s\n' % '\n'.join(tr.format_diff()))
 
+            self.checkPostProcessing()
+            self.checkSlots()
+
             if datetime.datetime.now() - last_checkup_time > checkup_interval:
+                if program_info.changed():
+                    # Finish the running and queued tests before
+                    # checkForUpdate reloads the program.
+                    self.waitForSlots()
+                    self.waitForPostProcessing()
                 self.checkForUpdate()
                 last_checkup_time = datetime.datetime.now()
 
@@ -937,7 +1478,14 @@ class CrashTestWorker(worker.Worker):
             time.sleep(waittime)
             waittime = 0
 
+            if len(self.active_slots) >= self.slots:
+                waittime = 1
+                continue
+
             self.testrun_row = self.getJob()
+            if not self.testrun_row and self.active_slots:
+                waittime = 1
+                continue
             if not self.testrun_row:
                 if self.state != "waiting":
                     self.logMessage('No signatures available to process, going idle.')
@@ -953,6 +1501,8 @@ class CrashTestWorker(worker.Worker):
             build_needed = self.isNewBuildNeeded(build_checkup_interval)
 
             if build_needed:
+                self.waitForSlots()
+                self.waitForPostProcessing()
                 if self.isBuilder:
                     if self.tinderbox:
                         self.getTinderboxProduct()
@@ -975,14 +1525,17 @@ class CrashTestWorker(worker.Worker):
             if self.state == "waiting":
                 self.logMessage('New signatures available to process, going active.')
 
+            self.batch_testrun_rows = self.getJobBatch(self.testrun_row, self.batch_size - 1)
+
             try:
                 # XXX: extra_test_args should be something to pass parameters to the
                 # test process.
                 extra_test_args = None
-                self.runTest(extra_test_args)
-                if self.testrun_row:
-                    self.testrun_row.state = 'completed'
-                    self.testrun_row.save()
+                if self.slots > 1:
+                    self.startSlot(extra_test_args)
+                    continue
+                tests = self.runTest(extra_test_args)
+                self.processTests(tests)
                 self.state            = 'completed'
                 self.testrun_row  = None
                 self.save()
@@ -1005,6 +1558,7 @@ class CrashTestWorker(worker.Worker):
                 if self.testrun_row:
                     self.testrun_row.state = 'waiting'
                     self.testrun_row.save()
+                self.releaseJobBatch()
                 self.state            = 'completed'
                 self.testrun_row  = None
                 self.save()
@@ -1064,6 +1618,12 @@ def main():
                        help='Space delimited list of paths to third party symbols. Defaults to /mozilla/flash-symbols',
                        default='/mozilla/flash-symbols')
 
+    parser.add_option('--symbol-cache-size', action='store', type='int',
+                       dest='symbol_cache_size',
+                       help='Maximum size in megabytes of the symbols cached '
+                      'between tests. Defaults to 512.',
+                       default=512)
+
     parser.add_option('--do-not-reproduce-bogus-signatures', action='store_true',
                        dest='do_not_reproduce_bogus_signatures',
                        help='Do not attempt to reproduce crashes with signatures of the form (frame)',
@@ -1087,6 +1647,102 @@ def main():
                       'Defaults to False.',
                        default=False)
 
+    parser.add_option('--dump-processes', action='store', type='int',
+                       dest='dump_processes',
+                       help='Maximum number of minidump_stackwalk and exploitable '
+                      'processes run at once when processing minidumps. '
+                      'Defaults to the number of cpus.',
+                       default=multiprocessing.cpu_count())
+
+    parser.add_option('--stackwalk-cache-dir', action='store', type='string',
+                       dest='stackwalk_cache_dir',
+                       help='Directory of the cache of minidump processing results. '
+                      'Defaults to sisyphus-stackwalk-cache in the temporary directory.',
+                       default=os.path.join(tempfile.gettempdir(), 'sisyphus-stackwalk-cache'))
+
+    parser.add_option('--stackwalk-cache-size', action='store', type='int',
+                       dest='stackwalk_cache_size',
+                       help='Maximum size in megabytes of the cache of minidump '
+                      'processing results. 0 disables the cache. Defaults to 512.',
+                       default=512)
+
+    parser.add_option('--profile-template-dir', action='store', type='string',
+                       dest='profile_template_dir',
+                       help='Directory where the runner keeps a profile template '
+                      'for each build and set of preferences. Each test profile '
+                      'is copied from the template instead of being created. '
+                      'Defaults to None.',
+                       default=None)
+
+    parser.add_option('--adaptive-wait', action='store_true',
+                       dest='adaptive_wait',
+                       help='Wait after each page is loaded until it is idle, for '
+                      'at most 5 seconds, instead of always waiting 5 seconds. '
+                      'Defaults to False.',
+                       default=False)
+
+    parser.add_option('--crash-exit-delay', action='store', type='int',
+                       dest='crash_exit_delay',
+                       help='End a test this many seconds after its first minidump '
+                      'is complete instead of waiting for the runner to finish. '
+                      'Not used with --batch-size. Defaults to None.',
+                       default=None)
+
+    parser.add_option('--max-log-size', action='store', type='int',
+                       dest='max_log_size',
+                       help='Maximum size in megabytes of the output of a test. '
+                      'The test is killed if its output exceeds the limit. '
+                      'Defaults to 256.',
+                       default=256)
+
+    parser.add_option('--batch-size', action='store', type='int',
+                       dest='batch_size',
+                       help='Number of jobs for the same build loaded one after '
+                      'another in a single browser session. The browser is '
+                      'restarted after a crash or hang. Defaults to 1.',
+                       default=1)
+
+    parser.add_option('--pipeline-depth', action='store', type='int',
+                       dest='pipeline_depth',
+                       help='Number of completed tests which may wait to have '
+                      'their logs and minidumps processed in the background '
+                      'while the next test runs. 0 processes the results '
+                      'before the next test is started. Defaults to 0.',
+                       default=0)
+
+    parser.add_option('--slots', action='store', type='int',
+                       dest='slots',
+                       help='Number of tests run concurrently using the same '
+                      'build. Each slot uses its own profile, Marionette port '
+                      'and log files. At most %d. Not supported on Windows. '
+                      'Defaults to 1.' % max_slots,
+                       default=1)
+
+    parser.add_option('--marionette-port', action='store', type='int',
+                       dest='marionette_port',
+                       help='First of the Marionette ports used by the slots '
+                      'of this worker. Slot n uses the port marionette_port + n. '
+                      'Defaults to 2828 plus %d times the worker id modulo 256 '
+                      'so that the workers on a host use different ports.' % max_slots,
+                       default=None)
+
+    parser.add_option('--machine-readable-stackwalk', action='store_true',
+                       dest='machine_readable_stackwalk',
+                       help='Run minidump_stackwalk with -m and parse its '
+                      'machine readable output. The human readable output is '
+                      'still used when exploitable is run since it needs the '
+                      'registers. '
+                      'Defaults to False.',
+                       default=False)
+
+    parser.add_option('--human-readable-crash-reports', action='store_true',
+                       dest='human_readable_crash_reports',
+                       help='When --machine-readable-stackwalk is specified, also run '
+                      'minidump_stackwalk without -m so that the human readable '
+                      'crash report is uploaded. '
+                      'Defaults to False.',
+                       default=False)
+
     try:
         (options, args) = parser.parse_args()
     except:
@@ -1115,6 +1771,8 @@ def main():
                 this_worker.testrun_row.save()
                 this_worker.testrun_row = None
                 this_worker.save()
+            this_worker.releaseJobBatch()
+            this_worker.releaseSlots()
 
             exception_counter += 1
             if exception_counter > 100:
@@ -1177,7 +1835,10 @@ if __name__ == "__main__":
                 this_worker.logMessage('Program restarting')
             this_worker.reloadProgram(db_available=db_available)
 
-    if db_available:
+    if db_available and this_worker:
+        this_worker.releaseJobBatch()
+        this_worker.releaseSlots()
+        this_worker.releasePostProcessing()
         this_worker.logMessage('Program terminating')
         this_worker.state = 'dead'
         this_worker.save()
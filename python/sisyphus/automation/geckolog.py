@@ -0,0 +1,214 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Scanner for the messages of interest in a gecko log.
+
+Most lines of a gecko log are not of interest. scan_lines only runs
+the regular expressions for a line when a cheap literal check shows
+the line can match and only decodes the lines it returns. decode_line
+decodes a line as utf-8 with replacement as utils.makeUnicodeString
+did for every line before scan_lines.
+
+scan_lines(lines, fatal_message_set) yields an (event, match, line) tuple for each line
+of interest where line is the unicode line and match is the match of
+the event's regular expression. The events, in the order they are
+checked for a line, are:
+
+  asan_start         ==pid==ERROR: AddressSanitizer: ... starts a report.
+                     groups: pid, error.
+  asan_frame         A frame of the current report.
+                     groups: frame number, address, function.
+  asan_text          A blank, AddressSanitizer or thread creation line
+                     of the current report. match is None.
+  asan_summary       SUMMARY: AddressSanitizer: reason. groups: reason.
+  asan_end           ==pid==... ends the current report.
+                     groups: pid, message.
+  assertion_failure  Assertion failure: message, at ...
+  moz_crash          Hit MOZ_CRASH(...) at ...
+  panic              thread 'name' panicked at '...', ...
+  abort              ###!!! ABORT: ...
+  assertion          ###!!! ASSERTION: message, file file, line n.
+                     groups: message, file.
+  valgrind           ==pid== valgrind output.
+
+The assertion_failure, moz_crash, panic and abort events are fatal.
+Only the first fatal message is recorded, so as in the loop scan_lines
+replaced, a fatal event ends the line only if fatal_message_set(), a
+callable, returned False when it was yielded. Otherwise the line goes
+on to the later events. The assertion event always ends the line and
+valgrind is only yielded if no event ended the line. If
+fatal_message_set is not specified, every fatal event ends the line.
+Use fatal_message(match) to get the message of a fatal event.
+
+Run this module with the paths of gecko logs to measure the
+throughput of the scanner.
+"""
+
+import re
+
+reAssertionFail    = re.compile(r'(Assertion failure: .*), at .*')
+reMOZ_CRASH        = re.compile(r'(Hit MOZ_CRASH.*) at .*')
+reABORT            = re.compile(r'###\!\!\! (ABORT: .*)')
+reABORT2           = re.compile(r'###\!\!\! (ABORT: .*), file (.*), line [0-9]+.*')
+reABORT3           = re.compile(r'###\!\!\! (ABORT: .*) file (.*), line [0-9]+.*')
+reASSERTION        = re.compile(r'###\!\!\! ASSERTION: (.*), file (.*), line [0-9]+.*')
+reValgrindLeader   = re.compile(r'^==[0-9]+==')
+# AddressSanitizer patterns
+# reAsanStart pid - group 1, message - group 2
+reAsanStart        = re.compile(r'^==(\d+)==ERROR: (AddressSanitizer: .*)')
+# reAsanEnd pid - group 1 must match, reason - group 2
+reAsanEnd          = re.compile(r'^==(\d+)==(.*)')
+# reAsanFrame frame number - group 1, address - group 2, funcdecl - group 3
+reAsanFrame        = re.compile(r'^ {4}(#\d+) (0x[0-9a-fA-F]+) in (.*) [^ ]+$')
+reAsanThread       = re.compile(r'Thread.*created by.*here:')
+# rAsanSummary - reason - group 1
+reAsanSummary      = re.compile(r'SUMMARY: AddressSanitizer: ([^ ]*)')
+reAsan             = re.compile(r'AddressSanitizer')
+reAsanBlank        = re.compile(r' *$')
+rePanic            = re.compile(r"(thread '[^']+' panicked at '.*'),.*")
+
+# The events which are checked after the AddressSanitizer events, the
+# literal a line must contain to match and the regular expression
+# searched for.
+messagePatterns = [
+    ('assertion_failure', 'Assertion failure: ', reAssertionFail),
+    ('moz_crash',         'Hit MOZ_CRASH',       reMOZ_CRASH),
+    ('panic',             "' panicked at '",     rePanic),
+    ('abort',             '###!!! ABORT: ',      reABORT),
+    ('assertion',         '###!!! ASSERTION: ',  reASSERTION),
+    ]
+
+fatalEvents = frozenset(['assertion_failure', 'moz_crash', 'panic', 'abort'])
+
+def decode_line(line):
+    if not isinstance(line, unicode):
+        line = unicode(line, "utf-8", errors='replace')
+    return line
+
+def fatal_message(match):
+    """
+    Return the fatal message of the match of an assertion_failure,
+    moz_crash, panic or abort event.
+    """
+
+    if match.re is reABORT:
+        return match.group(1).rstrip()
+    return match.group(1)
+
+def scan_lines(lines, fatal_message_set=None):
+    """
+    Yield an (event, match, line) tuple for each line of interest in
+    lines. See the module documentation for the events and
+    fatal_message_set.
+    """
+
+    # True while an AddressSanitizer report is being read.
+    asan_open = False
+    asan_reason = None
+
+    for rawline in lines:
+        line = None
+
+        if rawline.startswith('=='):
+            line = decode_line(rawline)
+            match = reAsanStart.match(line)
+            if match:
+                asan_open = True
+                asan_reason = None
+                yield ('asan_start', match, line)
+                continue
+
+        if asan_open:
+            if line is None:
+                line = decode_line(rawline)
+            match = reAsanFrame.match(line)
+            if match:
+                yield ('asan_frame', match, line)
+                continue
+            if reAsanBlank.match(line):
+                yield ('asan_text', None, line)
+            if reAsan.match(line) or reAsanThread.match(line):
+                yield ('asan_text', None, line)
+                continue
+            match = reAsanSummary.match(line)
+            if match:
+                asan_reason = match.group(1)
+                yield ('asan_summary', match, line)
+                continue
+            if not asan_reason:
+                # ignore lines such as ==7924==WARNING: ...
+                match = reAsanEnd.match(line)
+                if match:
+                    asan_open = False
+                    yield ('asan_end', match, line)
+
+        for (event, literal, pattern) in messagePatterns:
+            if literal in rawline:
+                if line is None:
+                    line = decode_line(rawline)
+                match = pattern.search(line)
+                if match:
+                    if event == 'abort':
+                        match = reABORT3.search(line) or reABORT2.search(line) or match
+                    ends_line = (event not in fatalEvents or fatal_message_set is None or
+                                 not fatal_message_set())
+                    yield (event, match, line)
+                    if ends_line:
+                        break
+        else:
+            if rawline.startswith('=='):
+                match = reValgrindLeader.match(line)
+                if match:
+                    yield ('valgrind', match, line)
+
+def scan_all_lines(lines):
+    """
+    Decode each line and try every pattern as the scanner's callers
+    did before scan_lines. Used as the baseline for the benchmark.
+    """
+
+    patterns = [reAsanStart, reAsanFrame, reAsanBlank, reAsan, reAsanThread, reAsanSummary,
+                reAsanEnd, reAssertionFail, reMOZ_CRASH, rePanic, reABORT, reASSERTION,
+                reValgrindLeader]
+    for line in lines:
+        line = decode_line(line)
+        for pattern in patterns:
+            match = pattern.search(line)
+            if match:
+                yield (pattern.pattern, match, line)
+
+if __name__ == "__main__":
+
+    import optparse
+    import time
+
+    parser = optparse.OptionParser(usage='%prog [options] geckolog...')
+    parser.add_option('--repeat', action='store', type='int',
+                      dest='repeat',
+                      help='Number of times to scan the logs. Defaults to 5.',
+                      default=5)
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('at least one gecko log is required')
+
+    lines = []
+    for path in args:
+        logfile = open(path, 'r')
+        try:
+            lines.extend(logfile.readlines())
+        finally:
+            logfile.close()
+    size = sum([len(line) for line in lines])
+
+    for (name, scanner) in (('scan_lines', scan_lines), ('scan_all_lines', scan_all_lines)):
+        starttime = time.time()
+        for repeat in range(options.repeat):
+            events = 0
+            for event in scanner(lines):
+                events += 1
+        elapsed = (time.time() - starttime) / options.repeat
+        print '%-15s %9d lines %8.1f MB %8d events %8.3f seconds %10.0f lines/s %8.1f MB/s' % (
+            name, len(lines), size / 1048576.0, events, elapsed,
+            len(lines) / elapsed, size / 1048576.0 / elapsed)
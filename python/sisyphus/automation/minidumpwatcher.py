@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Watch the directories where Firefox and the runner write minidumps
+while a test runs so that a crash is noticed as soon as its minidump
+is complete rather than when the runner exits.
+
+pyinotify is used when it is installed. The directories are also
+polled since they may not exist when the test starts and the profile
+may be replaced by the runner.
+"""
+
+import os
+import threading
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+class MinidumpWatcher(object):
+    """
+    Record each minidump written to directories, or a subdirectory,
+    once its .extra file is complete. events is a list of (elapsed
+    seconds, minidump path) in the order they were seen.
+
+    If exitdelay is not None, stopevent is set exitdelay seconds after
+    the first minidump so that the test can be ended early.
+    """
+
+    def __init__(self, directories, exitdelay=None, pollinterval=1):
+        self.directories  = directories
+        self.exitdelay    = exitdelay
+        self.pollinterval = pollinterval
+        self.events       = []
+        self.stopevent    = threading.Event()
+        self.starttime    = None
+        self.stoptime     = None
+        # Minidumps are moved between the directories, so they are
+        # identified by name.
+        self.seen         = set()
+        # The size of each .extra file when it was last polled.
+        self.sizes        = {}
+        # The .extra files reported closed or moved by inotify.
+        self.closed       = set()
+        self.done         = threading.Event()
+        self.thread       = None
+
+    def start(self):
+        self.starttime = time.time()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop watching and check the directories one last time.
+        """
+
+        self.done.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.poll(True)
+
+    def run(self):
+        watchmanager = None
+        notifier = None
+        if pyinotify:
+            watchmanager = pyinotify.WatchManager()
+            notifier = pyinotify.Notifier(watchmanager, self.processEvent)
+        try:
+            while not self.done.is_set():
+                if notifier:
+                    for directory in self.directories:
+                        if os.path.isdir(directory) and watchmanager.get_wd(directory) is None:
+                            watchmanager.add_watch(directory,
+                                                   pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO,
+                                                   rec=True, auto_add=True, quiet=True)
+                    if notifier.check_events(self.pollinterval * 1000):
+                        notifier.read_events()
+                        notifier.process_events()
+                else:
+                    self.done.wait(self.pollinterval)
+                self.poll(False)
+                if self.stoptime and time.time() >= self.stoptime:
+                    self.stopevent.set()
+        finally:
+            if notifier:
+                notifier.stop()
+
+    def processEvent(self, event):
+        if event.pathname.endswith('.extra'):
+            self.closed.add(event.pathname)
+
+    def poll(self, final):
+        """
+        Record the minidumps whose .extra file is complete. A .extra
+        file is complete when inotify reported it closed or moved, when
+        its size has not changed since the last poll or, when final,
+        when it is not empty.
+        """
+
+        for directory in self.directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                for filename in filenames:
+                    if not filename.endswith('.extra'):
+                        continue
+                    dumpname = filename[:-len('.extra')] + '.dmp'
+                    if dumpname in self.seen or dumpname not in filenames:
+                        continue
+                    extrapath = os.path.join(dirpath, filename)
+                    try:
+                        size = os.path.getsize(extrapath)
+                    except OSError:
+                        continue
+                    if size == 0:
+                        continue
+                    if (extrapath in self.closed or final or
+                        self.sizes.get(extrapath) == size):
+                        self.seen.add(dumpname)
+                        self.events.append((time.time() - self.starttime,
+                                            os.path.join(dirpath, dumpname)))
+                        if self.exitdelay is not None and not self.stoptime:
+                            self.stoptime = time.time() + self.exitdelay
+                    else:
+                        self.sizes[extrapath] = size
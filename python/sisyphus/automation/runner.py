@@ -4,12 +4,14 @@
 
 import argparse
 import glob
+import hashlib
 import json
 import logging
 import os
 import platform
 import random
 import re
+import shutil
 import signal
 import sys
 import tempfile
@@ -23,6 +25,102 @@ import mozprofile
 from marionette_driver.marionette import Marionette, Alert
 from marionette_driver import errors
 
+# Register the dialog closer for the browser. If the download
+# dialog appears, it will be closed and the browser window
+# will be closed. This forces marionette to return from
+# navigate and works around Bug 1366035. This version does
+# not dismiss normal Alerts which can be handled by Marionette's Alert.
+DIALOG_CLOSER_SCRIPT = """
+var gDialogCloser;
+var gDialogCloserObserver;
+var gDialogCloserSubjects = [];
+
+registerDialogCloser = function () {
+  gDialogCloser = Components.classes['@mozilla.org/embedcomp/window-watcher;1'].getService(Components.interfaces.nsIWindowWatcher);
+  gDialogCloserObserver = {observe: dialogCloser_observe};
+  gDialogCloser.registerNotification(gDialogCloserObserver);
+}
+
+unregisterDialogCloser = function () {
+  if (!gDialogCloserObserver || !gDialogCloser)
+  {
+    return;
+  }
+
+  gDialogCloser.unregisterNotification(gDialogCloserObserver);
+  gDialogCloserObserver = null;
+  gDialogCloser = null;
+}
+
+dialogCloser_observe = function (subject, topic, data) {
+  if (subject instanceof ChromeWindow && topic == 'domwindowopened' )
+  {
+    gDialogCloserSubjects.push(subject);
+    subject.setTimeout(closeDialog, 5000)
+  }
+}
+
+closeDialog = function () {
+  var subject;
+  while ( (subject = gDialogCloserSubjects.pop()) != null)
+  {
+      if (subject.document instanceof XULDocument) {
+          var uri = subject.document.documentURI;
+          //if (uri.startsWith('chrome://') && uri.endsWith('ialog.xul')) {
+          //    subject.close();
+          //} else
+          if (uri == 'chrome://mozapps/content/downloads/unknownContentType.xul') {
+              dump('Sisyphus Runner: Closing Window due to download dialog\\n');
+              subject.close();
+              window.close();
+          }
+      }
+  }
+}
+
+registerDialogCloser();
+"""
+
+# Written to stdout and the gecko log before and after each url is
+# loaded in --url-file mode so that the output can be attributed to
+# the url.
+URL_MARKER = 'Sisyphus Runner: URL %s %d %s'
+
+# Wait until the page has loaded and neither its DOM nor the number of
+# resources it has loaded has changed for quietTime milliseconds or
+# until maxWait milliseconds have passed. Returns the time waited.
+SETTLE_SCRIPT = """
+var maxWait = arguments[0];
+var quietTime = arguments[1];
+var callback = arguments[arguments.length - 1];
+var start = performance.now();
+var lastActivity = start;
+var resources = performance.getEntriesByType('resource').length;
+var observer = new MutationObserver(function () {
+  lastActivity = performance.now();
+});
+observer.observe(document, {childList: true, subtree: true,
+                            attributes: true, characterData: true});
+
+function check() {
+  var now = performance.now();
+  var count = performance.getEntriesByType('resource').length;
+  if (count != resources) {
+    resources = count;
+    lastActivity = now;
+  }
+  var idle = document.readyState == 'complete' && now - lastActivity >= quietTime;
+  if (idle || now - start >= maxWait) {
+    observer.disconnect();
+    callback({settle: now - start, idle: idle, resources: count});
+    return;
+  }
+  setTimeout(check, 100);
+}
+check();
+"""
+
+
 def get_remote_text(url):
     """Return the string containing the contents of a remote url if the
     request is successful, otherwise return None.
@@ -61,6 +159,21 @@ def runner_options():
     parser = argparse.ArgumentParser(description='Sisyphus Firefox runner')
     parser.add_argument('--url',
                         help='URL to load into Firefox.')
+    parser.add_argument('--url-file',
+                        help="""Path to file containing urls to load, one per
+                        line, in a single browser session. "-" reads the urls
+                        from stdin. The file may be a named pipe.""")
+    parser.add_argument('--restart-after',
+                        type=int,
+                        default=50,
+                        help="""Number of urls loaded from --url-file before the
+                        browser is restarted. The browser is also restarted after
+                        a crash or hang. Default: 50.""")
+    parser.add_argument('--marionette-port',
+                        type=int,
+                        default=2828,
+                        help="""Port used by Marionette. Concurrent runners must
+                        use different ports. Default: 2828.""")
     parser.add_argument('--restart',
                         action='store_true',
                         default=False,
@@ -69,12 +182,28 @@ def runner_options():
                         default=0,
                         help="""Time in seconds to wait before closing browser.
                         Default: 0.""")
+    parser.add_argument('--adaptive-wait',
+                        action='store_true',
+                        default=False,
+                        help="""Wait until the page is idle, for at most --wait
+                        seconds, instead of always waiting --wait seconds.""")
+    parser.add_argument('--settle-quiet-time',
+                        type=int,
+                        default=500,
+                        help="""Time in milliseconds without DOM changes or
+                        resource loads after which the page is idle when
+                        --adaptive-wait is specified. Default: 500.""")
     parser.add_argument('--binary',
                         required=True,
                         help='Path to Firefox binary.')
     parser.add_argument('--profile',
                         help="""Path to profile. If not specified, a temporary
                         profile will be created""")
+    parser.add_argument('--profile-template',
+                        help="""Path to directory containing profile templates.
+                        If specified, the profile is cloned from a template
+                        for the binary and preferences which is created and
+                        started once when the binary or preferences change.""")
     parser.add_argument('--page-load-timeout',
                         type=int,
                         default=300,
@@ -152,7 +281,7 @@ def run_firefox(args):
         os.unlink(tmpaddon)
 
     # Work around Windows issues with shell metacharacters in url.
-    if not args.url:
+    if not args.url and not args.url_file:
         if "URL" in os.environ:
             args.url = os.environ["URL"]
         else:
@@ -195,19 +324,14 @@ def run_firefox(args):
 
     logger.info("preferences: %s", json.dumps(preferences, indent=2, sort_keys=True))
 
-    profile = mozprofile.profile.FirefoxProfile(profile=args.profile,
-                                                preferences=preferences)
-    client = Marionette(host='localhost',
-                        port=2828,
-                        bin=args.binary,
-                        profile=profile,
-                        gecko_log=args.gecko_log,
-                        symbols_path=args.symbols_path)
+    profile = create_profile(args, preferences)
+    if profile is None:
+        return
+    if args.url_file:
+        run_batch(args, profile)
+        return
 
-    client.start_session()
-    if args.restart:
-        client.restart(clean=False, in_app=True)
-    client.maximize_window()
+    client = start_client(args, profile, args.gecko_log)
 
     references = {'time_out_alarm_fired': False}
 
@@ -225,136 +349,381 @@ def run_firefox(args):
         signal.alarm(args.page_load_timeout + 2*args.script_timeout)
 
     try:
-        client.timeout.page_load = args.page_load_timeout
-        client.timeout.script = args.script_timeout
-        # Register the dialog closer for the browser. If the download
-        # dialog appears, it will be closed and the browser window
-        # will be closed. This forces marionette to return from
-        # navigate and works around Bug 1366035. This version does
-        # not dismiss normal Alerts which can be handled by Marionette's Alert.
-        dialog_closer_script = """
-var gDialogCloser;
-var gDialogCloserObserver;
-var gDialogCloserSubjects = [];
+        prepare_client(client, args)
+        load_url(client, args, args.url)
+        try:
+            client.quit(in_app=True)
+        except:
+            pass
+    except (errors.TimeoutException, errors.UnknownException, IOError), e:
+        logger.warning("ABNORMAL: %s", e)
+        kill_client(client)
+    #except errors.MarionetteException, e:
+    #    logger.exception('time_out_alarm_fired %s', references['time_out_alarm_fired'])
+    #    if 'Please start a session' in e.message:
+    #        pass # Typically terminated firefox with marionette calls pending.
+    except Exception:
+        logger.exception('runner.py: ')
+    finally:
+        if hasattr(signal, 'SIGALRM'):
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, default_alarm_handler)
 
-registerDialogCloser = function () {
-  gDialogCloser = Components.classes['@mozilla.org/embedcomp/window-watcher;1'].getService(Components.interfaces.nsIWindowWatcher);
-  gDialogCloserObserver = {observe: dialogCloser_observe};
-  gDialogCloser.registerNotification(gDialogCloserObserver);
-}
 
-unregisterDialogCloser = function () {
-  if (!gDialogCloserObserver || !gDialogCloser)
-  {
-    return;
-  }
+def start_client(args, profile, gecko_log):
+    client = Marionette(host='localhost',
+                        port=args.marionette_port,
+                        bin=args.binary,
+                        profile=profile,
+                        gecko_log=gecko_log,
+                        symbols_path=args.symbols_path)
 
-  gDialogCloser.unregisterNotification(gDialogCloserObserver);
-  gDialogCloserObserver = null;
-  gDialogCloser = null;
-}
+    client.start_session()
+    if args.restart:
+        client.restart(clean=False, in_app=True)
+    client.maximize_window()
+    return client
 
-dialogCloser_observe = function (subject, topic, data) {
-  if (subject instanceof ChromeWindow && topic == 'domwindowopened' )
-  {
-    gDialogCloserSubjects.push(subject);
-    subject.setTimeout(closeDialog, 5000)
-  }
-}
 
-closeDialog = function () {
-  var subject;
-  while ( (subject = gDialogCloserSubjects.pop()) != null)
-  {
-      if (subject.document instanceof XULDocument) {
-          var uri = subject.document.documentURI;
-          //if (uri.startsWith('chrome://') && uri.endsWith('ialog.xul')) {
-          //    subject.close();
-          //} else
-          if (uri == 'chrome://mozapps/content/downloads/unknownContentType.xul') {
-              dump('Sisyphus Runner: Closing Window due to download dialog\\n');
-              subject.close();
-              window.close();
-          }
-      }
-  }
-}
+def prepare_client(client, args):
+    client.timeout.page_load = args.page_load_timeout
+    client.timeout.script = args.script_timeout
+    client.set_context(client.CONTEXT_CHROME)
+    client.execute_script(DIALOG_CLOSER_SCRIPT,
+                          new_sandbox=False, script_timeout=client.timeout.script)
+    client.set_context(client.CONTEXT_CONTENT)
 
-registerDialogCloser();
-"""
-        client.set_context(client.CONTEXT_CHROME)
-        client.execute_script(dialog_closer_script,
-                              new_sandbox=False, script_timeout=client.timeout.script)
-        client.set_context(client.CONTEXT_CONTENT)
-        try:
-            logger.info('New Page: %s' % args.url)
-            client.navigate(args.url)
-            client.maximize_window()
-        except Exception, e:
-            logger.warning('navigate: %s', e)
-
-        # Do not call client.check_for_crash() as that will invoke
-        # mozcrash which will delete the dump files. Handle the dumps
-        # in the caller.
-        client.set_context(client.CONTEXT_CONTENT)
-        for content_script_url in args.content_scripts:
-            content_script = get_remote_text(content_script_url)
-            if content_script:
+
+def load_url(client, args, url):
+    logger = logging.getLogger('sisyphus')
+
+    try:
+        logger.info('New Page: %s' % url)
+        client.navigate(url)
+        client.maximize_window()
+    except Exception, e:
+        logger.warning('navigate: %s', e)
+
+    # Do not call client.check_for_crash() as that will invoke
+    # mozcrash which will delete the dump files. Handle the dumps
+    # in the caller.
+    client.set_context(client.CONTEXT_CONTENT)
+    for content_script_url in args.content_scripts:
+        content_script = get_remote_text(content_script_url)
+        if content_script:
+            try:
+                logger.info('<contentscript>\n%s\n</contentscript>', content_script)
+                result = client.execute_script(content_script, script_args=[], script_timeout=client.timeout.script)
+                logger.info('content script result: %s', result)
+            except errors.ScriptTimeoutException, e:
+                logger.warning('content script: %s', e)
+            except Exception, e:
+                logger.error('content script: %s', e)
+    for chrome_script_url in args.chrome_scripts:
+        chrome_script = get_remote_text(chrome_script_url)
+        if chrome_script:
+            with client.using_context(client.CONTEXT_CHROME):
                 try:
-                    logger.info('<contentscript>\n%s\n</contentscript>', content_script)
-                    result = client.execute_script(content_script, script_args=[], script_timeout=client.timeout.script)
-                    logger.info('content script result: %s', result)
+                    logger.info('<chromescript>\n%s\n</chromescript>', chrome_script)
+                    result = client.execute_script(chrome_script, sandbox='system', script_args=[client.timeout.script], script_timeout=client.timeout.script)
+                    logger.info('chrome script result: %s\n', result)
                 except errors.ScriptTimeoutException, e:
-                    logger.warning('content script: %s', e)
+                    logger.warning('chrome script: %s', e)
                 except Exception, e:
-                    logger.error('content script: %s', e)
-        for chrome_script_url in args.chrome_scripts:
-            chrome_script = get_remote_text(chrome_script_url)
-            if chrome_script:
-                with client.using_context(client.CONTEXT_CHROME):
-                    try:
-                        logger.info('<chromescript>\n%s\n</chromescript>', chrome_script)
-                        result = client.execute_script(chrome_script, sandbox='system', script_args=[client.timeout.script], script_timeout=client.timeout.script)
-                        logger.info('chrome script result: %s\n', result)
-                    except errors.ScriptTimeoutException, e:
-                        logger.warning('chrome script: %s', e)
-                    except Exception, e:
-                        logger.error('chrome script: %s', e)
+                    logger.error('chrome script: %s', e)
+    if args.adaptive_wait:
+        settle(client, args)
+    else:
         time.sleep(float(args.wait))
-        while True:
-            try:
-                logger.info('alert: %s', Alert(client).text)
-                Alert(client).dismiss()
-            except errors.NoAlertPresentException:
-                break
-            except Exception, e:
-                logger.error('alert: %s', e)
-                break
+    while True:
         try:
-            client.quit(in_app=True)
-        except:
-            pass
-    except (errors.TimeoutException, errors.UnknownException, IOError), e:
-        logger.warning("ABNORMAL: %s", e)
-        try:
-            client.quit(in_app=True)
-            if client.session:
-                os.kill(client.session['moz:processID'], 9)
-        #except errors.MarionetteException, e:
-        #    if 'Please start a session' not in e.message:
-        #        raise # If the error is not that the app had disconnected/terminated.
+            logger.info('alert: %s', Alert(client).text)
+            Alert(client).dismiss()
+        except errors.NoAlertPresentException:
+            break
         except Exception, e:
-            logger.error('client session: %s', e)
-    #except errors.MarionetteException, e:
-    #    logger.exception('time_out_alarm_fired %s', references['time_out_alarm_fired'])
-    #    if 'Please start a session' in e.message:
-    #        pass # Typically terminated firefox with marionette calls pending.
+            logger.error('alert: %s', e)
+            break
+
+
+def settle(client, args):
+    """Wait until the page is idle or --wait seconds have passed and
+    log the time waited."""
+    logger = logging.getLogger('sisyphus')
+
+    max_wait = float(args.wait)
+    starttime = time.time()
+    try:
+        result = client.execute_async_script(SETTLE_SCRIPT,
+                                             script_args=[max_wait * 1000, args.settle_quiet_time],
+                                             script_timeout=int((max_wait + args.script_timeout) * 1000))
+        logger.info('settle: %.3f seconds, idle: %s, resources: %s',
+                    result['settle'] / 1000.0, result['idle'], result['resources'])
+    except Exception, e:
+        logger.warning('settle: %s', e)
+        remaining = max_wait - (time.time() - starttime)
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+def create_profile(args, preferences):
+    """Return the profile for the test. If --profile-template is
+    specified, the profile is a copy of the template for the binary and
+    preferences and --profile, if specified, must not exist or be empty.
+    Return None if it is not empty."""
+    if not args.profile_template:
+        return mozprofile.profile.FirefoxProfile(profile=args.profile,
+                                                 preferences=preferences)
+
+    # Templates are named for the binary and the build and
+    # preferences so that a new template is created when either
+    # changes.
+    binary_path = os.path.abspath(args.binary)
+    binary_stat = os.stat(binary_path)
+    template_prefix = hashlib.sha1(binary_path).hexdigest()[:16]
+    template_key = hashlib.sha1(json.dumps([binary_stat.st_size,
+                                            binary_stat.st_mtime,
+                                            preferences],
+                                           sort_keys=True)).hexdigest()[:16]
+    template_path = os.path.join(args.profile_template,
+                                 '%s-%s' % (template_prefix, template_key))
+    if not os.path.isdir(template_path):
+        create_profile_template(args, preferences, template_path)
+
+    if not args.profile:
+        args.profile = tempfile.mkdtemp(prefix='profile-')
+    if os.path.exists(args.profile):
+        # copytree creates the profile directory. Never remove a
+        # directory which may contain the user's files.
+        if os.listdir(args.profile):
+            logger = logging.getLogger('sisyphus')
+            logger.error('create_profile: --profile %s is not empty', args.profile)
+            return None
+        os.rmdir(args.profile)
+    # Firefox updates the profile's databases in place, so the files
+    # are copied rather than linked to the template.
+    shutil.copytree(template_path, args.profile, symlinks=True,
+                    ignore=shutil.ignore_patterns('lock', '.parentlock', 'parent.lock'))
+    return mozprofile.profile.FirefoxProfile(profile=args.profile)
+
+
+def create_profile_template(args, preferences, template_path):
+    """Create the profile template at template_path and start Firefox
+    with it once to populate the profile and its startup cache. Other
+    templates for the binary are removed."""
+    logger = logging.getLogger('sisyphus')
+    logger.info('creating profile template %s', template_path)
+
+    template_dir = os.path.dirname(template_path)
+    if not os.path.isdir(template_dir):
+        os.makedirs(template_dir)
+    build_path = tempfile.mkdtemp(prefix='build-', dir=template_dir)
+    # Marionette removes an existing gecko log, so do not use the
+    # test's log.
+    gecko_log = os.path.join(build_path, 'gecko.log')
+
+    profile = mozprofile.profile.FirefoxProfile(profile=os.path.join(build_path, 'profile'),
+                                                preferences=preferences,
+                                                restore=False)
+    client = start_client(args, profile, gecko_log)
+    try:
+        client.quit(in_app=True)
     except Exception:
-        logger.exception('runner.py: ')
+        kill_client(client)
+    shutil.rmtree(os.path.join(profile.profile, 'minidumps'), ignore_errors=True)
+
+    try:
+        os.rename(profile.profile, template_path)
+    except OSError:
+        # Another runner created the template first.
+        pass
+    shutil.rmtree(build_path, ignore_errors=True)
+
+    template_prefix = os.path.basename(template_path).split('-')[0]
+    for stale_path in glob.glob(os.path.join(template_dir, template_prefix + '-*')):
+        if stale_path != template_path:
+            logger.info('removing profile template %s', stale_path)
+            shutil.rmtree(stale_path, ignore_errors=True)
+
+
+def kill_client(client):
+    logger = logging.getLogger('sisyphus')
+
+    try:
+        client.quit(in_app=True)
+        if client.session:
+            os.kill(client.session['moz:processID'], 9)
+    #except errors.MarionetteException, e:
+    #    if 'Please start a session' not in e.message:
+    #        raise # If the error is not that the app had disconnected/terminated.
+    except Exception, e:
+        logger.error('client session: %s', e)
+
+
+def write_marker(gecko_log, event, index, detail):
+    """Write a url marker to stdout and, unless it is stdout, to the
+    gecko log.
+
+    """
+    logger = logging.getLogger('sisyphus')
+
+    marker = URL_MARKER % (event, index, detail)
+    logger.info(marker)
+    if gecko_log != '-':
+        with open(gecko_log, 'a') as gecko_log_file:
+            gecko_log_file.write(marker + '\n')
+
+
+def save_minidumps(profile_path, minidumps_savepath, index):
+    """Move any minidumps written by the browser or already saved by
+    marionette into the subdirectory of minidumps_savepath named for
+    the index of the url. Return the number of minidumps moved.
+
+    """
+    if not minidumps_savepath:
+        return 0
+
+    url_minidumps_path = os.path.join(minidumps_savepath, str(index))
+    count = 0
+    for minidumps_path in (os.path.join(profile_path, 'minidumps'), minidumps_savepath):
+        for dump_path in (glob.glob(os.path.join(minidumps_path, '*.dmp')) +
+                          glob.glob(os.path.join(minidumps_path, '*.extra'))):
+            if not os.path.isdir(url_minidumps_path):
+                os.makedirs(url_minidumps_path)
+            shutil.move(dump_path, url_minidumps_path)
+            if dump_path.endswith('.dmp'):
+                count += 1
+    return count
+
+
+def append_gecko_log(session_log, gecko_log):
+    """Append the gecko log of a browser session to the gecko log and
+    remove it. marionette removes an existing gecko log when it starts
+    the browser so each session must use its own.
+
+    """
+    if gecko_log == '-' or not os.path.exists(session_log):
+        return
+    with open(gecko_log, 'ab') as gecko_log_file:
+        with open(session_log, 'rb') as session_log_file:
+            shutil.copyfileobj(session_log_file, gecko_log_file)
+    os.unlink(session_log)
+
+
+def run_batch(args, profile):
+    """Load each url read from args.url_file in the same browser
+    session. The browser is restarted after a crash, a hang or after
+    args.restart_after urls. Each url is surrounded by URL_MARKER START
+    and END lines and its minidumps are saved in a subdirectory of
+    MINIDUMP_SAVE_PATH named for its index. Urls which were not started
+    have no markers.
+
+    """
+    logger = logging.getLogger('sisyphus')
+
+    if args.url_file == '-':
+        url_file = sys.stdin
+    else:
+        url_file = open(args.url_file)
+
+    if args.gecko_log == '-':
+        session_log = '-'
+    else:
+        session_log = args.gecko_log + '.session'
+
+    minidumps_savepath = os.environ.get('MINIDUMP_SAVE_PATH')
+
+    references = {'client': None, 'url': None, 'time_out_alarm_fired': False}
+
+    if hasattr(signal, 'SIGALRM'):
+        def timeout_handler(signum, frame):
+            logger.warning("navigate: %s timed out" % references['url'])
+            references['time_out_alarm_fired'] = True
+            references['client'].quit()
+
+        default_alarm_handler = signal.getsignal(signal.SIGALRM)
+        signal.signal(signal.SIGALRM, timeout_handler)
+
+    client = None
+    loaded = 0
+    index = -1
+    try:
+        # Use readline rather than iterating over the file so that
+        # urls written to a pipe are read as soon as they arrive.
+        for line in iter(url_file.readline, ''):
+            url = line.strip()
+            if not url:
+                continue
+            index += 1
+
+            if client is None:
+                try:
+                    client = start_client(args, profile, session_log)
+                    prepare_client(client, args)
+                    loaded = 0
+                except Exception:
+                    logger.exception('runner.py: unable to start browser')
+                    if client:
+                        kill_client(client)
+                    append_gecko_log(session_log, args.gecko_log)
+                    # The remaining urls are not started.
+                    return
+
+            references['client'] = client
+            references['url'] = url
+            references['time_out_alarm_fired'] = False
+            write_marker(session_log, 'START', index, url)
+            status = 'NORMAL'
+            if hasattr(signal, 'SIGALRM'):
+                signal.alarm(args.page_load_timeout + 2*args.script_timeout)
+            try:
+                load_url(client, args, url)
+                if not client.instance.runner.is_running():
+                    status = 'CRASHED'
+            except (errors.TimeoutException, errors.UnknownException, IOError), e:
+                logger.warning("ABNORMAL: %s", e)
+                status = 'ABNORMAL'
+            except Exception:
+                logger.exception('runner.py: ')
+                status = 'ABNORMAL'
+            finally:
+                if hasattr(signal, 'SIGALRM'):
+                    signal.alarm(0)
+            loaded += 1
+
+            if references['time_out_alarm_fired']:
+                status = 'TIMED OUT'
+            elif save_minidumps(profile.profile, minidumps_savepath, index) and status == 'NORMAL':
+                status = 'CRASHED'
+
+            if status != 'NORMAL' or loaded >= args.restart_after:
+                if status == 'NORMAL':
+                    try:
+                        client.quit(in_app=True)
+                    except:
+                        pass
+                else:
+                    kill_client(client)
+                client = None
+                save_minidumps(profile.profile, minidumps_savepath, index)
+            write_marker(session_log, 'END', index, status)
+            if client is None:
+                append_gecko_log(session_log, args.gecko_log)
+
+        if client:
+            try:
+                client.quit(in_app=True)
+            except:
+                pass
+            save_minidumps(profile.profile, minidumps_savepath, index)
+            append_gecko_log(session_log, args.gecko_log)
     finally:
         if hasattr(signal, 'SIGALRM'):
             signal.alarm(0)
             signal.signal(signal.SIGALRM, default_alarm_handler)
+        if url_file is not sys.stdin:
+            url_file.close()
+
 
 if __name__ == '__main__':
     logging.basicConfig()
@@ -0,0 +1,144 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+A local cache of the results of processing minidumps, keyed by the
+content of the dump and the symbols used to process it, so that the
+same dump is not stackwalked again when a job is reprocessed or when
+byte identical dumps are found.
+
+The callers include crashreports.CRASH_DATA_VERSION in the key so that
+entries are not reused once the parsing of the tool output changes.
+"""
+
+import hashlib
+import json
+import os
+
+def decode_entry(value):
+    """
+    Convert the unicode strings of a loaded entry back into the byte
+    strings which were stored.
+    """
+
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return [decode_entry(item) for item in value]
+    if isinstance(value, dict):
+        return dict([(decode_entry(k), decode_entry(v)) for (k, v) in value.iteritems()])
+    return value
+
+class StackwalkCache(object):
+
+    # Fraction of maxbytes evict leaves the cache at so that the
+    # following puts do not walk the cache again.
+    evictratio = 0.9
+
+    def __init__(self, directory, maxbytes):
+        self.directory  = directory
+        self.maxbytes   = maxbytes
+        # The size of the cache as of the last walk plus the entries
+        # put since. None until the cache is first walked. Other
+        # workers may share the directory, so each walk starts over.
+        self.totalbytes = None
+
+    def key(self, dumpFile, symbolsPathList, build_id, mode):
+        """
+        Return the cache key for dumpFile processed with the symbols in
+        symbolsPathList for the build build_id. mode distinguishes the
+        different ways the tools can be run.
+        """
+
+        digest = hashlib.sha1()
+        dumpFileHandle = open(dumpFile, 'rb')
+        try:
+            for chunk in iter(lambda: dumpFileHandle.read(1024 * 1024), ''):
+                digest.update(chunk)
+        finally:
+            dumpFileHandle.close()
+        digest.update('\0'.join([str(build_id), mode] + list(symbolsPathList)))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        Return the cached entry for key or None.
+        """
+
+        entrypath = self.path(key)
+        try:
+            entryFileHandle = open(entrypath, 'rb')
+            try:
+                entry = decode_entry(json.load(entryFileHandle))
+            finally:
+                entryFileHandle.close()
+            # Mark the entry as recently used.
+            os.utime(entrypath, None)
+            return entry
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        """
+        Store entry for key then, if the cache is larger than maxbytes,
+        evict the least recently used entries.
+        """
+
+        entrypath = self.path(key)
+        entrydir = os.path.dirname(entrypath)
+        if not os.path.exists(entrydir):
+            os.makedirs(entrydir)
+        tmppath = '%s.%d.tmp' % (entrypath, os.getpid())
+        entryFileHandle = open(tmppath, 'wb')
+        try:
+            # The tool output is not necessarily utf-8.
+            json.dump(entry, entryFileHandle, encoding='latin-1')
+        finally:
+            entryFileHandle.close()
+        size = os.path.getsize(tmppath)
+        try:
+            size -= os.path.getsize(entrypath)
+        except OSError:
+            pass
+        os.rename(tmppath, entrypath)
+        if self.totalbytes is not None:
+            self.totalbytes += size
+        if self.totalbytes is None or self.totalbytes > self.maxbytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Walk the cache to find its size and, if it is larger than
+        maxbytes, remove the least recently used entries until it is no
+        larger than evictratio * maxbytes.
+        """
+
+        entries = []
+        totalbytes = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                entrypath = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(entrypath)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entrypath))
+                totalbytes += st.st_size
+
+        if totalbytes > self.maxbytes:
+            entries.sort()
+            for (mtime, size, entrypath) in entries:
+                if totalbytes <= self.maxbytes * self.evictratio:
+                    break
+                try:
+                    os.unlink(entrypath)
+                except OSError:
+                    pass
+                totalbytes -= size
+        self.totalbytes = totalbytes
@@ -0,0 +1,117 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Check that the machine readable (minidump_stackwalk -m) output of a
+dump is parsed into the same crash data as its human readable output.
+
+Run from the python directory with
+python -m unittest sisyphus.automation.test_crashreports
+"""
+
+# sisyphus.automation.unittest would otherwise hide the standard module.
+from __future__ import absolute_import
+
+import unittest
+
+from sisyphus.automation import crashreports
+
+HUMAN_REPORT = """
+Operating system: Linux
+                  0.0.0 Linux 2.6.18-194.17.4.el5 #1 SMP Mon Oct 25 15:51:07 EDT 2010 i686
+CPU: x86
+     GenuineIntel family 6 model 23 stepping 6
+     1 CPU
+
+Crash reason:  SIGSEGV
+Crash address: 0x6ea35800
+
+Thread 0 (crashed)
+ 0  0x6ea35800
+    eip = 0x6ea35800   esp = 0xbfbaca00   ebp = 0x3800c878   ebx = 0x021e20f0
+    Found by: given as instruction pointer in context
+ 1  libgobject-2.0.so.0.1200.3 + 0x37f77
+    eip = 0x00335f78   esp = 0xbfbaca2c   ebp = 0x3800c878
+    Found by: stack scanning
+ 2  libxul.so!nsEditor::InstallEventListeners() [nsEditor.cpp : 375 + 0x67]
+    eip = 0x011d4800   esp = 0xbfbaca60   ebp = 0x3800c878
+    Found by: stack scanning
+ 3  libxul.so!nsDetectionAdaptor::Init(nsIWebShellServices *,nsIDocument *) [nsDetectionAdaptor.cpp : 139 + 0x1e]
+    eip = 0x00a57000   esp = 0xbfbacaa4   ebp = 0x3800c878
+    Found by: stack scanning
+ 4  libnspr4.so!PR_GetThreadPrivate + 0x4
+    eip = 0x0012fa8b   esp = 0xbfbacb00   ebp = 0x3800c878
+    Found by: stack scanning
+
+Thread 1
+ 0  libc-2.5.so + 0x68ee5
+    eip = 0x0445bee6   esp = 0xbfbacb0c   ebp = 0x3800c878
+    Found by: given as instruction pointer in context
+
+Loaded modules:
+0x08048000 - 0x08050fff  firefox-bin  ???  (main)
+0x00110000 - 0x0124bfff  libxul.so  ???
+"""
+
+MACHINE_REPORT = """OS|Linux|0.0.0 Linux 2.6.18-194.17.4.el5 #1 SMP Mon Oct 25 15:51:07 EDT 2010 i686
+CPU|x86|GenuineIntel family 6 model 23 stepping 6|1
+GPU|||
+Crash|SIGSEGV|0x6ea35800|0
+
+Module|firefox-bin||firefox-bin|0A1B2C3D0|0x08048000|0x08050fff|1
+Module|libxul.so||libxul.so|4E5F6A7B0|0x00110000|0x0124bfff|0
+
+0|0|||||0x6ea35800
+0|1|libgobject-2.0.so.0.1200.3||||0x37f77
+0|2|libxul.so|nsEditor::InstallEventListeners()|/builds/src/editor/nsEditor.cpp|375|0x67
+0|3|libxul.so|nsDetectionAdaptor::Init(nsIWebShellServices *,nsIDocument *)|/builds/src/nsDetectionAdaptor.cpp|139|0x1e
+0|4|libnspr4.so|PR_GetThreadPrivate|||0x4
+1|0|libc-2.5.so||||0x68ee5
+
+ EXIT STATUS: NORMAL (0.5 seconds)
+"""
+
+class ParseMachineCrashReportTest(unittest.TestCase):
+
+    def test_crash_data(self):
+        crash_data = crashreports.parse_machine_crashreport(MACHINE_REPORT)
+        self.assertEqual(crash_data['operating_system'], 'Linux')
+        self.assertEqual(crash_data['cpu_type'], 'x86')
+        self.assertEqual(crash_data['cpu_family'], 'GenuineIntel family 6 model 23 stepping 6')
+        self.assertEqual(crash_data['cpu_count'], '1')
+        self.assertEqual(crash_data['crash_reason'], 'SIGSEGV')
+        self.assertEqual(crash_data['crash_address'], '0x6ea35800')
+        self.assertEqual(crash_data['crashing_thread'], '0')
+        self.assertEqual(crash_data['main'], 'firefox-bin')
+        self.assertEqual(crash_data['messages'], [])
+
+    def test_frames(self):
+        frames = crashreports.parse_machine_crashreport(MACHINE_REPORT)['frames']
+        # Only the crashing thread's frames are read.
+        self.assertEqual([frame['frame_type'] for frame in frames],
+                         ['address', 'library', 'module', 'module', 'module'])
+        self.assertEqual(frames[1]['frame_library_address'], '0x37f77')
+        self.assertEqual(frames[2]['frame_filename'], 'nsEditor.cpp')
+        self.assertEqual(frames[2]['frame_linenumber'], '375')
+        self.assertEqual(frames[4]['frame_function'], 'PR_GetThreadPrivate + 0x4')
+        for frame in frames:
+            self.assertEqual(frame['frame_registers'], {})
+
+    def test_same_as_human_readable(self):
+        human = crashreports.parse_crashreport(HUMAN_REPORT)
+        machine = crashreports.parse_machine_crashreport(MACHINE_REPORT)
+        for key in ('operating_system', 'operating_system_version', 'cpu_type', 'cpu_family',
+                    'cpu_count', 'crash_address', 'crashing_thread', 'main', 'signature_list'):
+            self.assertEqual(machine[key], human[key], key)
+        self.assertEqual([frame['frame_signature'] for frame in machine['frames']],
+                         [frame['frame_signature'] for frame in human['frames']])
+
+    def test_parse_stackwalk_output(self):
+        self.assertEqual(crashreports.parse_stackwalk_output(MACHINE_REPORT.splitlines(True)),
+                         crashreports.parse_machine_crashreport(MACHINE_REPORT))
+        self.assertEqual(crashreports.parse_stackwalk_output(HUMAN_REPORT),
+                         crashreports.parse_crashreport(HUMAN_REPORT))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Check that scan_lines finds the same messages as the loop in
+crashworker.processTestResults which it replaced.
+
+Run from the python directory with
+python -m unittest sisyphus.automation.test_geckolog
+"""
+
+# sisyphus.automation.unittest would otherwise hide the standard module.
+from __future__ import absolute_import
+
+import re
+import unittest
+
+from sisyphus.automation import geckolog
+from sisyphus.automation.geckolog import (reAssertionFail, reMOZ_CRASH, reABORT, reABORT2,
+                                          reABORT3, reASSERTION, reValgrindLeader,
+                                          reAsanStart, reAsanEnd, reAsanFrame, reAsanThread,
+                                          reAsanSummary, reAsan, reAsanBlank, rePanic)
+
+GECKO_LOG = [
+    'Sisyphus Runner: URL START 0\n',
+    '###!!! ASSERTION: Some assertion: \'false\', file c:\\src\\dom\\Foo.cpp, line 12\n',
+    '###!!! ASSERTION: Some assertion: \'false\', file /src/dom/Foo.cpp, line 12\n',
+    'JavaScript error: chrome://foo.js, line 1: TypeError: \xe9\xff is null\n',
+    '==4242==ERROR: AddressSanitizer: heap-use-after-free on address 0x602000 at pc 0x7f\n',
+    'READ of size 8 at 0x602000 thread T0\n',
+    '    #0 0x7f1234 in nsFoo::Bar() /src/dom/Foo.cpp:12\n',
+    '    #1 0x7f5678 in nsFoo::Baz(int) /src/dom/Foo.cpp:34\n',
+    '\n',
+    'Thread T1 created by T0 here:\n',
+    '    #0 0x7f9abc in pthread_create /src/asan.cc:1\n',
+    'AddressSanitizer can not describe address in more detail\n',
+    'SUMMARY: AddressSanitizer: heap-use-after-free /src/dom/Foo.cpp:12 nsFoo::Bar()\n',
+    '==4242==ABORTING\n',
+    'Assertion failure: mFoo, at /src/dom/Foo.cpp:56\n',
+    # A line matching several patterns after the fatal message is set.
+    'Assertion failure: x, at /src/Bar.cpp:8 ###!!! ASSERTION: Nested: \'y\', file /src/Bar.cpp, line 9\n',
+    'Hit MOZ_CRASH(boom) at /src/mfbt/Assertions.h:1\n',
+    "thread 'Compositor' panicked at 'index out of bounds', src/lib.rs:1\n",
+    '###!!! ABORT: Aborting on channel error.: file /src/ipc/Channel.cpp, line 7\n',
+    '==1234== Invalid read of size 4\n',
+    '==1234==    at 0x4C2: foo (foo.c:1)\n',
+    'Sisyphus Runner: URL END 0 NORMAL\n',
+    ]
+
+class Result(object):
+
+    def __init__(self):
+        self.fatal_message  = None
+        self.asan_list      = []
+        self.assertion_dict = {}
+        self.valgrind_text  = ''
+
+    def add_assertion(self, match):
+        assertionmessage = match.group(1)
+        assertionfile    = re.sub('^([a-zA-Z]:/|/[a-zA-Z]/)', '/', re.sub(r'\\', '/', match.group(2)))
+        assertionkey     = assertionmessage + ':' + assertionfile
+        if assertionkey in self.assertion_dict:
+            self.assertion_dict[assertionkey]["count"] += 1
+        else:
+            self.assertion_dict[assertionkey] = {"message": assertionmessage,
+                                                 "file"   : assertionfile,
+                                                 "count"  : 1}
+
+    def start_asan(self, match, line):
+        self.asan_list.append({'pid': match.group(1),
+                               'error': match.group(2),
+                               'text': line,
+                               'frames': [],
+                               'reason': '',
+                               'frames_collected': False,
+                               'completed': False})
+        if not self.fatal_message:
+            self.fatal_message = match.group(2).rstrip()
+        else:
+            self.fatal_message += ' | ' + match.group(2).rstrip()
+
+def baseline_scan(lines):
+    """
+    The loop of processTestResults before scan_lines.
+    """
+
+    result = Result()
+    asan_list = result.asan_list
+    for line in lines:
+        line = unicode(line, "utf-8", errors='replace')
+
+        match = reAsanStart.match(line)
+        if match:
+            result.start_asan(match, line)
+            continue
+        if asan_list and not asan_list[-1]['completed']:
+            match = reAsanFrame.match(line)
+            if match:
+                asan_list[-1]['text'] += line
+                if not asan_list[-1]['frames_collected']:
+                    asan_list[-1]['frames'].append(match.group(3))
+                continue
+            match = reAsanBlank.match(line)
+            if match:
+                asan_list[-1]['text'] += line
+            match = reAsan.match(line)
+            if match:
+                asan_list[-1]['text'] += line
+                continue
+            match = reAsanThread.match(line)
+            if match:
+                asan_list[-1]['text'] += line
+                continue
+            match = reAsanSummary.match(line)
+            if match:
+                asan_list[-1]['text'] += line
+                asan_list[-1]['reason'] = match.group(1)
+                asan_list[-1]['frames_collected'] = True
+                continue
+            if not asan_list[-1]['reason']:
+                match = reAsanEnd.match(line)
+                if match:
+                    asan_list[-1]['completed'] = True
+                    asan_list[-1]['text'] += line
+
+        match = reAssertionFail.search(line)
+        if match and not result.fatal_message:
+            result.fatal_message = match.group(1)
+            continue
+        match = reMOZ_CRASH.search(line)
+        if match and not result.fatal_message:
+            result.fatal_message = match.group(1)
+            continue
+        match = rePanic.search(line)
+        if match and not result.fatal_message:
+            result.fatal_message = match.group(1)
+            continue
+        match = reABORT.search(line)
+        if match and not result.fatal_message:
+            result.fatal_message = match.group(1).rstrip()
+            match = reABORT2.search(line)
+            if match:
+                result.fatal_message = match.group(1)
+            match = reABORT3.search(line)
+            if match:
+                result.fatal_message = match.group(1)
+            continue
+        match = reASSERTION.search(line)
+        if match:
+            result.add_assertion(match)
+            continue
+        match = reValgrindLeader.match(line)
+        if match:
+            result.valgrind_text += line
+            continue
+    return result
+
+def events_scan(lines):
+    """
+    The dispatch of processTestResults on the scan_lines events.
+    """
+
+    result = Result()
+    asan_list = result.asan_list
+
+    def fatal_message_set():
+        return bool(result.fatal_message)
+
+    for (event, match, line) in geckolog.scan_lines(lines, fatal_message_set):
+        if event == 'asan_start':
+            result.start_asan(match, line)
+        elif event == 'asan_frame':
+            asan_list[-1]['text'] += line
+            if not asan_list[-1]['frames_collected']:
+                asan_list[-1]['frames'].append(match.group(3))
+        elif event == 'asan_text':
+            asan_list[-1]['text'] += line
+        elif event == 'asan_summary':
+            asan_list[-1]['text'] += line
+            asan_list[-1]['reason'] = match.group(1)
+            asan_list[-1]['frames_collected'] = True
+        elif event == 'asan_end':
+            asan_list[-1]['completed'] = True
+            asan_list[-1]['text'] += line
+        elif event in geckolog.fatalEvents:
+            if not result.fatal_message:
+                result.fatal_message = geckolog.fatal_message(match)
+        elif event == 'assertion':
+            result.add_assertion(match)
+        elif event == 'valgrind':
+            result.valgrind_text += line
+    return result
+
+class ScanLinesTest(unittest.TestCase):
+
+    def assertSameResult(self, lines):
+        expected = baseline_scan(lines)
+        actual = events_scan(lines)
+        self.assertEqual(actual.fatal_message, expected.fatal_message)
+        self.assertEqual(actual.asan_list, expected.asan_list)
+        self.assertEqual(actual.assertion_dict, expected.assertion_dict)
+        self.assertEqual(actual.valgrind_text, expected.valgrind_text)
+
+    def test_gecko_log(self):
+        self.assertSameResult(GECKO_LOG)
+
+    def test_fatal_messages(self):
+        # Start the log at each fatal message so that each is the first.
+        for i in range(len(GECKO_LOG)):
+            self.assertSameResult(GECKO_LOG[i:])
+
+    def test_later_patterns_after_fatal_message(self):
+        result = events_scan(GECKO_LOG)
+        self.assertTrue('Nested: \'y\':/src/Bar.cpp' in result.assertion_dict)
+
+    def test_abort_message(self):
+        result = events_scan(['###!!! ABORT: Aborting on channel error.: file /src/ipc/Channel.cpp, line 7\n'])
+        self.assertEqual(result.fatal_message, 'ABORT: Aborting on channel error.:')
+
+    def test_decode_line(self):
+        line = geckolog.decode_line('\xe9\xff\n')
+        self.assertTrue(isinstance(line, unicode))
+        self.assertEqual(line, u'\ufffd\ufffd\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,12 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import datetime
+import multiprocessing
 import os
 import re
 import subprocess
 import sys
+import tempfile
 import time
 
 from optparse import OptionParser
@@ -29,6 +31,8 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'sisyphus.webapp.settings'
 import django
 django.setup()
 
+from django.db import transaction
+
 sisyphus_url      = os.environ["SISYPHUS_URL"]
 post_files_url    = sisyphus_url + '/post_files/'
 
@@ -54,6 +58,13 @@ class UnitTestWorker(worker.Worker):
         self.model_test_valgrind  = models.UnitTestValgrind
         self.model_test_crash_dump_meta_data = models.UnitTestCrashDumpMetaData
 
+        # UnitTestResults are buffered and inserted in batches of up
+        # to result_batch_size rows or after result_batch_interval.
+        self.result_batch          = []
+        self.result_batch_size     = options.result_batch_size
+        self.result_batch_interval = datetime.timedelta(seconds=options.result_batch_interval)
+        self.result_batch_time     = datetime.datetime.now()
+
         self.testrun_row = None
         self.save()
 
@@ -180,8 +191,10 @@ class UnitTestWorker(worker.Worker):
 
         unittest_id = 'startup'
 
+        reader = utils.TimedLineReader(proc.stdout)
+
         try:
-            line = utils.timedReadLine(proc.stdout, self.test_timeout)
+            line = self.readTestLine(reader)
             line = utils.makeUnicodeString(line)
 
             while line:
@@ -288,7 +301,7 @@ class UnitTestWorker(worker.Worker):
                         unittest_result = unittest_result,
                         unittest_message = utils.mungeUnicodeToUtf8(unittest_message),
                         )
-                    unittestresult.save()
+                    self.queueTestResult(unittestresult)
 
                 match = reASSERTION.match(line)
                 if match:
@@ -324,7 +337,7 @@ class UnitTestWorker(worker.Worker):
                     if match:
                         self.testrun_row.fatal_message = match.group(1)
 
-                line = utils.timedReadLine(proc.stdout, self.test_timeout)
+                line = self.readTestLine(reader)
                 line = utils.makeUnicodeString(line)
 
         except KeyboardInterrupt:
@@ -335,6 +348,8 @@ class UnitTestWorker(worker.Worker):
                 self.logMessage("runTest: %s %s %s: exception %s." %
                                 (self.product, self.branch, self.testrun_row.unittestbranch.test, errorMessage))
 
+        self.flushTestResults()
+
         hung_process = False
         test_process_dict = self.psTest()
         if test_process_dict:
@@ -386,6 +401,56 @@ class UnitTestWorker(worker.Worker):
         self.process_assertions(assertion_dict, "shutdown", self.testrun_row.unittestbranch.test, extra_test_args)
         self.process_valgrind(valgrind_text, "shutdown", self.testrun_row.unittestbranch.test, extra_test_args)
 
+    def queueTestResult(self, unittestresult):
+        """
+        Buffer unittestresult and insert the buffered results if the
+        batch is full or has waited too long.
+        """
+
+        if not self.result_batch:
+            self.result_batch_time = datetime.datetime.now()
+        self.result_batch.append(unittestresult)
+        if (len(self.result_batch) >= self.result_batch_size or
+            datetime.datetime.now() - self.result_batch_time > self.result_batch_interval):
+            self.flushTestResults()
+
+    def flushTestResults(self):
+        """
+        Insert the buffered UnitTestResults in a single transaction.
+        """
+
+        if not self.result_batch:
+            return
+        result_batch = self.result_batch
+        self.result_batch = []
+        with transaction.atomic():
+            # Limit the rows per INSERT so that a large batch does not
+            # exceed the server's maximum packet size.
+            models.UnitTestResult.objects.bulk_create(result_batch, batch_size=100)
+
+    def readTestLine(self, reader):
+        """
+        Return the next line of the test output from the
+        TimedLineReader reader. The buffered results are inserted if no
+        line is available before the batch has waited
+        result_batch_interval so that a quiet test does not hold them.
+        Raise IOError('ReadLineTimeout') if no line is read within
+        test_timeout seconds.
+        """
+
+        deadline = time.time() + self.test_timeout
+        while self.result_batch:
+            batch_remaining = (self.result_batch_time + self.result_batch_interval -
+                               datetime.datetime.now()).total_seconds()
+            if batch_remaining <= 0:
+                self.flushTestResults()
+                break
+            if reader.wait(min(batch_remaining, deadline - time.time())):
+                break
+            if time.time() >= deadline:
+                break
+        return reader.readline(max(deadline - time.time(), 0))
+
     def getJob(self):
 
         """
@@ -625,6 +690,18 @@ Example:
                       help='By default only record unexpected unittest results. ' +
                       'Add --all-test-results to record all results.')
 
+    parser.add_option('--result-batch-size', action='store', type='int',
+                      dest='result_batch_size',
+                      help='Maximum number of unittest results inserted into the '
+                      'database at once. Defaults to 1000.',
+                      default=1000)
+
+    parser.add_option('--result-batch-interval', action='store', type='int',
+                      dest='result_batch_interval',
+                      help='Maximum time in seconds a unittest result is buffered '
+                      'before it is inserted into the database. Defaults to 30.',
+                      default=30)
+
     parser.add_option('--debug', action='store_true',
                       dest='debug',
                       default=False,
@@ -651,6 +728,42 @@ Example:
                       'Defaults to False.',
                        default=False)
 
+    parser.add_option('--dump-processes', action='store', type='int',
+                       dest='dump_processes',
+                       help='Maximum number of minidump_stackwalk and exploitable '
+                      'processes run at once when processing minidumps. '
+                      'Defaults to the number of cpus.',
+                       default=multiprocessing.cpu_count())
+
+    parser.add_option('--stackwalk-cache-dir', action='store', type='string',
+                       dest='stackwalk_cache_dir',
+                       help='Directory of the cache of minidump processing results. '
+                      'Defaults to sisyphus-stackwalk-cache in the temporary directory.',
+                       default=os.path.join(tempfile.gettempdir(), 'sisyphus-stackwalk-cache'))
+
+    parser.add_option('--stackwalk-cache-size', action='store', type='int',
+                       dest='stackwalk_cache_size',
+                       help='Maximum size in megabytes of the cache of minidump '
+                      'processing results. 0 disables the cache. Defaults to 512.',
+                       default=512)
+
+    parser.add_option('--machine-readable-stackwalk', action='store_true',
+                       dest='machine_readable_stackwalk',
+                       help='Run minidump_stackwalk with -m and parse its '
+                      'machine readable output. The human readable output is '
+                      'still used when exploitable is run since it needs the '
+                      'registers. '
+                      'Defaults to False.',
+                       default=False)
+
+    parser.add_option('--human-readable-crash-reports', action='store_true',
+                       dest='human_readable_crash_reports',
+                       help='When --machine-readable-stackwalk is specified, also run '
+                      'minidump_stackwalk without -m so that the human readable '
+                      'crash report is uploaded. '
+                      'Defaults to False.',
+                       default=False)
+
     (options, args) = parser.parse_args()
 
     if options.debugger_args and not options.debugger:
@@ -671,6 +784,11 @@ Example:
             raise
         except:
 
+            try:
+                this_worker.flushTestResults()
+            except:
+                pass
+
             if this_worker.testrun_row:
                 this_worker.testrun_row.state = 'waiting'
                 this_worker.testrun_row.worker = None
@@ -718,6 +836,10 @@ if __name__ == "__main__":
 
     # kill any test processes still running.
     if this_worker:
+        try:
+            this_worker.flushTestResults()
+        except:
+            pass
         this_worker.killTest()
 
     if this_worker is None:
@@ -2,12 +2,18 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import collections
 import datetime
+import distutils.spawn
+import errno
 import os
 import re
+import select
 import signal
 import subprocess
 import sys
+import threading
+import time
 import traceback
 import urllib
 import urllib2
@@ -15,6 +21,12 @@ import urlparse
 
 import taskcluster
 
+try:
+    # subprocess32 starts a new session in C between fork and exec.
+    import subprocess32
+except ImportError:
+    subprocess32 = None
+
 
 def makeUnicodeString(s):
     # http://farmdev.com/talks/unicode/
@@ -90,30 +102,247 @@ def convertReturnCodeToExitStatusMessage(rc):
 
     return exitstatusmessage.strip()
 
-def timedReadLine_handler(signum, frame):
-    print 'timedReadLine timeout'
-    raise IOError('ReadLineTimeout')
+class TimedLineReader(object):
+    """
+    Read lines from the pipe filehandle. The pipe is read in chunks of
+    up to chunksize bytes when select reports it is readable and the
+    chunks are split into lines. Signals are not used so a
+    TimedLineReader may be used from any thread. filehandle must not
+    be read other than by the TimedLineReader.
+    """
+
+    def __init__(self, filehandle, chunksize=65536):
+        self.fd        = filehandle.fileno()
+        self.chunksize = chunksize
+        self.lines     = collections.deque()
+        # The chunks read since the last newline. They are only joined
+        # once the line is complete so that a long line is not copied
+        # for every chunk.
+        self.partial   = []
+        self.eof       = False
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for a line or the end of the file.
+        Return True if readline will return without waiting, otherwise
+        False.
+        """
+
+        deadline = time.time() + timeout
+        while not self.lines and not self.eof:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                (readable, writable, errors) = select.select([self.fd], [], [], remaining)
+                if not readable:
+                    continue
+                chunk = os.read(self.fd, self.chunksize)
+            except (select.error, OSError), e:
+                # Retry with the remaining time if a signal interrupted
+                # the call.
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not chunk:
+                self.eof = True
+                if self.partial:
+                    self.lines.append(''.join(self.partial))
+                    self.partial = []
+                break
+            self.partial.append(chunk)
+            if '\n' not in chunk:
+                continue
+            chunklines = ''.join(self.partial).split('\n')
+            last = chunklines.pop()
+            self.partial = [last] if last else []
+            self.lines.extend([chunkline + '\n' for chunkline in chunklines])
+        return True
+
+    def readline(self, timeout = None):
+        """
+        Return the next line or '' at the end of the file. If a line
+        is not available within timeout seconds, raise
+        IOError('ReadLineTimeout')
+        """
+
+        if timeout is None:
+            timeout = 300
+
+        if not self.wait(timeout):
+            raise IOError('ReadLineTimeout')
+        if self.lines:
+            return self.lines.popleft()
+        return ''
+
+class TimedCommandResult(object):
+
+    def __init__(self, pid, returncode, elapsedtime, timedout, stdout, stderr,
+                 outputsize=None, oversize=False, stopped=False):
+        self.pid         = pid
+        self.returncode  = returncode
+        self.elapsedtime = elapsedtime
+        self.timedout    = timedout
+        self.stdout      = stdout
+        self.stderr      = stderr
+        self.outputsize  = outputsize
+        self.oversize    = oversize
+        self.stopped     = stopped
+
+    def exitStatusMessage(self):
+        """
+        Return the exit status in the form reported by timed_run.py.
+        """
+
+        if self.timedout:
+            return "TIMED OUT (%s seconds)" % self.elapsedtime
+
+        if self.stopped:
+            return "STOPPED (%f seconds)" % self.elapsedtime
+
+        if self.returncode < 0:
+            signum = -self.returncode
+            if signum == signal.SIGINT:
+                msg = 'INTERRUPT'
+            else:
+                msg = 'CRASHED'
+            return "%s signal %d %s (%f seconds)" % (msg, signum, getSignalName(signum), self.elapsedtime)
+
+        if self.returncode == 0:
+            msg = 'NORMAL'
+        else:
+            msg = 'ABNORMAL ' + str(self.returncode)
+        return "%s (%f seconds)" % (msg, self.elapsedtime)
+
+# setsid(1) runs a command in a new session. The child started by Popen
+# is not a process group leader so setsid execs the command in place
+# and the command keeps the child's pid.
+SETSID = distutils.spawn.find_executable('setsid')
 
-def timedReadLine(filehandle, timeout = None):
+def popenProcessGroup(args, **kwargs):
     """
-    Attempt to readline from filehandle. If readline does not return
-    within timeout seconds, raise IOError('ReadLineTimeout')
+    Return a Popen of args in a new process group whose id is the pid
+    of the Popen. A preexec_fn is only used when neither subprocess32
+    nor setsid is available since running Python code between fork
+    and exec can deadlock when other threads hold locks.
     """
 
-    if timeout is None:
-        timeout = 300
+    if subprocess32:
+        return subprocess32.Popen(args, start_new_session=True, **kwargs)
+    if SETSID:
+        return subprocess.Popen([SETSID] + list(args), **kwargs)
+    return subprocess.Popen(args,
+                            preexec_fn=lambda : os.setpgid(0,0), # make the process its own process group
+                            **kwargs)
 
-    default_alarm_handler = signal.getsignal(signal.SIGALRM)
-    signal.signal(signal.SIGALRM, timedReadLine_handler)
-    signal.alarm(timeout)
+def runTimedCommand(args, timeout, env=None, stderr=subprocess.PIPE,
+                    outputfile=None, maxsize=None, tailsize=65536, stopevent=None):
+    """
+    Run args in its own process group and kill the whole process
+    group if it has not exited within timeout seconds. Return a
+    TimedCommandResult. The exit status line which timed_run.py used
+    to print is appended to stdout so that logs of the output are
+    unchanged. Pass stderr=subprocess.STDOUT to combine the output.
+
+    If outputfile is specified, stdout is written to it as it is read
+    and only the last tailsize bytes are kept in the result. The
+    process group is killed if the output exceeds maxsize bytes.
+    stderr must not be subprocess.PIPE when streaming.
+
+    If stopevent is specified, the process group is also killed when
+    the threading.Event is set.
+
+    The timeout is enforced by a timer thread rather than SIGALRM so
+    runTimedCommand may be called from any thread.
+    """
 
+    if outputfile and stderr == subprocess.PIPE:
+        raise ValueError('runTimedCommand: stderr can not be a pipe when streaming to outputfile')
+
+    starttime = time.time()
+    proc = popenProcessGroup(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        close_fds=True,
+        env=env)
+
+    timedout = threading.Event()
+
+    def timeout_handler():
+        timedout.set()
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            # The process group has already exited.
+            pass
+
+    timer = threading.Timer(timeout, timeout_handler)
+    timer.daemon = True
+    timer.start()
+
+    finished = threading.Event()
+    stopped = threading.Event()
+
+    def stop_handler():
+        while not finished.is_set():
+            if stopevent.wait(1):
+                if not finished.is_set():
+                    stopped.set()
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                return
+
+    if stopevent:
+        stop_thread = threading.Thread(target=stop_handler)
+        stop_thread.daemon = True
+        stop_thread.start()
+    outputsize = None
+    oversize = False
     try:
-        line = filehandle.readline()
+        if not outputfile:
+            stdout, stderr = proc.communicate()
+        else:
+            tail = collections.deque()
+            tailbytes = 0
+            outputsize = 0
+            for chunk in iter(lambda: os.read(proc.stdout.fileno(), 65536), ''):
+                outputfile.write(chunk)
+                outputsize += len(chunk)
+                tail.append(chunk)
+                tailbytes += len(chunk)
+                while tailbytes - len(tail[0]) >= tailsize:
+                    tailbytes -= len(tail.popleft())
+                if maxsize and outputsize > maxsize and not oversize:
+                    oversize = True
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+            proc.stdout.close()
+            proc.wait()
+            stdout = ''.join(tail)
+            stderr = None
+            if outputsize > tailbytes:
+                # Start the tail at a complete line.
+                stdout = stdout[stdout.find('\n') + 1:]
+    except:
+        # Do not leave the command running if we are interrupted.
+        timeout_handler()
+        raise
     finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, default_alarm_handler)
-
-    return line
+        timer.cancel()
+        finished.set()
+
+    result = TimedCommandResult(proc.pid, proc.returncode, time.time() - starttime, timedout.is_set(),
+                                stdout, stderr, outputsize, oversize, stopped.is_set())
+    exitstatus = "\n EXIT STATUS: %s\n" % result.exitStatusMessage()
+    result.stdout += exitstatus
+    if outputfile:
+        outputfile.write(exitstatus)
+    return result
 
 def encodeUrl(url):
     # encode the url.
@@ -5,6 +5,8 @@
 import datetime
 import glob
 import httplib
+import multiprocessing
+import multiprocessing.pool
 import os
 import platform
 import random
@@ -13,6 +15,7 @@ import sets
 import signal
 import subprocess
 import sys
+import tempfile
 import time
 import urllib2
 import urlparse
@@ -33,6 +36,10 @@ tempdir          = os.path.join(tempdir, 'webapp')
 if tempdir not in sys.path:
     sys.path.append(tempdir)
 
+tempdir = "%s/bin" % sisyphus_dir
+if tempdir not in sys.path:
+    sys.path.append(tempdir)
+
 os.environ['DJANGO_SETTINGS_MODULE'] = 'sisyphus.webapp.settings'
 
 import sisyphus.webapp.settings
@@ -41,9 +48,39 @@ post_files_url    = sisyphus_url + '/post_files/'
 
 from sisyphus.webapp.bughunter import models
 
-from sisyphus.automation import utils, program_info, crashreports
+from sisyphus.automation import utils, program_info, crashreports, stackwalkcache
 import sisyphus.automation.bugzilla
 
+import fix_stack_using_bpsyms
+
+def run_timed_tool(command):
+    """
+    Run command with a timeout since the crash tools can hang and
+    return (stdout, stderr, returncode). This does not use the database
+    so that it can be run in a pool thread.
+    """
+
+    result = utils.runTimedCommand(command, 300)
+    return (result.stdout, result.stderr, result.returncode)
+
+class CachedToolResult(object):
+    """
+    Stands in for the AsyncResult of a tool whose output was found in
+    the stackwalk cache.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self):
+        return self.value
+
 class Worker(object):
 
     def __init__(self, worker_type, options):
@@ -67,6 +104,27 @@ class Worker(object):
         except AttributeError:
             self.isBuilder = False
 
+        try:
+            self.dump_processes = options.dump_processes
+        except AttributeError:
+            self.dump_processes = multiprocessing.cpu_count()
+
+        try:
+            if options.stackwalk_cache_size > 0:
+                self.stackwalk_cache = stackwalkcache.StackwalkCache(options.stackwalk_cache_dir,
+                                                                     options.stackwalk_cache_size * 1024 * 1024)
+            else:
+                self.stackwalk_cache = None
+        except AttributeError:
+            self.stackwalk_cache = None
+
+        try:
+            self.machine_readable_stackwalk = options.machine_readable_stackwalk
+            self.human_readable_crash_reports = options.human_readable_crash_reports
+        except AttributeError:
+            self.machine_readable_stackwalk = False
+            self.human_readable_crash_reports = False
+
         # Adjust the time before a worker is considered a zombie
         # to 3 hours for a builder to account for possible long build
         # times and to 30 minutes for non builders. Note this
@@ -677,6 +735,138 @@ class Worker(object):
             uploader.send()
 
 
+    def stackwalk_command(self, stackwalkPath, dumpFile, symbolsPathList, machine_readable):
+        """
+        stackwalk_command returns the minidump_stackwalk command for
+        dumpFile. If machine_readable is True, minidump_stackwalk is run
+        with -m to produce the pipe delimited output.
+        """
+
+        command = [stackwalkPath]
+        if machine_readable:
+            command.append("-m")
+        command.append(dumpFile)
+        command.extend(symbolsPathList)
+        return command
+
+    def machine_readable_dumps(self, exploitablePath):
+        """
+        machine_readable_dumps returns True if the dumps are parsed from
+        the machine readable output of minidump_stackwalk. That output
+        has no registers, which the exploitability check in
+        process_dump_files uses, so the human readable output is used
+        when exploitable is run.
+        """
+
+        return self.machine_readable_stackwalk and not exploitablePath
+
+    def dump_tool_names(self, exploitablePath):
+        tool_names = ['stackwalk']
+        if self.machine_readable_dumps(exploitablePath) and self.human_readable_crash_reports:
+            tool_names.append('human_stackwalk')
+        if exploitablePath:
+            tool_names.append('exploitable')
+        return tool_names
+
+    def get_cached_dump_results(self, dumpFiles, exploitablePath, symbolsPathList):
+        """
+        get_cached_dump_results looks up each dump in the stackwalk cache
+        and returns the dictionaries dumpFile -> cache key and
+        dumpFile -> cached entry for the dumps whose entries contain the
+        output of every tool to be run.
+        """
+
+        cache_keys = {}
+        cached_entries = {}
+        if not self.stackwalk_cache:
+            return (cache_keys, cached_entries)
+
+        tool_names = self.dump_tool_names(exploitablePath)
+        mode = '%s-%d' % ('machine' if self.machine_readable_dumps(exploitablePath) else 'human',
+                          crashreports.CRASH_DATA_VERSION)
+        for dumpFile in dumpFiles:
+            try:
+                key = self.stackwalk_cache.key(dumpFile, symbolsPathList, self.build_id, mode)
+                cache_keys[dumpFile] = key
+                entry = self.stackwalk_cache.get(key)
+                if entry and not [name for name in tool_names if name not in entry['tools']]:
+                    self.debugMessage('process_dump_files: using cached results for %s' % dumpFile)
+                    cached_entries[dumpFile] = entry
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                exceptionType, exceptionValue, errorMessage = utils.formatException()
+                self.logMessage('process_dump_files: exception reading stackwalk cache: %s, %s, %s' % (dumpFile,
+                                                                                                   exceptionValue,
+                                                                                                   errorMessage))
+        return (cache_keys, cached_entries)
+
+    def save_cached_dump_results(self, key, results, crash_data):
+        """
+        save_cached_dump_results stores the tool output and crash_data
+        of a dump in the stackwalk cache unless a tool failed.
+        """
+
+        try:
+            tools = {}
+            for name, result in results.items():
+                tools[name] = list(result.get())
+            if tools['stackwalk'][2] != 0:
+                return
+            self.stackwalk_cache.put(key, {'tools': tools, 'crash_data': crash_data})
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            exceptionType, exceptionValue, errorMessage = utils.formatException()
+            self.logMessage('process_dump_files: exception writing stackwalk cache: %s, %s' % (exceptionValue,
+                                                                                              errorMessage))
+
+    def run_dump_tools(self, dumpFiles, stackwalkPath, exploitablePath, symbolsPathList, cached_entries):
+        """
+        run_dump_tools runs minidump_stackwalk and exploitable for every
+        dump concurrently using at most self.dump_processes processes
+        and returns a dictionary of dumpFile -> dictionary of tool name
+        -> AsyncResult for (stdout, stderr, returncode). The tools are
+        not run for the dumps in cached_entries.
+        """
+
+        tool_results = {}
+        for dumpFile in cached_entries:
+            tool_results[dumpFile] = dict([(name, CachedToolResult(tuple(cached_entries[dumpFile]['tools'][name])))
+                                           for name in self.dump_tool_names(exploitablePath)])
+
+        dumpFiles = [dumpFile for dumpFile in dumpFiles if dumpFile not in cached_entries]
+        if not dumpFiles:
+            return tool_results
+
+        pool = multiprocessing.pool.ThreadPool(min(self.dump_processes, len(dumpFiles)))
+        try:
+            for dumpFile in dumpFiles:
+                results = tool_results[dumpFile] = {}
+                results['stackwalk'] = pool.apply_async(
+                    run_timed_tool,
+                    (self.stackwalk_command(stackwalkPath, dumpFile, symbolsPathList,
+                                            self.machine_readable_dumps(exploitablePath)),))
+                if self.machine_readable_dumps(exploitablePath) and self.human_readable_crash_reports:
+                    results['human_stackwalk'] = pool.apply_async(
+                        run_timed_tool,
+                        (self.stackwalk_command(stackwalkPath, dumpFile, symbolsPathList, False),))
+                if exploitablePath:
+                    results['exploitable'] = pool.apply_async(run_timed_tool, ([exploitablePath, dumpFile],))
+            pool.close()
+            # Wait for the tools to finish so that no threads remain once
+            # the results are used. Wait with a timeout so that signals
+            # are still delivered to this thread.
+            for results in tool_results.values():
+                for result in results.values():
+                    while not result.ready():
+                        result.wait(1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return tool_results
+
     def process_dump_files(self, minidumps_dir, page, symbolsPathList, uploadpath):
         """
         process_dump_files looks for any minidumps that may have been written, parses them,
@@ -701,6 +891,17 @@ class Worker(object):
         if len(dumpFiles) > 0:
             self.debugMessage("process_dump_files: %s: %d dumpfiles found in %s" % (page, len(dumpFiles), minidumps_dir))
 
+        # Run the tools for every dump at once. Only the database and
+        # upload work below is done one dump at a time.
+        if exploitablePath and self.testrun_row.fatal_message:
+            exploitablePath = None
+        if self.machine_readable_stackwalk and exploitablePath and dumpFiles:
+            self.debugMessage('process_dump_files: using the human readable minidump_stackwalk output '
+                              'since the machine readable output has no registers for exploitable')
+        (cache_keys, cached_entries) = self.get_cached_dump_results(dumpFiles, exploitablePath, symbolsPathList)
+        tool_results = self.run_dump_tools(dumpFiles, stackwalkPath, exploitablePath, symbolsPathList,
+                                           cached_entries)
+
         icrashreport = 0
 
         all_crash_reports = ''
@@ -737,32 +938,25 @@ class Worker(object):
                 except:
                     pass
 
-            # use timed_run.py to run stackwalker since it can hang.
+            crash_report = ''
             try:
-                arglist = [
-                    "python",
-                    sisyphus_dir + "/bin/timed_run.py",
-                    "300",
-                    "-",
-                    stackwalkPath,
-                    dumpFile,
-                    ]
-                arglist.extend(symbolsPathList)
-
-                proc = subprocess.Popen(
-                    arglist,
-                    preexec_fn=lambda : os.setpgid(0,0), # make the process its own process group
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    close_fds=True)
-                crash_report, stderr = proc.communicate()
+                crash_report, stderr, returncode = tool_results[dumpFile]['stackwalk'].get()
                 all_crash_reports += '\n\n==== Crash Report ====\n\n' + crash_report
                 self.debugMessage("stackwalking: stdout: %s" % (crash_report))
-                if proc.returncode != 0:
+                if returncode != 0:
                     self.debugMessage("stackwalking: stderr: %s" % (stderr))
 
+                # The machine readable report is uploaded unless the
+                # human readable report was requested.
+                if 'human_stackwalk' in tool_results[dumpFile]:
+                    upload_report, stderr, returncode = tool_results[dumpFile]['human_stackwalk'].get()
+                    if returncode != 0:
+                        self.debugMessage("stackwalking: stderr: %s" % (stderr))
+                else:
+                    upload_report = crash_report
+
                 filehandle = open(crashReportFile, 'wb+')
-                filehandle.write(crash_report)
+                filehandle.write(upload_report)
                 filehandle.close()
                 # if the extra data fingers the plugin file but it doesn't
                 # specify the plugin version, grep it from the crash report
@@ -770,7 +964,11 @@ class Worker(object):
                     'PluginVersion' in extradict and
                     extradict['PluginFilename'] and
                     not extradict['PluginVersion']):
-                    rePluginVersion = re.compile(r'0x[0-9a-z]+ \- 0x[0-9a-z]+  %s  (.*)' % extradict['PluginFilename'])
+                    if self.machine_readable_dumps(exploitablePath):
+                        rePluginVersion = re.compile(r'^Module\|%s\|([^|]*)\|' % re.escape(extradict['PluginFilename']),
+                                                     re.MULTILINE)
+                    else:
+                        rePluginVersion = re.compile(r'0x[0-9a-z]+ \- 0x[0-9a-z]+  %s  (.*)' % extradict['PluginFilename'])
 
                     match = re.search(rePluginVersion, crash_report)
                     if match:
@@ -784,22 +982,9 @@ class Worker(object):
                                                                                                             exceptionValue,
                                                                                                             errorMessage))
             exploitability = None
-            if exploitablePath and not self.testrun_row.fatal_message:
+            if exploitablePath:
                 try:
-                    proc = subprocess.Popen(
-                        [
-                            "python",
-                            sisyphus_dir + "/bin/timed_run.py",
-                            "300",
-                            "-",
-                            exploitablePath,
-                            dumpFile,
-                            ],
-                        preexec_fn=lambda : os.setpgid(0,0), # make the process its own process group
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        close_fds=True)
-                    exploitable_report, stderr = proc.communicate()
+                    exploitable_report, stderr, returncode = tool_results[dumpFile]['exploitable'].get()
                     self.debugMessage("exploitable: stdout: %s" % (exploitable_report))
                     self.debugMessage("exploitable: stderr: %s" % (stderr))
 
@@ -822,7 +1007,15 @@ class Worker(object):
 
             self.testrun_row.crashed = True
 
-            crash_data = crashreports.parse_crashreport(crash_report)
+            if dumpFile in cached_entries:
+                crash_data = cached_entries[dumpFile]['crash_data']
+            else:
+                if self.machine_readable_dumps(exploitablePath):
+                    crash_data = crashreports.parse_machine_crashreport(crash_report)
+                else:
+                    crash_data = crashreports.parse_crashreport(crash_report)
+                if dumpFile in cache_keys:
+                    self.save_cached_dump_results(cache_keys[dumpFile], tool_results[dumpFile], crash_data)
 
             # Augment the exploitable tool by attempting to use the
             # crash address and registers of the crashing frame to
@@ -891,9 +1084,7 @@ class Worker(object):
                         elif exploitability != 'high':
                             exploitability = 'medium'
 
-            # replace each pure address frame by 0x to prevent random pure addresses from
-            # polluting the signature and preventing matches.
-            crashsignature = ' '.join([re.sub('@0x[0-9a-fA-F]+', '', sig.rstrip()) for sig in crash_data["signature_list"]])
+            crashsignature = crashreports.generateCrashSignature(crash_data["signature_list"])
 
             self.debugMessage('process_dump_files: signature: %s, exploitability: %s' % (crashsignature, exploitability))
 
@@ -1063,6 +1254,13 @@ class Worker(object):
 
         self.logMessage("begin installing %s %s %s" % (self.product, self.branch, self.buildtype))
 
+        # Drop the symbols cached for the previous build. build_id
+        # names the product, branch and platform rather than the build,
+        # so the build date and changeset identify this build.
+        fix_stack_using_bpsyms.symbolCache.reset('%s_%s_%s' % (self.build_row.build_id,
+                                                               self.build_row.builddate,
+                                                               self.build_row.changeset))
+
         # clobber old build to make sure we don't mix builds.
         # note clobber essentially rm's the objdir.
         if not self.clobberProduct():
@@ -1166,6 +1364,21 @@ class Worker(object):
                                 (self.product, self.branch, self.buildtype, stdout))
                 return False
 
+            # Compile the symbol files into binary indexes once per
+            # build so that fix_stack_using_bpsyms can map them rather
+            # than reparse the text symbols for every test.
+            try:
+                starttime = time.time()
+                count = fix_stack_using_bpsyms.compileSymbolsDir(objdir + '/dist/crashreporter-symbols')
+                self.debugMessage('installBuild: compiled %d symbol indexes in %.1f seconds' %
+                                  (count, time.time() - starttime))
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                exceptionType, exceptionValue, errorMessage = utils.formatException()
+                self.logMessage('installBuild: exception compiling symbol indexes: %s, %s' %
+                                (exceptionValue, errorMessage))
+
         self.logMessage("success installing %s %s %s" % (self.product, self.branch, self.buildtype))
 
         self.build_date = self.build_row.builddate
@@ -1933,10 +2146,13 @@ class Worker(object):
             self.logMessage('publishNewBuild: finishing build document %s %s %s: %s' %
                             (self.product, self.branch, self.buildtype, errorMessage))
 
-    def psTest(self):
+    def psTest(self, scope = None):
         # ps test processes
         process_dict = {}
 
+        if scope is not None:
+            return self.psTestScope(scope)
+
         if self.os_name != "Windows NT":
             pattern = r' *([0-9]+)\s+.*((/work)?/mozilla/builds/[^/]+/mozilla/' + self.product + '-' + self.buildtype + '|totem-plugin-viewer|gst-install-plugins-helper)'
             ps_args = ['ps', '-e', '-x']
@@ -1965,7 +2181,50 @@ class Worker(object):
 
         return process_dict
 
-    def killTest(self, test_pid = None):
+    def psTestScope(self, scope):
+        """
+        Return the processes whose command line contains scope, such
+        as the profile directory of a test slot, and their descendants
+        so that the test processes of other slots on the host are left
+        alone. Not supported on Windows.
+        """
+
+        ps_proc = subprocess.Popen(['ps', '-e', '-o', 'pid=', '-o', 'ppid=', '-o', 'args='],
+                                   preexec_fn=lambda : os.setpgid(0,0), # make the process its own process group
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = ps_proc.communicate()
+
+        ps_dict = {}
+        parent_dict = {}
+        children_dict = {}
+        for ps_line in stdout.split('\n'):
+            ps_fields = ps_line.split(None, 2)
+            if len(ps_fields) < 3 or int(ps_fields[0]) == ps_proc.pid:
+                continue
+            (pid, ppid, command) = ps_fields
+            ps_dict[pid] = ps_line
+            parent_dict[pid] = ppid
+            children_dict.setdefault(ppid, []).append(pid)
+
+        # Never match this worker or its ancestors.
+        ancestors = set()
+        pid = str(os.getpid())
+        while pid in parent_dict and pid not in ancestors:
+            ancestors.add(pid)
+            pid = parent_dict[pid]
+
+        process_dict = {}
+        pids = [pid for pid in ps_dict if scope in ps_dict[pid] and pid not in ancestors]
+        while pids:
+            pid = pids.pop()
+            if pid not in process_dict:
+                process_dict[pid] = ps_dict[pid]
+                pids.extend(children_dict.get(pid, []))
+
+        return process_dict
+
+    def killTest(self, test_pid = None, scope = None):
         # os.kill fails to kill the entire test process and children when
         # a test times out. This is most noticible on Windows but can occur on
         # Linux as well. To kill the test reliably, use the external kill program
@@ -1983,22 +2242,28 @@ class Worker(object):
         # can hang, thus preventing the worker from completing the kill
         # task.
 
-        if self.os_name == "Windows NT":
+        # When scope is specified, only the processes found by
+        # psTest(scope) are killed.
+
+        if scope is not None:
+            kill_args = None
+        elif self.os_name == "Windows NT":
             # Will kill any firefox process.
             kill_args = ["taskkill", "/f", "/t", "/im", "firefox.exe"]
         else:
             # Will only kill firefox processes from custom builds.
             kill_args = ["pkill", "-9", "-f", "dist/bin/firefox"]
 
-        self.logMessage("killTest: %s" % kill_args)
-        try:
-            subprocess.call(kill_args)
-        except Exception:
-            (etype, evalue, etraceback) = utils.formatException()
-            self.debugMessage("killTest: %s" % etraceback)
+        if kill_args:
+            self.logMessage("killTest: %s" % kill_args)
+            try:
+                subprocess.call(kill_args)
+            except Exception:
+                (etype, evalue, etraceback) = utils.formatException()
+                self.debugMessage("killTest: %s" % etraceback)
 
 
-        process_dict = self.psTest()
+        process_dict = self.psTest(scope)
         pids = [pid for pid in process_dict]
         if len(pids) > 0:
             for attempt in range(4):
@@ -2025,7 +2290,7 @@ class Worker(object):
                 except KeyboardInterrupt:
                     pass
 
-                process_dict = self.psTest()
+                process_dict = self.psTest(scope)
                 pids = [pid for pid in process_dict]
 
                 if len(pids) == 0:
@@ -2081,7 +2346,7 @@ class Worker(object):
                     self.logMessage('killTest: os.killpg: %s: %s, %s' % (exceptionType,
                                                                          exceptionValue,
                                                                          errorMessage))
-        process_dict = self.psTest()
+        process_dict = self.psTest(scope)
         pids = [pid for pid in process_dict]
 
         if len(pids) > 0:
@@ -0,0 +1,254 @@
+import gzip
+import multiprocessing
+import signal
+import time
+
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from sisyphus.automation import crashreports
+from sisyphus.webapp.bughunter import models
+
+# The fields which, together with the signature, identify a Crash row.
+CRASH_HEADER_FIELDS = ('os_name', 'os_version', 'cpu_name', 'build_cpu_name',
+                       'product', 'branch', 'buildtype')
+
+TEST_CRASH_MODELS = {
+    'site': models.SiteTestCrash,
+    'unit': models.UnitTestCrash,
+    }
+
+
+def init_resign_process():
+    # Let the parent handle KeyboardInterrupt and terminate the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def resign_crashreport(job):
+    """
+    Parse the stored crash report for a test crash and return a tuple
+    (model_key, testcrash_id, crash_id, signature, error).
+    """
+
+    (model_key, testcrash_id, crash_id, crashreport_path) = job
+
+    try:
+        if crashreport_path.endswith('.gz'):
+            crashreport_file = gzip.open(crashreport_path, 'rb')
+        else:
+            crashreport_file = open(crashreport_path, 'rb')
+        try:
+            crash_data = crashreports.parse_stackwalk_output(crashreport_file)
+        finally:
+            crashreport_file.close()
+        signature = crashreports.generateCrashSignature(crash_data['signature_list'])
+        return (model_key, testcrash_id, crash_id, signature, None)
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception, e:
+        return (model_key, testcrash_id, crash_id, None, '%s: %s' % (crashreport_path, e))
+
+
+class Command(BaseCommand):
+
+    help = ('Regenerates the signatures of stored site and unit test crash '
+            'reports using the current rules in crashreports.py and remaps '
+            'the test crashes to the matching Crash rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tests', choices=['site', 'unit', 'all'],
+                            default='all',
+                            help='Reprocess site test crashes, unit test crashes or both. '
+                            'Defaults to all.')
+        parser.add_argument('--processes', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of processes used to parse crash reports. '
+                            'Defaults to the number of cpus.')
+        parser.add_argument('--batch-size', type=int,
+                            default=5000,
+                            help='Number of test crashes updated per transaction. '
+                            'Defaults to 5000.')
+        parser.add_argument('--delete-orphans', action='store_true',
+                            default=False,
+                            help='Delete Crash rows which no longer have any test '
+                            'crashes and have no bugs after remapping.')
+        parser.add_argument('--dry-run', action='store_true',
+                            default=False,
+                            help='Report the signature changes without updating the database.')
+
+    def handle(self, *args, **options):
+
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        if options['tests'] == 'all':
+            self.model_keys = ['site', 'unit']
+        else:
+            self.model_keys = [options['tests']]
+
+        # crash_id -> (header, signature) of Crash rows seen so far.
+        self.crashes = {}
+        # header + (signature,) -> crash_id of Crash rows seen so far.
+        self.crash_ids = {}
+        # ids of Crash rows which lost test crashes during remapping.
+        self.abandoned_crash_ids = set()
+
+        self.processed = 0
+        self.changed = 0
+        self.errors = 0
+
+        total = 0
+        for model_key in self.model_keys:
+            total += self.get_testcrash_rows(model_key).count()
+
+        self.stdout.write('resign_crashes: %d crash reports, %d processes%s' % (
+            total, options['processes'], ', dry run' if self.dry_run else ''))
+
+        # Do not share the database connection with the forked processes.
+        connection.close()
+        pool = multiprocessing.Pool(options['processes'], init_resign_process)
+
+        starttime = time.time()
+        results = []
+        try:
+            for result in pool.imap_unordered(resign_crashreport, self.get_jobs(), 64):
+                results.append(result)
+                if len(results) >= self.batch_size:
+                    self.apply_results(results)
+                    results = []
+                    self.report_progress(total, starttime)
+            self.apply_results(results)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        self.report_progress(total, starttime)
+
+        if options['delete_orphans'] and not self.dry_run:
+            self.delete_orphans()
+
+    def get_testcrash_rows(self, model_key):
+        # Asan crash reports are not minidump_stackwalk output.
+        return (TEST_CRASH_MODELS[model_key].objects.
+                filter(crashreport__isnull=False).
+                exclude(crashreport='').
+                exclude(crashtype='asan'))
+
+    def get_jobs(self):
+        """
+        Generate the (model_key, testcrash_id, crash_id, crashreport)
+        jobs in primary key order a chunk at a time so that the rows
+        are not all held in memory.
+        """
+
+        for model_key in self.model_keys:
+            last_id = 0
+            while True:
+                rows = list(self.get_testcrash_rows(model_key).
+                            filter(pk__gt=last_id).
+                            order_by('pk').
+                            values_list('id', 'crash_id', 'crashreport')[:self.batch_size])
+                if not rows:
+                    break
+                for (testcrash_id, crash_id, crashreport) in rows:
+                    yield (model_key, testcrash_id, crash_id, crashreport)
+                last_id = rows[-1][0]
+
+    def load_crashes(self, crash_ids):
+        crash_ids = [crash_id for crash_id in crash_ids if crash_id not in self.crashes]
+        fields = ('id', 'signature') + CRASH_HEADER_FIELDS
+        for start in range(0, len(crash_ids), 1000):
+            for crash in models.Crash.objects.filter(pk__in=crash_ids[start:start + 1000]).values(*fields):
+                header = tuple([crash[field] for field in CRASH_HEADER_FIELDS])
+                self.crashes[crash['id']] = (header, crash['signature'])
+                self.crash_ids.setdefault(header + (crash['signature'],), crash['id'])
+
+    def get_crash_id(self, header, signature):
+        """
+        Return the id of the Crash row for the header and signature,
+        creating the row if it does not exist.
+        """
+
+        key = header + (signature,)
+        if key in self.crash_ids:
+            return self.crash_ids[key]
+
+        criteria = dict(zip(CRASH_HEADER_FIELDS, header))
+        crash_ids = list(models.Crash.objects.filter(signature=signature, **criteria).
+                         values_list('id', flat=True)[:1])
+        if crash_ids:
+            crash_id = crash_ids[0]
+        else:
+            crash_row = models.Crash(signature=signature, **criteria)
+            crash_row.save()
+            crash_id = crash_row.id
+            self.crashes[crash_id] = (header, signature)
+
+        self.crash_ids[key] = crash_id
+        return crash_id
+
+    def apply_results(self, results):
+        if not results:
+            return
+
+        self.load_crashes(set([result[2] for result in results]))
+
+        # (model_key, crash_id) -> ids of the test crashes to be moved to crash_id
+        remap = defaultdict(list)
+
+        with transaction.atomic():
+            for (model_key, testcrash_id, crash_id, signature, error) in results:
+                self.processed += 1
+                if error:
+                    self.errors += 1
+                    self.stderr.write('resign_crashes: %s' % error)
+                    continue
+
+                (header, old_signature) = self.crashes[crash_id]
+                if signature == old_signature:
+                    continue
+
+                self.changed += 1
+                if self.dry_run:
+                    continue
+
+                remap[(model_key, self.get_crash_id(header, signature))].append(testcrash_id)
+                self.abandoned_crash_ids.add(crash_id)
+
+            for (model_key, crash_id), testcrash_ids in remap.iteritems():
+                TEST_CRASH_MODELS[model_key].objects.filter(pk__in=testcrash_ids).update(crash=crash_id)
+
+    def delete_orphans(self):
+        crash_ids = list(self.abandoned_crash_ids)
+        deleted = 0
+        for start in range(0, len(crash_ids), 1000):
+            with transaction.atomic():
+                orphans = (models.Crash.objects.
+                           filter(pk__in=crash_ids[start:start + 1000],
+                                  sitetestcrash__isnull=True,
+                                  unittestcrash__isnull=True).
+                           exclude(bugs__gt=''))
+                orphan_ids = list(orphans.values_list('id', flat=True))
+                models.Crash.objects.filter(pk__in=orphan_ids).delete()
+                deleted += len(orphan_ids)
+        self.stdout.write('resign_crashes: deleted %d orphaned crashes' % deleted)
+
+    def report_progress(self, total, starttime):
+        elapsed = time.time() - starttime
+        if elapsed > 0:
+            rate = self.processed / elapsed
+        else:
+            rate = 0
+        self.stdout.write('resign_crashes: %d/%d processed, %d changed, %d errors, '
+                          '%.1f seconds, %.1f reports/second' % (
+                              self.processed, total, self.changed, self.errors, elapsed, rate))